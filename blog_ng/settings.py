@@ -46,6 +46,13 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # First, so its timings cover page cache hits too
+    'blogengine.instrumentation.InstrumentationMiddleware',
+    # The page cache answers anonymous reads before any session or auth
+    # work, and stores pages already compressed
+    'blogengine.middleware.UpdateCacheMiddleware',
+    'blogengine.middleware.GZipMiddleware',
+    'blogengine.middleware.FetchFromCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -53,8 +60,6 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
 )
 
 ROOT_URLCONF = 'blog_ng.urls'
@@ -117,6 +122,25 @@ ALLOWED_HOSTS = ['*']
 # Static asset configuration
 STATIC_ROOT = 'staticfiles'
 
+# Fingerprint the collected files, build the bundles linked with the
+# bundle template tag and gzip them; served by blogengine.assets.Cling
+STATICFILES_STORAGE = 'blogengine.assets.BundlingStaticFilesStorage'
+
+BLOGENGINE_STATIC_BUNDLES = {
+    'bundles/site.css': [
+        'bower_components/html5-boilerplate/css/normalize.css',
+        'bower_components/html5-boilerplate/css/main.css',
+        'bower_components/bootstrap/dist/css/bootstrap.min.css',
+        'bower_components/bootstrap/dist/css/bootstrap-theme.min.css',
+        'css/main.css',
+        'css/code.css',
+    ],
+    'bundles/site.js': [
+        'bower_components/html5-boilerplate/js/plugins.js',
+        'bower_components/bootstrap/dist/js/bootstrap.min.js',
+    ],
+}
+
 STATICFILES_DIRS = (
     os.path.join(BASE_DIR, 'static'),
 )
@@ -140,16 +164,29 @@ def get_cache():
         os.environ['MEMCACHE_PASSWORD'] = os.environ['MEMCACHE_PASSWORD']
         return {
             'default': {
-                'BACKEND': 'django_pylibmc.memcached.PyLibMCCache',
+                # PyLibMCCache with a near cache of the hot keys in each
+                # process, see blogengine/cache.py
+                'BACKEND': 'blogengine.cache.NearPyLibMCCache',
                 'TIMEOUT': 300,
                 'BINARY': True,
-                'OPTIONS': {'tcp_nodelay': True}
+                # Ketama consistent hashing, so adding a server only moves
+                # its share of the keys. MEMCACHE_SERVERS may give weights
+                # as host:port:weight; run warm_cache_servers before
+                # changing the list.
+                'OPTIONS': {'tcp_nodelay': True, 'ketama_weighted': True},
+                'NEAR_CACHE': {
+                    'TTL': 5,
+                    'CHECK_INTERVAL': 1,
+                    'MAX_ITEMS': 1000,
+                    'MAX_BYTES': 16 * 1024 * 1024,
+                },
             }
         }
     except:
         return {
             'default': {
-                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                # LocMemCache, with its calls timed like memcached's
+                'BACKEND': 'blogengine.instrumentation.InstrumentedLocMemCache',
                 'LOCATION': '127.0.0.1:11211'
             }
         }
@@ -158,3 +195,45 @@ CACHES = get_cache()
 CACHE_MIDDLEWARE_ALIAS = 'default'
 CACHE_MIDDLEWARE_SECONDS = 300
 CACHE_MIDDLEWARE_KEY_PREFIX = ''
+
+# Paths never served from or stored in the page cache
+BLOGENGINE_PAGE_CACHE_EXCLUDE = ('/admin/', '/__debug__/')
+# Count page cache hits and misses (see the page_cache_stats command).
+# Each request then increments a shared counter in memcached, even when the
+# page comes from the near cache, so only turn it on while measuring.
+BLOGENGINE_PAGE_CACHE_STATS = False
+# How long pages are kept past CACHE_MIDDLEWARE_SECONDS, served while
+# they're refreshed in the background
+BLOGENGINE_PAGE_CACHE_STALE_SECONDS = 60 * 60
+BLOGENGINE_BACKGROUND_REFRESH = True
+
+# Share of requests timed, with the timings sent as a Server-Timing header
+# and logged to blogengine.performance. Off unless set in the environment,
+# e.g. to 0.01 in production.
+BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE = float(
+    os.environ.get('BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE', 0)
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'blogengine.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Number of posts in the RSS feed
+BLOGENGINE_FEED_ITEMS = 20
+
+# Number of posts per page of the index
+BLOGENGINE_INDEX_PAGE_SIZE = 2
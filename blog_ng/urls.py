@@ -16,7 +16,7 @@ urlpatterns = patterns(
     url(r'', include('blogengine.urls', namespace="blogengine")),
 
     # Flat pages
-    url(r'', include('django.contrib.flatpages.urls')),
+    url(r'^(?P<url>.*)$', 'blogengine.views.flatpage'),
 )
 if settings.DEBUG:
     import debug_toolbar
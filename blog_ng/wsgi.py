@@ -11,6 +11,6 @@ import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "blog_ng.settings")
 
 from django.core.wsgi import get_wsgi_application
-from dj_static import Cling
+from blogengine.assets import Cling
 
 application = Cling(get_wsgi_application())
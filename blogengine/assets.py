@@ -0,0 +1,176 @@
+"""
+Bundled, fingerprinted and pre-compressed static files.
+
+``collectstatic`` concatenates the files of each bundle in
+``BLOGENGINE_STATIC_BUNDLES`` (minifying stylesheets), adds a hash of the
+content to every file name, and writes a gzipped copy next to each text
+file. The ``bundle`` template tag links a bundle, or its files one by one
+while DEBUG is on.
+
+``Cling`` serves ``STATIC_ROOT`` like dj_static does, but hands out the
+gzipped copy to clients that accept it, and lets browsers cache
+fingerprinted files for a year.
+"""
+import gzip
+import os
+import posixpath
+import re
+from StringIO import StringIO
+
+import dj_static
+import static
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    CachedFilesMixin, CachedStaticFilesStorage
+)
+from django.core.files.base import ContentFile
+
+from .middleware import accepts_gzip
+
+GZIP_EXTENSIONS = (
+    '.css', '.js', '.svg', '.eot', '.ttf', '.txt', '.xml', '.json', '.map'
+)
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+FAR_FUTURE = 'public, max-age=31536000'
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+CSS_COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s*([{};,])\s*')
+
+
+def get_bundles():
+    return getattr(settings, 'BLOGENGINE_STATIC_BUNDLES', {})
+
+
+def rebase_css_urls(css, source, bundle):
+    """Make the relative urls in *source*'s stylesheet work from *bundle*."""
+    def rebase(match):
+        url = match.group(2)
+        if url.startswith(('#', '/', 'data:', 'http:', 'https:')):
+            return match.group(0)
+        target = posixpath.normpath(
+            posixpath.join(posixpath.dirname(source), url)
+        )
+        return 'url(%s)' % posixpath.relpath(
+            target, posixpath.dirname(bundle)
+        )
+    return CSS_URL.sub(rebase, css)
+
+
+def minify_css(css):
+    """Drop comments (but /*! licenses) and needless whitespace."""
+    css = CSS_COMMENT.sub('', css)
+    css = re.sub(r'\s+', ' ', css)
+    css = CSS_SPACE.sub(r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def gzip_content(content):
+    out = StringIO()
+    # A fixed mtime gives the same bytes for the same content
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(content)
+    return out.getvalue()
+
+
+class BundlingStaticFilesStorage(CachedStaticFilesStorage):
+    """
+    Hashed static files storage that also builds the bundles and gzipped
+    copies when ``collectstatic`` post-processes the files.
+    """
+    def __init__(self, *args, **kwargs):
+        self.bundles = kwargs.pop('bundles', None)
+        if self.bundles is None:
+            self.bundles = get_bundles()
+        super(BundlingStaticFilesStorage, self).__init__(*args, **kwargs)
+
+    def url(self, name, force=False):
+        try:
+            return super(BundlingStaticFilesStorage, self).url(name, force)
+        except ValueError:
+            # Not collected yet, e.g. in tests: link the plain name
+            return super(CachedFilesMixin, self).url(name)
+
+    def build_bundle(self, name, sources, paths):
+        parts = []
+        for source in sources:
+            if source not in paths:
+                raise ValueError(
+                    "The file '%s' of bundle '%s' could not be found" % (
+                        source, name
+                    )
+                )
+            storage, path = paths[source]
+            with storage.open(path) as f:
+                content = f.read()
+            if name.endswith('.css'):
+                content = rebase_css_urls(content, source, name)
+            parts.append(content)
+        if name.endswith('.css'):
+            return minify_css('\n'.join(parts))
+        # Scripts are only joined; a statement left open by one file mustn't
+        # swallow the next
+        return ';\n'.join(parts)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        paths = dict(paths)
+        for name, sources in sorted(self.bundles.items()):
+            if self.exists(name):
+                self.delete(name)
+            content = self.build_bundle(name, sources, paths)
+            self.save(name, ContentFile(content))
+            paths[name] = (self, name)
+
+        processed = super(BundlingStaticFilesStorage, self).post_process(
+            paths, dry_run, **options
+        )
+        for original, hashed, was_processed in processed:
+            if hashed and hashed.endswith(GZIP_EXTENSIONS) and (
+                    was_processed or not self.exists(hashed + '.gz')):
+                self.save_gzipped(hashed)
+            yield original, hashed, was_processed
+
+    def save_gzipped(self, name):
+        with self.open(name) as f:
+            content = f.read()
+        compressed = gzip_content(content)
+        if len(compressed) >= len(content):
+            return
+        if self.exists(name + '.gz'):
+            self.delete(name + '.gz')
+        self.save(name + '.gz', ContentFile(compressed))
+
+
+class PrecompressedCling(static.Cling):
+    """
+    Serve ``<file>.gz`` in place of a file to clients accepting gzip, and
+    fingerprinted files with far-future caching headers.
+    """
+    def __call__(self, environ, start_response):
+        path_info = environ.get('PATH_INFO', '')
+        headers = []
+        if path_info.endswith(GZIP_EXTENSIONS):
+            headers.append(('Vary', 'Accept-Encoding'))
+            accept = environ.get('HTTP_ACCEPT_ENCODING', '')
+            gzipped = self._full_path(path_info + '.gz')
+            if accepts_gzip(accept) and self._is_under_root(gzipped) and \
+                    os.path.isfile(gzipped):
+                environ = dict(environ, PATH_INFO=path_info + '.gz')
+                headers.append(('Content-Encoding', 'gzip'))
+        if FINGERPRINTED.search(path_info):
+            headers.append(('Cache-Control', FAR_FUTURE))
+
+        def add_headers(status, response_headers, exc_info=None):
+            if status.startswith(('200', '304')):
+                response_headers = response_headers + headers
+            return start_response(status, response_headers, exc_info)
+        return super(PrecompressedCling, self).__call__(environ, add_headers)
+
+
+class Cling(dj_static.Cling):
+    def __init__(self, application, base_dir=None, ignore_debug=False):
+        super(Cling, self).__init__(application, base_dir, ignore_debug)
+        self.cling = PrecompressedCling(self.cling.root)
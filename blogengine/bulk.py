@@ -0,0 +1,256 @@
+"""
+Streaming export and import of posts, categories and tags as JSON Lines.
+
+Each line is one object with a ``type`` of ``category``, ``tag`` or
+``post``. Categories and tags come first, so an import can resolve the
+slugs posts refer to as it goes::
+
+    {"type": "category", "slug": "python", "name": "Python", ...}
+    {"type": "tag", "slug": "django", "name": "Django", ...}
+    {"type": "post", "slug": "my-first-post", "category": "python",
+     "tags": ["django"], "author": "bob", "site": "example.com", ...}
+
+The import writes in batches with ``bulk_create``, bypassing the save
+signals, and invalidates the cached pages once at the end. Slugs already in
+the database are skipped, so an interrupted import can simply be run again.
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .invalidation import invalidate
+from .markup import renderer_signature
+from .models import Category, Post, Tag
+
+BATCH_SIZE = 500
+
+
+def _term_record(kind, term):
+    return {
+        'type': kind,
+        'slug': term.slug,
+        'name': term.name,
+        'description': term.description,
+    }
+
+
+def export_lines(batch_size=BATCH_SIZE):
+    """Yield the JSON lines of every category, tag and post."""
+    categories = {}
+    for category in Category.objects.order_by('pk'):
+        categories[category.pk] = category.slug
+        yield json.dumps(_term_record('category', category))
+    tags = {}
+    for tag in Tag.objects.order_by('pk'):
+        tags[tag.pk] = tag.slug
+        yield json.dumps(_term_record('tag', tag))
+    authors = dict(User.objects.values_list('pk', 'username'))
+    sites = dict(Site.objects.values_list('pk', 'domain'))
+
+    last_pk = 0
+    while True:
+        # Walk the table by primary key, with the tags of each batch in
+        # one more query
+        posts = list(
+            Post.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+        )
+        if not posts:
+            break
+        post_tags = {}
+        for post_id, tag_id in Post.tag.through.objects.filter(
+                post__in=posts).values_list('post_id', 'tag_id'):
+            post_tags.setdefault(post_id, []).append(tags[tag_id])
+        for post in posts:
+            yield json.dumps({
+                'type': 'post',
+                'slug': post.slug,
+                'title': post.title,
+                'pub_date': post.pub_date.isoformat(),
+                'text': post.text,
+                'text_html': post.text_html,
+                'text_html_signature': post.text_html_signature,
+                'author': authors[post.author_id],
+                'site': sites[post.site_id],
+                'category': categories.get(post.category_id),
+                'tags': sorted(post_tags.get(post.pk, [])),
+            })
+        last_pk = posts[-1].pk
+
+
+class Importer(object):
+    """
+    Create the objects of JSON lines fed to ``add``, in batches. Categories
+    and tags are resolved by slug from maps kept in memory.
+    """
+    def __init__(self, batch_size=BATCH_SIZE, default_author=None):
+        self.batch_size = batch_size
+        self.default_author = default_author
+        self.signature = renderer_signature()
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.tags = dict(Tag.objects.values_list('slug', 'pk'))
+        self.authors = dict(User.objects.values_list('username', 'pk'))
+        self.sites = dict(Site.objects.values_list('domain', 'pk'))
+        self.default_site = Site.objects.get_current()
+        self.post_slugs = set(Post.objects.values_list('slug', flat=True))
+        self.new_categories = []
+        self.new_tags = []
+        self.new_posts = []
+        self.counts = dict.fromkeys(
+            ['category', 'tag', 'post', 'skipped'], 0
+        )
+        self.dependencies = set(['posts'])
+
+    def add(self, line, number):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+            kind = record['type']
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("Line %d is not a valid record" % number)
+        if kind in ('category', 'tag'):
+            self.add_term(kind, record, number)
+        elif kind == 'post':
+            self.add_post(record, number)
+        else:
+            raise ValueError("Line %d has unknown type '%s'" % (number, kind))
+
+    def add_term(self, kind, record, number):
+        known, new, model = {
+            'category': (self.categories, self.new_categories, Category),
+            'tag': (self.tags, self.new_tags, Tag),
+        }[kind]
+        slug = record.get('slug')
+        if not slug:
+            raise ValueError("Line %d has no slug" % number)
+        if slug in known:
+            self.counts['skipped'] += 1
+            return
+        known[slug] = None
+        new.append(model(
+            slug=slug, name=record.get('name', slug),
+            description=record.get('description', ''),
+        ))
+        self.counts[kind] += 1
+        if len(new) >= self.batch_size:
+            self.flush_terms()
+
+    def add_post(self, record, number):
+        missing = [
+            field for field in ('slug', 'title', 'pub_date', 'text')
+            if not record.get(field)
+        ]
+        if missing:
+            raise ValueError(
+                "Line %d has no %s" % (number, ', '.join(missing))
+            )
+        slug = record['slug']
+        post = Post(
+            slug=slug,
+            title=record['title'],
+            pub_date=parse_datetime(record['pub_date']),
+            text=record['text'],
+        )
+        if post.pub_date is None:
+            raise ValueError("Line %d has an invalid pub_date" % number)
+
+        author = record.get('author')
+        if author in self.authors:
+            post.author_id = self.authors[author]
+        elif self.default_author is not None:
+            post.author_id = self.default_author.pk
+        else:
+            raise ValueError(
+                "Line %d has unknown author '%s'" % (number, author)
+            )
+        site = record.get('site')
+        if site is None:
+            post.site_id = self.default_site.pk
+        elif site in self.sites:
+            post.site_id = self.sites[site]
+        else:
+            raise ValueError("Line %d has unknown site '%s'" % (number, site))
+
+        if slug in self.post_slugs:
+            self.counts['skipped'] += 1
+            return
+        self.post_slugs.add(slug)
+
+        # Keep the stored HTML when the renderer hasn't changed since
+        if record.get('text_html_signature') == self.signature:
+            post.text_html = record.get('text_html', '')
+            post.text_html_signature = self.signature
+        else:
+            post.render_text()
+        category = record.get('category')
+        tags = record.get('tags') or []
+        for name, known, slugs in (
+                ('category', self.categories, [category] if category else []),
+                ('tag', self.tags, tags)):
+            for term in slugs:
+                if term not in known:
+                    raise ValueError(
+                        "Line %d has unknown %s '%s'" % (number, name, term)
+                    )
+        self.new_posts.append((post, category, tags))
+        self.counts['post'] += 1
+        if len(self.new_posts) >= self.batch_size:
+            self.flush_posts()
+
+    def flush_terms(self):
+        """Create the pending categories and tags, and map their pks."""
+        for model, new, known in (
+                (Category, self.new_categories, self.categories),
+                (Tag, self.new_tags, self.tags)):
+            if not new:
+                continue
+            model.objects.bulk_create(new)
+            # bulk_create doesn't set the pks
+            known.update(model.objects.filter(
+                slug__in=[term.slug for term in new]
+            ).values_list('slug', 'pk'))
+            del new[:]
+
+    def flush_posts(self):
+        """Create the pending posts and their tags."""
+        if not self.new_posts:
+            return
+        self.flush_terms()
+        for post, category, tags in self.new_posts:
+            if category:
+                post.category_id = self.categories[category]
+                self.dependencies.add('category-posts:%s' % category)
+            self.dependencies.update('tag-posts:%s' % tag for tag in tags)
+        Post.objects.bulk_create([post for post, _, _ in self.new_posts])
+        pks = dict(Post.objects.filter(
+            slug__in=[post.slug for post, _, _ in self.new_posts]
+        ).values_list('slug', 'pk'))
+        Post.tag.through.objects.bulk_create([
+            Post.tag.through(post_id=pks[post.slug], tag_id=self.tags[tag])
+            for post, _, tags in self.new_posts
+            for tag in set(tags)
+        ], batch_size=self.batch_size)
+        del self.new_posts[:]
+
+    def finish(self):
+        self.flush_posts()
+        self.flush_terms()
+
+
+def import_lines(lines, batch_size=BATCH_SIZE, default_author=None):
+    """
+    Import JSON *lines* in a single transaction, and return the number of
+    categories, tags and posts created and of records skipped.
+    """
+    with transaction.atomic():
+        importer = Importer(batch_size, default_author)
+        for number, line in enumerate(lines, 1):
+            importer.add(line, number)
+        importer.finish()
+    # One invalidation for everything created, rather than one per save
+    invalidate(*importer.dependencies)
+    return importer.counts
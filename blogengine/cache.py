@@ -0,0 +1,77 @@
+"""
+Memcached cache backend with an in-process near cache for hot keys.
+
+Configured like ``django_pylibmc.memcached.PyLibMCCache``, plus a
+``NEAR_CACHE`` entry in the cache settings with the options of
+``pylibmc.NearCache`` and ``pylibmc.LRUStore``::
+
+    'NEAR_CACHE': {
+        'TTL': 5,
+        'CHECK_INTERVAL': 1,
+        'MAX_ITEMS': 1000,
+        'MAX_BYTES': 8 * 1024 * 1024,
+    }
+
+Only the keys every request reads are kept near: the cached pages and the
+generations of their dependencies. Pages are checked against those
+generations before being served, so only writes of generations need to
+empty the near caches of the other processes.
+
+Calls are timed for the requests sampled by
+``blogengine.instrumentation.InstrumentationMiddleware``.
+"""
+import threading
+
+import pylibmc
+from django_pylibmc.memcached import PyLibMCCache
+
+from .instrumentation import InstrumentedCacheMixin
+from .invalidation import GENERATION_KEY
+
+# Keys, as stored in memcached, of the page cache and of the generations
+NEAR_KEYS = ('views.decorators.cache.cache_', GENERATION_KEY % '')
+VERSIONED_KEYS = (GENERATION_KEY % '',)
+
+# One store per process and cache, shared by the clients of all threads
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _contains_any(fragments):
+    return lambda key: any(fragment in key for fragment in fragments)
+
+
+class NearPyLibMCCache(InstrumentedCacheMixin, PyLibMCCache):
+    def __init__(self, server, params, *args, **kwargs):
+        super(NearPyLibMCCache, self).__init__(server, params, *args, **kwargs)
+        options = params.get('NEAR_CACHE', {})
+        with _stores_lock:
+            key = (repr(server), params.get('KEY_PREFIX', ''))
+            if key not in _stores:
+                _stores[key] = pylibmc.LRUStore(
+                    max_items=options.get('MAX_ITEMS', 1000),
+                    max_bytes=options.get('MAX_BYTES', 8 * 1024 * 1024),
+                )
+            self.near_store = _stores[key]
+        self._near_options = {
+            'ttl': options.get('TTL', 5),
+            'check_interval': options.get('CHECK_INTERVAL', 1),
+            'near': _contains_any(NEAR_KEYS),
+            'versioned': _contains_any(VERSIONED_KEYS),
+        }
+        self._near_local = threading.local()
+
+    @property
+    def _cache(self):
+        client = super(NearPyLibMCCache, self)._cache
+        near = getattr(self._near_local, 'client', None)
+        if near is None or near.mc is not client:
+            near = pylibmc.NearCache(
+                client, self.near_store, **self._near_options
+            )
+            self._near_local.client = near
+        return near
+
+    def near_cache_stats(self):
+        """Hits, misses and evictions of this process's near cache."""
+        return self.near_store.stats()
@@ -0,0 +1,68 @@
+"""
+Batched caching of per-item fragments.
+
+A page showing many posts looks all their fragments up in a single
+``get_many`` (one memcached round trip with ``get_multi``), renders only
+the missing ones, and stores those back with a single ``set_many``.
+
+Fragment keys include the modification times of everything the fragment
+shows, so a change gives a new key and entries never have to be evicted.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .instrumentation import timed
+
+POST_SUMMARY_TEMPLATE = 'blogengine/includes/post_summary.html'
+POST_SUMMARY_TIMEOUT = 60 * 60 * 24
+
+
+def cached_many(items, key_func, compute, timeout):
+    """
+    Return the cached value of each of *items*, in order, fetched in one
+    ``get_many``. *compute* is called once, with the list of items missing
+    from the cache, and returns their values in the same order; they're
+    stored back with one ``set_many``.
+    """
+    keys = [key_func(item) for item in items]
+    found = cache.get_many(keys)
+    missing = [(key, item) for key, item in zip(keys, items)
+               if key not in found]
+    if missing:
+        computed = dict(zip(
+            [key for key, item in missing],
+            compute([item for key, item in missing])
+        ))
+        cache.set_many(computed, timeout)
+        found.update(computed)
+    return [found[key] for key in keys]
+
+
+def post_summary_key(post):
+    """
+    Key of the summary of *post* in listings, which shows its category and
+    tags as well. Expects them loaded with ``listed_posts()``.
+    """
+    times = [post.updated_at]
+    if post.category is not None:
+        times.append(post.category.updated_at)
+    times.extend(sorted(tag.updated_at for tag in post.tag.all()))
+    return 'blogengine:post-summary:%d:%s' % (
+        post.pk, hashlib.md5(repr(times)).hexdigest()
+    )
+
+
+def render_post_summary(post):
+    with timed('render'):
+        return render_to_string(POST_SUMMARY_TEMPLATE, {'post': post})
+
+
+def render_post_summaries(posts):
+    """Return the HTML summary of each of *posts*, rendering only misses."""
+    return cached_many(
+        posts, post_summary_key,
+        lambda missing: [render_post_summary(post) for post in missing],
+        POST_SUMMARY_TIMEOUT
+    )
@@ -0,0 +1,175 @@
+"""
+Per-request timings of database queries, cache calls, Markdown and
+template rendering.
+
+For a sample of the requests, ``InstrumentationMiddleware`` records how
+many SQL queries and cache calls were made and how long they, Markdown
+rendering and template rendering took. It sends them in a
+``Server-Timing`` header, shown by browsers' developer tools, and logs
+them as JSON to the ``blogengine.performance`` logger.
+
+``BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE`` is the share of requests
+instrumented, from 0 (none, the default) to 1 (all). Requests that aren't
+sampled only pay for a random number and a thread-local lookup per timed
+call.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+
+logger = logging.getLogger('blogengine.performance')
+
+# The timings shown, in order, and the name of what they count
+TIMINGS = (
+    ('db', 'queries'),
+    ('cache', 'calls'),
+    ('markdown', 'calls'),
+    ('render', 'templates'),
+)
+
+_local = threading.local()
+
+
+class Timings(object):
+    def __init__(self):
+        self.start = time.time()
+        self.durations = dict((name, 0.0) for name, _ in TIMINGS)
+        self.counts = dict((name, 0) for name, _ in TIMINGS)
+        self.running = set()
+
+    def add(self, name, duration, count=1):
+        self.durations[name] += duration
+        self.counts[name] += count
+
+    def server_timing(self, total):
+        metrics = [
+            '%s;dur=%.1f;desc="%d %s"' % (
+                name, self.durations[name] * 1000, self.counts[name], unit
+            )
+            for name, unit in TIMINGS
+        ]
+        metrics.append('total;dur=%.1f' % (total * 1000))
+        return ', '.join(metrics)
+
+    def record(self, request, response, total):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+        }
+        for name, unit in TIMINGS:
+            record['%s_%s' % (name, unit)] = self.counts[name]
+            record['%s_ms' % name] = round(self.durations[name] * 1000, 1)
+        return record
+
+
+def current():
+    """The timings of the request being handled, if it's sampled."""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the *name* timing of the current
+    request. Nested blocks of the same name are only counted once.
+    """
+    timings = current()
+    if timings is None or name in timings.running:
+        yield
+        return
+    timings.running.add(name)
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings.running.discard(name)
+        timings.add(name, time.time() - start)
+
+
+class InstrumentedCacheMixin(object):
+    """Time the calls made through a cache backend."""
+
+
+def _timed_method(name):
+    def method(self, *args, **kwargs):
+        with timed('cache'):
+            return getattr(super(InstrumentedCacheMixin, self), name)(
+                *args, **kwargs
+            )
+    method.__name__ = name
+    return method
+
+for _name in ('get', 'set', 'add', 'delete', 'get_many', 'set_many',
+              'delete_many', 'incr', 'decr', 'has_key'):
+    setattr(InstrumentedCacheMixin, _name, _timed_method(_name))
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
+
+
+class InstrumentationMiddleware(object):
+    """
+    Goes first in MIDDLEWARE_CLASSES, so page cache hits are measured too
+    and the header isn't stored with cached pages.
+    """
+    def process_request(self, request):
+        _local.timings = None
+        sample_rate = getattr(
+            settings, 'BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE', 0
+        )
+        if random.random() >= sample_rate:
+            return None
+        _local.timings = Timings()
+        # Have each connection log its queries, with their duration
+        request._instrumented_queries = []
+        for connection in connections.all():
+            request._instrumented_queries.append(
+                (connection, connection.use_debug_cursor,
+                 len(connection.queries))
+            )
+            connection.use_debug_cursor = True
+        return None
+
+    def process_template_response(self, request, response):
+        timings = current()
+        # Pages from the page cache come rendered already
+        if timings is not None and not response.is_rendered:
+            start = time.time()
+            response.add_post_render_callback(
+                lambda r: timings.add('render', time.time() - start)
+            )
+        return response
+
+    def process_response(self, request, response):
+        timings = current()
+        _local.timings = None
+        if timings is None:
+            return response
+        for connection, use_debug_cursor, first in getattr(
+                request, '_instrumented_queries', []):
+            queries = connection.queries[first:]
+            timings.add(
+                'db', sum(float(query['time']) for query in queries),
+                len(queries)
+            )
+            # Don't let the query log grow when nothing else reads it
+            if not (use_debug_cursor or settings.DEBUG):
+                del connection.queries[first:]
+            connection.use_debug_cursor = use_debug_cursor
+
+        total = time.time() - timings.start
+        response['Server-Timing'] = timings.server_timing(total)
+        logger.info(json.dumps(
+            timings.record(request, response, total), sort_keys=True
+        ))
+        return response
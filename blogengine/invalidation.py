@@ -0,0 +1,128 @@
+"""
+Dependency-tracked invalidation for cached pages.
+
+Every cached page records the dependencies it was rendered from, such as
+``post:12``, ``category:python`` or ``tag-posts:django``. Each dependency
+has a generation counter in the cache; the page stores the generations it
+saw, and is only served while they are all unchanged. Invalidating a
+dependency just bumps its counter, so no key scan or global clear is needed.
+
+Dependencies used by blogengine:
+
+- ``post:<pk>``: the content of a single post.
+- ``posts``: which posts are published and in what order.
+- ``category:<slug>`` / ``tag:<slug>``: the category or tag itself.
+- ``category-posts:<slug>`` / ``tag-posts:<slug>``: which posts it lists.
+- ``flatpages``: the flat pages, listed in every page's menu.
+- ``content``: the site-wide content version, bumped by every change.
+
+Every invalidation also records the time of the change, sent as the
+Last-Modified of the pages.
+"""
+import math
+import time
+from datetime import datetime
+
+from django.core.cache import cache
+from django.utils import timezone
+
+GENERATION_KEY = 'blogengine:generation:%s'
+
+# Memcached treats anything above 30 days as an absolute timestamp. An
+# expired generation simply invalidates the pages depending on it.
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+CONTENT_VERSION = 'content'
+CONTENT_MODIFIED_KEY = 'blogengine:content-modified'
+
+
+def _new_generation():
+    # Start from the clock rather than zero, so a generation that was
+    # evicted and recreated can never match a value stored by an old page.
+    return int(time.time() * 1000)
+
+
+def post_dependencies(post):
+    """Dependencies of a page showing *post* with its category and tags."""
+    dependencies = ['post:%d' % post.pk]
+    if post.category is not None:
+        dependencies.append('category:%s' % post.category.slug)
+    dependencies.extend('tag:%s' % tag.slug for tag in post.tag.all())
+    return dependencies
+
+
+def add_dependencies(request, dependencies):
+    """Record that the response to *request* depends on *dependencies*."""
+    if not hasattr(request, 'cache_dependencies'):
+        request.cache_dependencies = set()
+    request.cache_dependencies.update(dependencies)
+
+
+def get_generations(dependencies):
+    """Return the current generation of each dependency, creating missing ones."""
+    keys = dict((GENERATION_KEY % dep, dep) for dep in dependencies)
+    found = cache.get_many(keys.keys())
+    missing = [key for key in keys if key not in found]
+    for key in missing:
+        cache.add(key, _new_generation(), GENERATION_TIMEOUT)
+    if missing:
+        found.update(cache.get_many(missing))
+    return dict((keys[key], value) for key, value in found.items())
+
+
+def is_current(generations):
+    """Check that none of the recorded *generations* has been bumped since."""
+    if not generations:
+        return True
+    keys = dict((GENERATION_KEY % dep, dep) for dep in generations)
+    found = cache.get_many(keys.keys())
+    for key, dep in keys.items():
+        if found.get(key) != generations[dep]:
+            return False
+    return True
+
+
+def content_version():
+    """
+    Site-wide counter bumped by every invalidation, for checking in a
+    single cache read whether anything at all changed.
+    """
+    return get_generations([CONTENT_VERSION])[CONTENT_VERSION]
+
+
+def content_modified():
+    """
+    When anything at all last changed, to the second. Later than any
+    change if the record was lost, so it never makes a client keep an
+    outdated page.
+    """
+    modified = cache.get(CONTENT_MODIFIED_KEY)
+    if modified is None:
+        cache.add(
+            CONTENT_MODIFIED_KEY, int(math.ceil(time.time())),
+            GENERATION_TIMEOUT
+        )
+        modified = cache.get(CONTENT_MODIFIED_KEY)
+    if modified is not None:
+        return datetime.utcfromtimestamp(modified).replace(tzinfo=timezone.utc)
+
+
+def _touch_content_modified():
+    # HTTP dates have a resolution of one second: make each change move
+    # the time on by at least that much
+    modified = int(math.ceil(time.time()))
+    previous = cache.get(CONTENT_MODIFIED_KEY)
+    if previous is not None and modified <= previous:
+        modified = previous + 1
+    cache.set(CONTENT_MODIFIED_KEY, modified, GENERATION_TIMEOUT)
+
+
+def invalidate(*dependencies):
+    """Evict every cached page that depends on any of *dependencies*."""
+    for dep in set(dependencies) | set([CONTENT_VERSION]):
+        key = GENERATION_KEY % dep
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_generation(), GENERATION_TIMEOUT)
+    _touch_content_modified()
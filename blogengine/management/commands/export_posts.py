@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from blogengine.bulk import export_lines
+
+
+class Command(BaseCommand):
+    args = '[<file>]'
+    help = (
+        "Export the posts, categories and tags as JSON Lines, to a file or "
+        "to the standard output."
+    )
+
+    def handle(self, *args, **options):
+        if args and args[0] != '-':
+            out = open(args[0], 'w')
+        else:
+            out = self.stdout
+        try:
+            for line in export_lines():
+                out.write(line + '\n')
+        finally:
+            if out is not self.stdout:
+                out.close()
@@ -0,0 +1,232 @@
+"""
+Render the blog to a directory of static files.
+
+Each page is written to ``<directory><path>index.html`` (the feed to
+``index.xml``), so nginx can serve the directory with something like::
+
+    location / {
+        if ($args) { proxy_pass http://gunicorn; }
+        try_files $uri $uri/index.html $uri/index.xml @gunicorn;
+    }
+
+Listings are rendered on their first page; further pages are reached
+with cursor or page query strings and still go to Django.
+
+A manifest of page fingerprints is kept next to the files, so later runs
+only re-render pages whose posts, categories, tags or flat pages changed.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+from optparse import make_option
+
+from django.contrib.flatpages.models import FlatPage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import resolve
+from django.db import connections
+from django.http import Http404
+from django.test.client import RequestFactory
+
+from blogengine.models import Category, Post, Tag
+
+MANIFEST = '.manifest.json'
+FEED_PATH = '/feeds/posts/'
+
+
+def fingerprint(*parts):
+    return hashlib.md5(repr(parts)).hexdigest()
+
+
+def page_fingerprints():
+    """
+    Map every page path to a fingerprint of the content shown on it,
+    computed from a handful of small queries without rendering anything.
+    """
+    categories = dict(
+        (pk, (slug, updated_at)) for pk, slug, updated_at in
+        Category.objects.values_list('pk', 'slug', 'updated_at')
+    )
+    tags = dict(
+        (pk, (slug, updated_at)) for pk, slug, updated_at in
+        Tag.objects.values_list('pk', 'slug', 'updated_at')
+    )
+    post_tags = {}
+    for post_id, tag_id in Post.tag.through.objects.values_list(
+            'post_id', 'tag_id'):
+        post_tags.setdefault(post_id, []).append(tag_id)
+    flatpages = list(
+        FlatPage.objects.order_by('url').values_list('url', 'title', 'content')
+    )
+    menu = [(url, title) for url, title, content in flatpages]
+
+    pages = {}
+    post_fingerprints = []
+    category_posts = dict((slug, []) for slug, _ in categories.values())
+    tag_posts = dict((slug, []) for slug, _ in tags.values())
+    posts = Post.objects.only('pub_date', 'slug', 'updated_at', 'category')
+    for post in posts.order_by('-pub_date', '-pk'):
+        tag_ids = sorted(post_tags.get(post.pk, []))
+        post_fp = fingerprint(
+            post.pk, post.updated_at,
+            categories.get(post.category_id),
+            [tags[tag_id] for tag_id in tag_ids],
+        )
+        post_fingerprints.append(post_fp)
+        pages[post.get_absolute_url()] = fingerprint(post_fp, menu)
+        if post.category_id is not None:
+            category_posts[categories[post.category_id][0]].append(post_fp)
+        for tag_id in tag_ids:
+            tag_posts[tags[tag_id][0]].append(post_fp)
+
+    pages['/'] = fingerprint(post_fingerprints, menu)
+    pages[FEED_PATH] = fingerprint(post_fingerprints)
+    for slug, fps in category_posts.items():
+        pages['/category/%s/' % slug] = fingerprint(fps, menu)
+    for slug, fps in tag_posts.items():
+        pages['/tag/%s/' % slug] = fingerprint(fps, menu)
+    for url, title, content in flatpages:
+        pages[url] = fingerprint(title, content, menu)
+    return pages
+
+
+def output_file(directory, path, content_type):
+    name = 'index.xml' if 'xml' in content_type else 'index.html'
+    return os.path.join(directory, path.strip('/'), name)
+
+
+def remove_stale_files(directory, keep):
+    """
+    Delete the page files under *directory* that aren't in *keep*, and the
+    directories left empty, and return the number of files deleted.
+    """
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(directory, topdown=False):
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            if name in ('index.html', 'index.xml') and filename not in keep:
+                os.unlink(filename)
+                removed += 1
+        if dirpath != directory and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return removed
+
+
+def write_atomically(filename, content):
+    """Write *content* next to *filename* and rename it into place."""
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # Another worker created it in the meantime
+            if not os.path.isdir(dirname):
+                raise
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, filename)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+def render_page(job):
+    """Render the page at *path* and write it; runs in the worker processes."""
+    path, directory = job
+    request = RequestFactory().get(path)
+    match = resolve(path)
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+    except Http404:
+        return path, None
+    if response.status_code != 200:
+        return path, None
+    filename = output_file(directory, path, response['Content-Type'])
+    write_atomically(filename, response.content)
+    return path, filename
+
+
+class Command(BaseCommand):
+    args = '<directory>'
+    help = "Render the blog pages and feed to a directory of static files."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=multiprocessing.cpu_count(),
+            help='Number of rendering processes (1 renders in-process).'
+        ),
+        make_option(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Render every page, not only the changed ones.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the output directory")
+        directory = os.path.abspath(args[0])
+        manifest_file = os.path.join(directory, MANIFEST)
+
+        previous = {}
+        if not options['all'] and os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                previous = json.load(f)
+
+        pages = page_fingerprints()
+        jobs = [
+            (path, directory) for path, fp in sorted(pages.items())
+            if path not in previous or previous[path]['fingerprint'] != fp
+        ]
+
+        if options['workers'] > 1 and len(jobs) > 1:
+            # Forked workers must not share the parent's connections
+            for connection in connections.all():
+                connection.close()
+            pool = multiprocessing.Pool(options['workers'])
+            try:
+                results = pool.map(render_page, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(render_page, jobs)
+
+        manifest = dict(
+            (path, entry) for path, entry in previous.items()
+            if path in pages
+        )
+        rendered = 0
+        for path, filename in results:
+            if filename is None:
+                manifest.pop(path, None)
+                self.stderr.write("Skipped %s: not found" % path)
+            else:
+                rendered += 1
+                manifest[path] = {
+                    'fingerprint': pages[path], 'file': filename
+                }
+
+        # Drop the files of pages that no longer exist or weren't found,
+        # whether or not the previous manifest knew about them
+        removed = remove_stale_files(
+            directory, set(entry['file'] for entry in manifest.values())
+        )
+
+        write_atomically(manifest_file, json.dumps(manifest, indent=1))
+        self.stdout.write(
+            "Rendered %d page(s), removed %d, %d unchanged" % (
+                rendered, removed, len(pages) - len(jobs)
+            )
+        )
@@ -0,0 +1,61 @@
+import sys
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from blogengine.bulk import BATCH_SIZE, import_lines
+
+
+class Command(BaseCommand):
+    args = '[<file>]'
+    help = (
+        "Import posts, categories and tags from JSON Lines written by "
+        "export_posts, read from a file or the standard input."
+    )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=BATCH_SIZE,
+            help='Number of objects created per query.'
+        ),
+        make_option(
+            '--author',
+            action='store',
+            dest='author',
+            default=None,
+            help='Username given to posts whose author does not exist.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        default_author = None
+        if options['author']:
+            try:
+                default_author = User.objects.get(username=options['author'])
+            except User.DoesNotExist:
+                raise CommandError(
+                    "No user named '%s'" % options['author']
+                )
+
+        if args and args[0] != '-':
+            lines = open(args[0])
+        else:
+            lines = sys.stdin
+        try:
+            counts = import_lines(
+                lines, options['batch_size'], default_author
+            )
+        except ValueError as e:
+            raise CommandError("Nothing imported: %s" % e)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+        self.stdout.write(
+            "Imported %(post)d post(s), %(category)d category(ies) and "
+            "%(tag)d tag(s), skipped %(skipped)d existing" % counts
+        )
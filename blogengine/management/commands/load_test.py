@@ -0,0 +1,485 @@
+"""
+Measure the throughput and latency of the blog's pages under load.
+
+Seed a synthetic corpus, start gunicorn and drive every kind of page with
+concurrent clients::
+
+    python manage.py load_test --seed-posts 5000 -o before.json
+    python manage.py load_test -o after.json --compare before.json
+
+Each group of pages (index, deep pagination, post, category, tag, flat
+page and feed) is measured twice. The cold run restarts the server on an
+empty cache and fetches every page of the group once. The warm run fetches
+them all first, then makes ``--requests`` requests over them. Requests
+per second, p50/p95/p99 latency and SQL queries per request are printed,
+and saved with ``-o`` for comparing commits.
+
+Latency is measured with instrumentation off. Queries are then counted in
+a second pass, fetching each page once from a server instrumenting every
+request, and read from its Server-Timing header. With ``--server``, an
+already running server is used instead; there is no second pass, so
+queries are only reported for the requests it samples, and the cold runs
+only start from an empty cache if it shares the cache of this process
+(memcached, not the local memory cache).
+"""
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import threading
+import time
+import urllib2
+from datetime import timedelta
+from optparse import make_option
+from Queue import Queue
+
+from django.contrib.auth.models import User
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from blogengine.invalidation import invalidate
+from blogengine.management.commands.generate_static_site import FEED_PATH
+from blogengine.models import Category, Post, Tag
+from blogengine.views import INDEX_PAGE_SIZE
+
+# Synthetic content is marked with this slug prefix, to be replaced on the
+# next seeding
+PREFIX = 'lt-'
+CATEGORIES = 20
+TAGS = 100
+TAGS_PER_POST = 3
+FLATPAGES = 5
+BATCH_SIZE = 500
+
+# Fetched to tell when the server is up. Kept out of the page cache and
+# touching no blog content, so it warms nothing the cold runs measure.
+READY_PATH = '/admin/'
+
+DB_TIMING = re.compile(r'(?:^|,\s*)db;[^,]*desc="(\d+) queries"')
+
+WORDS = (
+    'cache memcached django python query index page latency request '
+    'template render server worker thread process queue socket'
+).split()
+
+CODE = '''```python
+def %(name)s(items, size=%(size)d):
+    """Split *items* into lists of *size*."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+```'''
+
+
+def synthetic_text(rnd, number):
+    """Markdown with a few sections, lists and code blocks."""
+    parts = ['# Post %d' % number]
+    for section in range(rnd.randint(2, 5)):
+        parts.append('## %s' % ' '.join(rnd.sample(WORDS, 3)).title())
+        parts.append(' '.join(rnd.choice(WORDS) for _ in range(80)) + '.')
+        parts.append('\n'.join(
+            '- `%s`' % rnd.choice(WORDS) for _ in range(rnd.randint(2, 5))
+        ))
+        parts.append(CODE % {
+            'name': '_'.join(rnd.sample(WORDS, 2)),
+            'size': rnd.randint(2, 100),
+        })
+    return '\n\n'.join(parts)
+
+
+def seed(count, rnd):
+    """Replace the synthetic corpus with *count* posts."""
+    Post.objects.filter(slug__startswith=PREFIX).delete()
+    Category.objects.filter(slug__startswith=PREFIX).delete()
+    Tag.objects.filter(slug__startswith=PREFIX).delete()
+    FlatPage.objects.filter(url__startswith='/%s' % PREFIX).delete()
+
+    author = User.objects.get_or_create(username='%sauthor' % PREFIX)[0]
+    site = Site.objects.get_current()
+    Category.objects.bulk_create([
+        Category(name='Category %d' % n, description='Category %d' % n,
+                 slug='%scategory-%d' % (PREFIX, n))
+        for n in range(CATEGORIES)
+    ])
+    Tag.objects.bulk_create([
+        Tag(name='Tag %d' % n, description='Tag %d' % n,
+            slug='%stag-%d' % (PREFIX, n))
+        for n in range(TAGS)
+    ])
+    categories = list(Category.objects.filter(slug__startswith=PREFIX))
+    tags = list(Tag.objects.filter(slug__startswith=PREFIX))
+    for n in range(FLATPAGES):
+        flatpage = FlatPage.objects.create(
+            url='/%spage-%d/' % (PREFIX, n), title='Page %d' % n,
+            content=synthetic_text(rnd, n),
+        )
+        flatpage.sites.add(site)
+
+    # Posts are created in batches without their save signals; the whole
+    # cache is invalidated once at the end
+    now = timezone.now()
+    for start in range(0, count, BATCH_SIZE):
+        posts = []
+        for n in range(start, min(count, start + BATCH_SIZE)):
+            post = Post(
+                title='Post %d' % n, text=synthetic_text(rnd, n),
+                slug='%spost-%d' % (PREFIX, n), author=author, site=site,
+                category=rnd.choice(categories),
+                pub_date=now - timedelta(hours=n),
+            )
+            post.render_text()
+            posts.append(post)
+        Post.objects.bulk_create(posts)
+        created = Post.objects.filter(
+            slug__in=[post.slug for post in posts]
+        ).values_list('pk', flat=True)
+        Post.tag.through.objects.bulk_create([
+            Post.tag.through(post_id=pk, tag_id=tag.pk)
+            for pk in created
+            for tag in rnd.sample(tags, TAGS_PER_POST)
+        ])
+    invalidate('posts', 'flatpages')
+    cache.clear()
+
+
+def url_groups(per_group, rnd):
+    """Map each kind of page to the paths measured for it."""
+    def sample(paths):
+        paths = list(paths)
+        return sorted(rnd.sample(paths, min(per_group, len(paths))))
+
+    posts = Post.objects.only('pub_date', 'slug')
+    pages = (posts.count() + INDEX_PAGE_SIZE - 1) // INDEX_PAGE_SIZE
+    groups = {
+        'index': ['/'],
+        # The last pages, where offset pagination is slowest
+        'pagination': [
+            '/?page=%d' % page
+            for page in range(max(2, pages - per_group + 1), pages + 1)
+        ],
+        'post': sample(post.get_absolute_url() for post in posts),
+        'category': sample(
+            '/category/%s/' % slug
+            for slug in Category.objects.values_list('slug', flat=True)
+        ),
+        'tag': sample(
+            '/tag/%s/' % slug
+            for slug in Tag.objects.values_list('slug', flat=True)
+        ),
+        'flatpage': sample(FlatPage.objects.values_list('url', flat=True)),
+        'feed': [FEED_PATH],
+    }
+    return dict((name, paths) for name, paths in groups.items() if paths)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def fetch(url):
+    """Return the status, seconds taken and SQL queries of a GET of *url*."""
+    request = urllib2.Request(url, headers={'Accept-Encoding': 'gzip'})
+    start = time.time()
+    try:
+        response = urllib2.urlopen(request, timeout=60)
+    except urllib2.HTTPError as e:
+        response = e
+    response.read()
+    elapsed = time.time() - start
+    match = DB_TIMING.search(response.info().get('Server-Timing', ''))
+    return response.getcode(), elapsed, match and int(match.group(1))
+
+
+def run(base_url, paths, requests, concurrency):
+    """Make *requests* GETs over *paths* from *concurrency* threads."""
+    jobs = Queue()
+    for n in range(requests):
+        jobs.put(base_url + paths[n % len(paths)])
+    results = []
+
+    def worker():
+        while True:
+            url = jobs.get()
+            if url is None:
+                return
+            try:
+                results.append(fetch(url))
+            except (urllib2.URLError, socket.error):
+                results.append((None, 0.0, None))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        jobs.put(None)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    ordered = sorted(seconds for status, seconds, queries in results)
+    queries = [q for status, seconds, q in results if q is not None]
+    return {
+        'requests': len(results),
+        'errors': len([
+            status for status, seconds, q in results if status != 200
+        ]),
+        'requests_per_sec': len(results) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(ordered, 0.5) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'queries_per_request': (
+            float(sum(queries)) / len(queries) if queries else None
+        ),
+    }
+
+
+class Server(object):
+    """gunicorn serving the blog, timing the share *sample_rate* of requests."""
+    def __init__(self, address, workers, log, sample_rate=0):
+        self.address = address
+        self.workers = workers
+        self.log = log
+        self.sample_rate = sample_rate
+        self.process = None
+
+    @property
+    def url(self):
+        return 'http://%s' % self.address
+
+    def start(self):
+        env = dict(
+            os.environ,
+            BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE=str(self.sample_rate),
+        )
+        try:
+            self.process = subprocess.Popen(
+                ['gunicorn', 'blog_ng.wsgi', '--bind', self.address,
+                 '--workers', str(self.workers)],
+                env=env, stdout=self.log, stderr=self.log,
+            )
+        except OSError:
+            raise CommandError("gunicorn is required to start the server")
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise CommandError("gunicorn exited at startup")
+            try:
+                urllib2.urlopen(self.url + READY_PATH, timeout=5).read()
+                return
+            except (urllib2.URLError, socket.error):
+                time.sleep(0.2)
+        self.stop()
+        raise CommandError("gunicorn did not answer within 30 seconds")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.process = None
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=open(os.devnull, 'w'),
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Measure requests/sec, latency and queries of the blog's pages."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--seed-posts',
+            action='store',
+            type='int',
+            dest='seed_posts',
+            default=0,
+            help='Replace the synthetic corpus with this many posts first.'
+        ),
+        make_option(
+            '--server',
+            action='store',
+            dest='server',
+            default=None,
+            help='URL of a running server, instead of starting gunicorn.'
+        ),
+        make_option(
+            '--bind',
+            action='store',
+            dest='bind',
+            default='127.0.0.1:8765',
+            help='Address of the gunicorn started (default %default).'
+        ),
+        make_option(
+            '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=4,
+            help='gunicorn workers (default %default).'
+        ),
+        make_option(
+            '-c', '--concurrency',
+            action='store',
+            type='int',
+            dest='concurrency',
+            default=8,
+            help='Concurrent clients (default %default).'
+        ),
+        make_option(
+            '-n', '--requests',
+            action='store',
+            type='int',
+            dest='requests',
+            default=500,
+            help='Warm requests per group of pages (default %default).'
+        ),
+        make_option(
+            '--urls',
+            action='store',
+            type='int',
+            dest='urls',
+            default=50,
+            help='Pages measured per group (default %default).'
+        ),
+        make_option(
+            '--seed',
+            action='store',
+            type='int',
+            dest='seed',
+            default=0,
+            help='Seed of the corpus and page choice (default %default).'
+        ),
+        make_option(
+            '-o', '--output',
+            action='store',
+            dest='output',
+            default=None,
+            help='Write the results as JSON to this file.'
+        ),
+        make_option(
+            '--compare',
+            action='store',
+            dest='compare',
+            default=None,
+            help='JSON results of a previous run to compare with.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        if options['seed_posts']:
+            seed(options['seed_posts'], rnd)
+            self.stdout.write("Seeded %d post(s)" % options['seed_posts'])
+        groups = url_groups(options['urls'], rnd)
+
+        server = None
+        base_url = (options['server'] or '').rstrip('/')
+        if not base_url:
+            log = open(os.devnull, 'w')
+            if int(options['verbosity']) > 1:
+                log = None
+            server = Server(options['bind'], options['workers'], log)
+            base_url = server.url
+
+        results = []
+        try:
+            for variant, name, paths in self.runs(groups, server):
+                requests = len(paths)
+                if variant == 'warm':
+                    run(base_url, paths, len(paths), options['concurrency'])
+                    requests = options['requests']
+                result = run(
+                    base_url, paths, requests, options['concurrency']
+                )
+                result.update(group=name, variant=variant)
+                results.append(result)
+
+            if server is not None:
+                # Count the queries without timing, as instrumenting
+                # every request slows it down
+                server.sample_rate = 1
+                queries = {}
+                for variant, name, paths in self.runs(groups, server):
+                    if variant == 'warm':
+                        run(base_url, paths, len(paths), 1)
+                    queries[variant, name] = run(
+                        base_url, paths, len(paths), 1
+                    )['queries_per_request']
+                for result in results:
+                    result['queries_per_request'] = queries[
+                        result['variant'], result['group']
+                    ]
+        finally:
+            if server is not None:
+                server.stop()
+        for result in results:
+            self.stdout.write(self.format(result))
+
+        report = {
+            'revision': git_revision(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'posts': Post.objects.count(),
+            'concurrency': options['concurrency'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=1, sort_keys=True)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(results, json.load(f))
+
+    def runs(self, groups, server):
+        """
+        Yield the variant, name and paths of each run, starting the cold
+        runs on an empty cache.
+        """
+        for variant in ('cold', 'warm'):
+            for name, paths in sorted(groups.items()):
+                if variant == 'cold':
+                    cache.clear()
+                    if server is not None:
+                        server.stop()
+                        server.start()
+                yield variant, name, paths
+
+    def format(self, result):
+        queries = result['queries_per_request']
+        return (
+            "%-5s %-10s %6d req %3d err %8.1f req/s  p50 %7.1fms  "
+            "p95 %7.1fms  p99 %7.1fms  %s queries" % (
+                result['variant'], result['group'], result['requests'],
+                result['errors'], result['requests_per_sec'],
+                result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                '-' if queries is None else '%.1f' % queries,
+            )
+        )
+
+    def compare(self, results, previous):
+        before = dict(
+            ((r['variant'], r['group']), r) for r in previous['results']
+        )
+        self.stdout.write(
+            "Change from %s:" % (previous.get('revision') or 'previous run')
+        )
+        for result in results:
+            old = before.get((result['variant'], result['group']))
+            if not old or not old['requests_per_sec'] or not old['p95_ms']:
+                continue
+            self.stdout.write("%-5s %-10s %+7.1f%% req/s  %+7.1f%% p95" % (
+                result['variant'], result['group'],
+                100.0 * (result['requests_per_sec'] /
+                         old['requests_per_sec'] - 1),
+                100.0 * (result['p95_ms'] / old['p95_ms'] - 1),
+            ))
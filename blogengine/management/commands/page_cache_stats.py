@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand
+
+from blogengine.middleware import page_cache_stats, reset_page_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show the page cache hit and miss counts of all workers."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--reset',
+            action='store_true',
+            dest='reset',
+            default=False,
+            help='Reset the counters after showing them.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        cache = get_cache(settings.CACHE_MIDDLEWARE_ALIAS)
+        stats = page_cache_stats(cache)
+        hits = stats['hit'] + stats['stale']
+        lookups = hits + stats['miss']
+        ratio = 100.0 * hits / lookups if lookups else 0.0
+        self.stdout.write(
+            "hits: %(hit)d, stale hits: %(stale)d, misses: %(miss)d, "
+            "bypassed: %(bypass)d" % stats
+        )
+        self.stdout.write("hit ratio: %.1f%%" % ratio)
+        if not getattr(settings, 'BLOGENGINE_PAGE_CACHE_STATS', False):
+            self.stdout.write(
+                "Counting is off; set BLOGENGINE_PAGE_CACHE_STATS to count."
+            )
+        if options['reset']:
+            reset_page_cache_stats(cache)
@@ -0,0 +1,61 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blogengine.invalidation import invalidate
+from blogengine.markup import render_markdown, renderer_signature
+from blogengine.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the stored HTML of every post whose renderer signature is "
+        "out of date (or of all posts with --all)."
+    )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Re-render every post, not only the stale ones.'
+        ),
+        make_option(
+            '--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=100,
+            help='Number of posts fetched per query.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        signature = renderer_signature()
+        posts = Post.objects.order_by('pk')
+        if not options['all']:
+            posts = posts.exclude(text_html_signature=signature)
+
+        rendered = 0
+        last_pk = 0
+        while True:
+            # Walk the table by primary key so each batch is a cheap range
+            # scan, and write back with update() to skip the save signals.
+            batch = list(
+                posts.filter(pk__gt=last_pk)
+                .values_list('pk', 'text')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            for pk, text in batch:
+                Post.objects.filter(pk=pk).update(
+                    text_html=render_markdown(text),
+                    text_html_signature=signature,
+                    updated_at=timezone.now(),
+                )
+            invalidate(*['post:%d' % pk for pk, text in batch])
+            rendered += len(batch)
+            last_pk = batch[-1][0]
+
+        self.stdout.write("Rendered %d post(s)" % rendered)
@@ -0,0 +1,114 @@
+"""
+Copy the hot cache keys to their owners under a new memcached server list,
+so that switching MEMCACHE_SERVERS doesn't start from a cold cache.
+
+Run it with the current settings, before the switch::
+
+    python manage.py warm_cache_servers "10.0.0.1:11211;10.0.0.2:11211:2"
+
+Keys are only added where missing: with consistent hashing most of them
+stay on the same server, and are left alone there.
+"""
+import os
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import RequestFactory
+from django.utils.cache import _generate_cache_header_key, get_cache_key
+
+from blogengine.invalidation import (
+    CONTENT_VERSION, GENERATION_KEY, GENERATION_TIMEOUT
+)
+from blogengine.management.commands.generate_static_site import (
+    page_fingerprints
+)
+from blogengine.models import Category, Post, Tag
+
+BATCH_SIZE = 500
+
+
+def generation_keys():
+    """Keys of the generations of every dependency blogengine records."""
+    dependencies = ['posts', 'flatpages', CONTENT_VERSION]
+    dependencies.extend(
+        'post:%d' % pk for pk in Post.objects.values_list('pk', flat=True)
+    )
+    for slug in Category.objects.values_list('slug', flat=True):
+        dependencies.extend(['category:%s' % slug, 'category-posts:%s' % slug])
+    for slug in Tag.objects.values_list('slug', flat=True):
+        dependencies.extend(['tag:%s' % slug, 'tag-posts:%s' % slug])
+    return [GENERATION_KEY % dependency for dependency in dependencies]
+
+
+def page_keys(cache):
+    """
+    Keys of the first page of every listing, post and flat page, in both
+    the compressed and the plain copy.
+    """
+    key_prefix = settings.CACHE_MIDDLEWARE_KEY_PREFIX
+    keys = []
+    for path in sorted(page_fingerprints()):
+        for accept_encoding in ('gzip', ''):
+            request = RequestFactory().get(
+                path, HTTP_ACCEPT_ENCODING=accept_encoding
+            )
+            request.LANGUAGE_CODE = settings.LANGUAGE_CODE
+            key = get_cache_key(request, key_prefix, 'GET', cache=cache)
+            if key is not None:
+                keys.append(key)
+        keys.append(_generate_cache_header_key(key_prefix, request))
+    return keys
+
+
+def copy_keys(cache, client, keys, timeout):
+    """
+    Add those of *keys* found in *cache* to the pylibmc *client*, and
+    return how many were added.
+    """
+    copied = 0
+    for start in range(0, len(keys), BATCH_SIZE):
+        found = cache.get_many(keys[start:start + BATCH_SIZE])
+        mapping = dict(
+            (cache.make_key(key), value) for key, value in found.items()
+        )
+        if mapping:
+            failed = client.add_multi(mapping, time=timeout)
+            copied += len(mapping) - len(failed)
+    return copied
+
+
+class Command(BaseCommand):
+    args = '<servers>'
+    help = "Copy the hot cache keys to a new memcached server list."
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the new server list")
+        try:
+            import pylibmc
+        except ImportError:
+            raise CommandError("pylibmc is required to warm memcached")
+
+        params = settings.CACHES[settings.CACHE_MIDDLEWARE_ALIAS]
+        client = pylibmc.Client(
+            args[0].replace(',', ';').split(';'),
+            binary=bool(params.get('BINARY')),
+            username=os.environ.get('MEMCACHE_USERNAME'),
+            password=os.environ.get('MEMCACHE_PASSWORD'),
+        )
+        client.behaviors = params.get('OPTIONS', {})
+
+        cache = get_cache(settings.CACHE_MIDDLEWARE_ALIAS)
+        page_timeout = settings.CACHE_MIDDLEWARE_SECONDS + getattr(
+            settings, 'BLOGENGINE_PAGE_CACHE_STALE_SECONDS', 60 * 60
+        )
+        groups = [
+            (generation_keys(), GENERATION_TIMEOUT),
+            (page_keys(cache), page_timeout),
+        ]
+        total = copied = 0
+        for keys, timeout in groups:
+            total += len(keys)
+            copied += copy_keys(cache, client, keys, timeout)
+        self.stdout.write("Copied %d of %d key(s)" % (copied, total))
@@ -0,0 +1,37 @@
+import markdown2
+
+from django.utils.encoding import force_unicode
+
+from blogengine.instrumentation import timed
+
+try:
+    import pygments
+    PYGMENTS_VERSION = pygments.__version__
+except ImportError:
+    PYGMENTS_VERSION = None
+
+
+MARKDOWN_EXTRAS = ["fenced-code-blocks"]
+
+# Bump this whenever the way we post-process Markdown output changes, so
+# that stored HTML gets rebuilt by the render_posts command.
+RENDERER_VERSION = 1
+
+
+def renderer_signature():
+    """
+    Identify everything that can change the HTML produced for a given text:
+    our own renderer version, the markdown2 and Pygments releases and the
+    extras in use.
+    """
+    return "v%s;markdown2-%s;pygments-%s;%s" % (
+        RENDERER_VERSION,
+        markdown2.__version__,
+        PYGMENTS_VERSION,
+        ",".join(sorted(MARKDOWN_EXTRAS)),
+    )
+
+
+def render_markdown(text):
+    with timed('markdown'):
+        return markdown2.markdown(force_unicode(text), extras=MARKDOWN_EXTRAS)
@@ -0,0 +1,336 @@
+import re
+import time
+from StringIO import StringIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.http import HttpResponseNotModified
+from django.middleware import cache as cache_middleware
+from django.middleware import gzip as gzip_middleware
+from django.utils.cache import (
+    cc_delim_re, get_max_age, learn_cache_key, patch_response_headers
+)
+from django.utils.http import parse_etags, parse_http_date_safe
+
+from .invalidation import CONTENT_VERSION, get_generations, is_current
+from .singleflight import (
+    acquire_lease, in_background, page_lease_name, release_lease, wait_for
+)
+
+STATS_KEY = 'blogengine:page-cache:%s'
+STATS_OUTCOMES = ('hit', 'stale', 'miss', 'bypass')
+STATS_TIMEOUT = 60 * 60 * 24 * 30
+
+# Marks the requests made to refresh a page, with the lease to release
+REFRESH_LEASE = 'blogengine.refresh_lease'
+
+# The suffix GZipMiddleware adds to the ETag of compressed responses
+GZIP_ETAG_SUFFIX = re.compile(r';gzip(?="|$)')
+
+_refresh_handler = None
+
+
+def not_modified(request, response):
+    """Check whether the client already holds *response*, by its validators."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and response.has_header('ETag'):
+        etags = parse_etags(if_none_match)
+        etag = GZIP_ETAG_SUFFIX.sub('', parse_etags(response['ETag'])[0])
+        return '*' in etags or etag in etags
+
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', '')
+    )
+    last_modified = parse_http_date_safe(response.get('Last-Modified', ''))
+    return bool(if_modified_since and last_modified and
+                last_modified <= if_modified_since)
+
+
+def is_anonymous_read(request):
+    """
+    Whether *request* is a GET or HEAD of a cacheable path by a visitor
+    without a session. Decided from the request alone, so it works before
+    the session and auth middleware have run.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return False
+    excluded = getattr(
+        settings, 'BLOGENGINE_PAGE_CACHE_EXCLUDE', ('/admin/', '/__debug__/')
+    )
+    return not request.path.startswith(tuple(excluded))
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header value allows gzip."""
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        if params[0].strip().lower() not in ('gzip', '*'):
+            continue
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def strip_vary_cookie(response):
+    if not response.has_header('Vary'):
+        return
+    headers = [
+        header for header in cc_delim_re.split(response['Vary'])
+        if header.lower() != 'cookie'
+    ]
+    if headers:
+        response['Vary'] = ', '.join(headers)
+    else:
+        del response['Vary']
+
+
+def is_expired(response):
+    """Whether a cached page is past its max-age, though still kept."""
+    fresh_until = getattr(response, 'cache_fresh_until', None)
+    return fresh_until is not None and fresh_until <= time.time()
+
+
+def refresh_page(environ, lease):
+    """
+    Render the page requested with *environ* again, through the whole
+    middleware stack, so the page cache stores the new copy and releases
+    *lease*.
+    """
+    global _refresh_handler
+    if _refresh_handler is None:
+        _refresh_handler = WSGIHandler()
+    environ = dict(environ)
+    environ.update({'wsgi.input': StringIO(), REFRESH_LEASE: lease})
+    # A conditional request would only get a 304 to cache
+    for header in ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE'):
+        environ.pop(header, None)
+    _refresh_handler(environ, lambda status, headers: None).close()
+
+
+def count(cache, outcome):
+    if not getattr(settings, 'BLOGENGINE_PAGE_CACHE_STATS', False):
+        return
+    key = STATS_KEY % outcome
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, STATS_TIMEOUT):
+            cache.incr(key)
+
+
+def page_cache_stats(cache):
+    """
+    Hit, stale hit, miss and bypass counts of the page cache, across all
+    workers.
+    """
+    found = cache.get_many([STATS_KEY % outcome for outcome in STATS_OUTCOMES])
+    return dict(
+        (outcome, found.get(STATS_KEY % outcome, 0))
+        for outcome in STATS_OUTCOMES
+    )
+
+
+def reset_page_cache_stats(cache):
+    cache.delete_many([STATS_KEY % outcome for outcome in STATS_OUTCOMES])
+
+
+class UpdateCacheMiddleware(cache_middleware.UpdateCacheMiddleware):
+    """
+    Cache pages like Django's middleware, but remember the generations of
+    the dependencies the view recorded so the page can be evicted early.
+
+    Pages stay cached for ``BLOGENGINE_PAGE_CACHE_STALE_SECONDS`` past
+    their max-age, so they can still be served while they're refreshed.
+
+    Goes first in MIDDLEWARE_CLASSES so it sees the final response. Only
+    anonymous reads are cached, and for those ``Vary: Cookie`` is dropped:
+    without a session the page can't depend on cookies, and varying on
+    them would give every visitor (and every analytics cookie) a cache
+    entry of their own.
+    """
+    def __init__(self):
+        super(UpdateCacheMiddleware, self).__init__()
+        self.stale_timeout = getattr(
+            settings, 'BLOGENGINE_PAGE_CACHE_STALE_SECONDS', 60 * 60
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Note the site-wide content version before the view reads anything,
+        # to tell whether the page may have been rendered from data changed
+        # in the meantime
+        if getattr(request, '_cache_update_cache', False):
+            request._cache_content_version = get_generations(
+                [CONTENT_VERSION]
+            )[CONTENT_VERSION]
+        return None
+
+    def process_response(self, request, response):
+        try:
+            if not is_anonymous_read(request):
+                return response
+            strip_vary_cookie(response)
+            if response.cookies:
+                # Never share a response that hands out a cookie
+                return response
+
+            dependencies = getattr(request, 'cache_dependencies', None)
+            if dependencies and self._should_update_cache(request, response):
+                generations = get_generations(
+                    set(dependencies) | set([CONTENT_VERSION])
+                )
+                version = generations.pop(CONTENT_VERSION)
+                if version != getattr(request, '_cache_content_version',
+                                      version):
+                    # Something changed while the page was rendered; its
+                    # generations now may be newer than what it shows
+                    return response
+                response.cache_generations = generations
+            return self.store(request, response)
+        finally:
+            # Whatever the outcome, let the other workers render the page
+            lease = getattr(request, '_cache_lease', None)
+            if lease is not None:
+                release_lease(*lease, cache=self.cache)
+
+    def store(self, request, response):
+        """Cache *response* as Django does, but past its max-age."""
+        if not self._should_update_cache(request, response):
+            return response
+        if response.streaming or response.status_code != 200:
+            return response
+
+        timeout = get_max_age(response)
+        if timeout is None:
+            timeout = self.cache_timeout
+        patch_response_headers(response, timeout)
+        if not timeout:
+            return response
+        response.cache_fresh_until = time.time() + timeout
+
+        timeout += self.stale_timeout
+        cache_key = learn_cache_key(
+            request, response, timeout, self.key_prefix, cache=self.cache
+        )
+        if hasattr(response, 'render') and callable(response.render):
+            response.add_post_render_callback(
+                lambda r: self.cache.set(cache_key, r, timeout)
+            )
+        else:
+            self.cache.set(cache_key, response, timeout)
+        return response
+
+
+class FetchFromCacheMiddleware(cache_middleware.FetchFromCacheMiddleware):
+    """
+    Serve cached pages only while their dependencies are unchanged.
+
+    When a page is stale or missing, only the worker holding its lease
+    renders it; the others serve the stale page meanwhile, or wait briefly
+    for the new one when there's none. A page past its max-age is served
+    as is, and refreshed in the background by whoever takes the lease.
+
+    Goes right after UpdateCacheMiddleware and GZipMiddleware, ahead of the
+    session and auth middleware, so a hit costs no session lookup.
+    """
+    def fetch(self, request):
+        """Return the cached page if it's current, and the stale one if not."""
+        response = super(FetchFromCacheMiddleware, self).process_request(
+            request
+        )
+        if response is not None and not is_current(
+                getattr(response, 'cache_generations', None)):
+            return None, response
+        return response, None
+
+    def revalidate(self, request):
+        """Refresh the page in the background, unless it's underway."""
+        lease_name = page_lease_name(request)
+        token = acquire_lease(lease_name, cache=self.cache)
+        if token is not None:
+            in_background(
+                refresh_page, request.META.copy(), (lease_name, token)
+            )
+
+    def process_request(self, request):
+        if not is_anonymous_read(request):
+            request._cache_update_cache = False
+            count(self.cache, 'bypass')
+            return None
+
+        lease = request.META.get(REFRESH_LEASE)
+        if lease is not None:
+            request._cache_lease = lease
+            request._cache_update_cache = True
+            return None
+
+        response, stale = self.fetch(request)
+        outcome = 'hit'
+        if response is not None and is_expired(response):
+            self.revalidate(request)
+            outcome = 'stale'
+        elif response is None:
+            lease_name = page_lease_name(request)
+            token = acquire_lease(lease_name, cache=self.cache)
+            if token is not None:
+                request._cache_lease = (lease_name, token)
+            elif stale is not None:
+                response, outcome = stale, 'stale'
+            else:
+                response = wait_for(lambda: self.fetch(request)[0])
+        if response is None:
+            request._cache_update_cache = True
+            count(self.cache, 'miss')
+            return None
+
+        request._cache_update_cache = False
+        count(self.cache, outcome)
+        if not_modified(request, response):
+            not_modified_response = HttpResponseNotModified()
+            for header in ('ETag', 'Last-Modified'):
+                if response.has_header(header):
+                    not_modified_response[header] = response[header]
+            return not_modified_response
+        return response
+
+
+class GZipMiddleware(gzip_middleware.GZipMiddleware):
+    """
+    Compress responses before the page cache stores them, so a hit serves
+    the compressed body as is.
+
+    The Accept-Encoding header is reduced to ``gzip`` or nothing first, so
+    the page cache, which varies on it, keeps exactly one compressed and
+    one plain copy of each page, whatever header each browser sends. The
+    ``;gzip`` suffix given to the ETag of compressed pages is dropped from
+    If-None-Match, so views compare it with their own ETag.
+
+    Only anonymous reads are compressed: pages with a session may hold
+    CSRF tokens, which compression would expose to BREACH.
+
+    Goes between UpdateCacheMiddleware and FetchFromCacheMiddleware.
+    """
+    def process_request(self, request):
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        request.META['HTTP_ACCEPT_ENCODING'] = (
+            'gzip' if accepts_gzip(accept_encoding) else ''
+        )
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            request.META['HTTP_IF_NONE_MATCH'] = GZIP_ETAG_SUFFIX.sub(
+                '', if_none_match
+            )
+
+    def process_response(self, request, response):
+        if not is_anonymous_read(request):
+            return response
+        return super(GZipMiddleware, self).process_response(
+            request, response
+        )
@@ -1,15 +1,21 @@
 from django.db import models
-from django.db.models.signals import post_save
-from django.core.cache import cache
+from django.db.models.signals import (
+    pre_save, post_save, pre_delete, post_delete, m2m_changed
+)
 from django.contrib.auth.models import User
+from django.contrib.flatpages.models import FlatPage
 from django.contrib.sites.models import Site
 from django.utils.text import slugify
 
+from .invalidation import invalidate
+from .markup import render_markdown, renderer_signature
+
 
 class Tag(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField()
     slug = models.SlugField(max_length=40, unique=True, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self):
         if not self.slug:
@@ -27,6 +33,7 @@ class Category(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField()
     slug = models.SlugField(max_length=40,  unique=True, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self):
         if not self.slug:
@@ -52,6 +59,23 @@ class Post(models.Model):
     site = models.ForeignKey(Site)
     category = models.ForeignKey(Category, blank=True, null=True)
     tag = models.ManyToManyField(Tag, blank=True, null=True)
+    text_html = models.TextField(blank=True, editable=False)
+    text_html_signature = models.CharField(
+        max_length=100, blank=True, editable=False
+    )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def render_text(self):
+        self.text_html = render_markdown(self.text)
+        self.text_html_signature = renderer_signature()
+
+    @property
+    def text_html_is_stale(self):
+        return self.text_html_signature != renderer_signature()
+
+    def save(self, *args, **kwargs):
+        self.render_text()
+        super(Post, self).save(*args, **kwargs)
 
     def get_absolute_url(self):
         return "/%s/%s/%s/" % (
@@ -63,10 +87,120 @@ class Post(models.Model):
 
     class Meta:
         ordering = ["-pub_date"]
+        index_together = [
+            ["pub_date", "id"],
+            ["site", "pub_date"],
+            ["category", "pub_date"],
+        ]
+
+
+def _listing_dependencies(post):
+    # Listings a post appears in, as opposed to the post's own content
+    dependencies = ['posts']
+    if post.category is not None:
+        dependencies.append('category-posts:%s' % post.category.slug)
+    if post.pk is not None:
+        dependencies.extend(
+            'tag-posts:%s' % slug
+            for slug in post.tag.values_list('slug', flat=True)
+        )
+    return dependencies
+
+
+def remember_post(sender, instance, raw, **kwargs):
+    instance._previous = None
+    if instance.pk is not None and not raw:
+        instance._previous = Post.objects.filter(pk=instance.pk).first()
 
 
 def new_post(sender, instance, created, **kwargs):
-    cache.clear()
+    dependencies = ['post:%d' % instance.pk]
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        dependencies.extend(_listing_dependencies(instance))
+    elif (previous.pub_date != instance.pub_date or
+          previous.site_id != instance.site_id or
+          previous.category_id != instance.category_id):
+        dependencies.extend(_listing_dependencies(previous))
+        dependencies.extend(_listing_dependencies(instance))
+    invalidate(*dependencies)
+
+
+def remember_deleted_post(sender, instance, **kwargs):
+    # The tags are gone by the time post_delete fires
+    instance._dependencies = (
+        ['post:%d' % instance.pk] + _listing_dependencies(instance)
+    )
+
+
+def deleted_post(sender, instance, **kwargs):
+    invalidate(*getattr(instance, '_dependencies', ['posts']))
+
+
+def post_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # tag.post_set was changed: *instance* is a Tag
+        if action == 'pre_clear':
+            pk_set = instance.post_set.values_list('pk', flat=True)
+        elif action not in ('post_add', 'post_remove'):
+            return
+        dependencies = ['tag-posts:%s' % instance.slug]
+        dependencies.extend('post:%d' % pk for pk in pk_set)
+    else:
+        if action == 'pre_clear':
+            tags = instance.tag.all()
+        elif action in ('post_add', 'post_remove'):
+            tags = Tag.objects.filter(pk__in=pk_set)
+        else:
+            return
+        dependencies = ['post:%d' % instance.pk]
+        dependencies.extend(
+            'tag-posts:%s' % slug
+            for slug in tags.values_list('slug', flat=True)
+        )
+    invalidate(*dependencies)
+
+
+def remember_slug(sender, instance, raw, **kwargs):
+    instance._previous_slug = None
+    if instance.pk is not None and not raw:
+        instance._previous_slug = sender.objects.filter(
+            pk=instance.pk
+        ).values_list('slug', flat=True).first()
+
+
+def changed_category(sender, instance, **kwargs):
+    slugs = set([instance.slug, getattr(instance, '_previous_slug', None)])
+    invalidate(*[
+        '%s:%s' % (kind, slug)
+        for slug in slugs if slug
+        for kind in ('category', 'category-posts')
+    ])
+
+
+def changed_tag(sender, instance, **kwargs):
+    slugs = set([instance.slug, getattr(instance, '_previous_slug', None)])
+    invalidate(*[
+        '%s:%s' % (kind, slug)
+        for slug in slugs if slug
+        for kind in ('tag', 'tag-posts')
+    ])
+
+def changed_flatpage(sender, **kwargs):
+    invalidate('flatpages')
 
 # Set up signals
+pre_save.connect(remember_post, sender=Post)
 post_save.connect(new_post, sender=Post)
+pre_delete.connect(remember_deleted_post, sender=Post)
+post_delete.connect(deleted_post, sender=Post)
+m2m_changed.connect(post_tags_changed, sender=Post.tag.through)
+pre_save.connect(remember_slug, sender=Category)
+post_save.connect(changed_category, sender=Category)
+post_delete.connect(changed_category, sender=Category)
+pre_save.connect(remember_slug, sender=Tag)
+post_save.connect(changed_tag, sender=Tag)
+post_delete.connect(changed_tag, sender=Tag)
+post_save.connect(changed_flatpage, sender=FlatPage)
+post_delete.connect(changed_flatpage, sender=FlatPage)
+m2m_changed.connect(changed_flatpage, sender=FlatPage.sites.through)
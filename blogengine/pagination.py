@@ -0,0 +1,124 @@
+"""
+Keyset ("seek") pagination for post listings.
+
+Pages are addressed by an opaque cursor naming the last post seen, and
+fetched with a ``(pub_date, id) < (cursor)`` condition instead of an
+``OFFSET``, so deep pages cost the same as the first one and no
+``COUNT(*)`` is needed.
+"""
+import base64
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def encode_cursor(direction, post):
+    raw = '%s|%s|%d' % (direction, post.pub_date.isoformat(), post.pk)
+    return base64.urlsafe_b64encode(raw).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (direction, pub_date, pk) for *cursor*."""
+    try:
+        raw = base64.urlsafe_b64decode(
+            str(cursor) + '=' * (-len(cursor) % 4)
+        )
+        direction, pub_date, pk = raw.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise InvalidCursor('Invalid cursor %r' % (cursor,))
+    if direction not in (NEXT, PREVIOUS) or pub_date is None:
+        raise InvalidCursor('Invalid cursor %r' % (cursor,))
+    return direction, pub_date, pk
+
+
+class KeysetPaginator(object):
+    """Paginate posts newest first, keyed on (pub_date, id)."""
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+
+    def page(self, cursor=None):
+        if not cursor:
+            posts = self._fetch(self.queryset.order_by('-pub_date', '-pk'))
+            return KeysetPage(
+                posts[:self.per_page], self,
+                has_next=len(posts) > self.per_page,
+                has_previous=False,
+            )
+
+        direction, pub_date, pk = decode_cursor(cursor)
+        if direction == NEXT:
+            posts = self._fetch(
+                self.queryset.filter(
+                    Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+                ).order_by('-pub_date', '-pk')
+            )
+            return KeysetPage(
+                posts[:self.per_page], self,
+                has_next=len(posts) > self.per_page,
+                has_previous=True,
+            )
+
+        # Walk backwards from the cursor, then restore newest-first order
+        posts = self._fetch(
+            self.queryset.filter(
+                Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+            ).order_by('pub_date', 'pk')
+        )
+        return KeysetPage(
+            list(reversed(posts[:self.per_page])), self,
+            has_next=True,
+            has_previous=len(posts) > self.per_page,
+        )
+
+    def _fetch(self, queryset):
+        # One extra row tells whether there is a further page
+        return list(queryset[:self.per_page + 1])
+
+
+class KeysetPage(object):
+    cursor_paginated = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<Keyset page of %d>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return encode_cursor(NEXT, self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous():
+            return encode_cursor(PREVIOUS, self.object_list[0])
@@ -0,0 +1,128 @@
+"""
+Single-flight regeneration of cached pages and fragments.
+
+When a cached value goes stale, every worker that reads it would otherwise
+regenerate it at once. Instead, the first one takes a short lease with an
+atomic ``cache.add``, regenerates the value and releases the lease; the
+others serve the stale copy meanwhile, or when there is none, wait briefly
+for the new one.
+
+A lease expires by itself after ``BLOGENGINE_LEASE_TIMEOUT`` seconds, so
+a worker dying while holding one only delays regeneration.
+"""
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .invalidation import get_generations, is_current
+
+LEASE_KEY = 'blogengine:lease:%s'
+LEASE_TIMEOUT = getattr(settings, 'BLOGENGINE_LEASE_TIMEOUT', 10)
+
+# How long to wait for another worker's value when there's no stale copy
+LEASE_WAIT = getattr(settings, 'BLOGENGINE_LEASE_WAIT', 2)
+POLL_INTERVAL = 0.05
+
+# How long fragments are kept past their timeout, to be served stale
+STALE_TIMEOUT = 60 * 60 * 24
+
+
+def acquire_lease(name, cache=cache):
+    """Take the lease on *name*, returning its token, or None if taken."""
+    token = uuid.uuid4().hex
+    if cache.add(LEASE_KEY % name, token, LEASE_TIMEOUT):
+        return token
+    return None
+
+
+def release_lease(name, token, cache=cache):
+    # Don't release a lease that expired and was taken by someone else
+    if cache.get(LEASE_KEY % name) == token:
+        cache.delete(LEASE_KEY % name)
+
+
+def wait_for(fetch, timeout=LEASE_WAIT):
+    """Poll *fetch* until it returns something other than None, or time out."""
+    deadline = time.time() + timeout
+    while True:
+        value = fetch()
+        if value is not None or time.time() >= deadline:
+            return value
+        time.sleep(POLL_INTERVAL)
+
+
+def in_background(function, *args):
+    """
+    Call *function* in a daemon thread, closing the thread's database
+    connections afterwards. With ``BLOGENGINE_BACKGROUND_REFRESH`` off it's
+    called right away instead, for servers that can't spare a thread.
+    """
+    if not getattr(settings, 'BLOGENGINE_BACKGROUND_REFRESH', True):
+        function(*args)
+        return
+
+    def run():
+        try:
+            function(*args)
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    thread = threading.Thread(target=run, name='blogengine-refresh')
+    thread.daemon = True
+    thread.start()
+
+
+def page_lease_name(request):
+    return 'page:%s' % hashlib.md5(
+        request.build_absolute_uri().encode('utf-8')
+    ).hexdigest()
+
+
+def _fresh(entry):
+    if entry is not None:
+        value, expires, generations = entry
+        if time.time() < expires and is_current(generations):
+            return entry
+
+
+def cached_fragment(key, regenerate, timeout, dependencies=()):
+    """
+    Return the value cached under *key*, calling *regenerate* to compute it
+    in one worker at a time when it is missing or stale.
+
+    The value is stale after *timeout* seconds, or as soon as any of
+    *dependencies* is invalidated; a stale value is still returned while
+    another worker regenerates it.
+    """
+    entry = cache.get(key)
+    if _fresh(entry):
+        return entry[0]
+
+    token = acquire_lease(key)
+    if token is None:
+        if entry is not None:
+            return entry[0]
+        entry = wait_for(lambda: _fresh(cache.get(key)))
+        if entry is not None:
+            return entry[0]
+        # The other worker is taking too long, go ahead without a lease
+
+    try:
+        # Taken before regenerating, so changes made meanwhile mark the
+        # new value stale rather than being lost
+        generations = get_generations(dependencies)
+        value = regenerate()
+        cache.set(
+            key, (value, time.time() + timeout, generations),
+            timeout + STALE_TIMEOUT
+        )
+    finally:
+        if token is not None:
+            release_lease(key, token)
+    return value
@@ -0,0 +1,26 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.html import format_html_join
+
+from blogengine.assets import get_bundles
+
+register = template.Library()
+
+TAGS = {
+    '.css': '<link rel="stylesheet" href="{0}">',
+    '.js': '<script src="{0}"></script>',
+}
+
+
+@register.simple_tag
+def bundle(name):
+    """
+    Link the static bundle *name*, or each of its files while DEBUG is on,
+    as they're only bundled by collectstatic.
+    """
+    names = get_bundles()[name] if settings.DEBUG else [name]
+    tag = TAGS[name[name.rindex('.'):]]
+    return format_html_join(
+        '\n', tag, ((staticfiles_storage.url(n),) for n in names)
+    )
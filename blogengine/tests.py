@@ -1,13 +1,49 @@
+import os
+import shutil
+import tempfile
+import time
+
+import gzip
+import json
+import logging
 import markdown2 as markdown
 import feedparser
-
+from StringIO import StringIO
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
 from django.test import TestCase, LiveServerTestCase, Client
+from django.test.client import RequestFactory
+from django.test.signals import template_rendered
+from django.test.utils import override_settings
 from django.utils import timezone
 from django.contrib.flatpages.models import FlatPage
 from django.contrib.sites.models import Site
 from django.contrib.auth.models import User
-
+from south.migration.base import Migrations
+
+from blogengine.assets import BundlingStaticFilesStorage, PrecompressedCling
+from blogengine.fragments import post_summary_key, render_post_summaries
+from blogengine.invalidation import (
+    GENERATION_KEY, content_version, invalidate
+)
+from blogengine.management.commands.warm_cache_servers import (
+    generation_keys, page_keys
+)
+from blogengine.markup import renderer_signature
+from blogengine.middleware import (
+    UpdateCacheMiddleware, page_cache_stats, reset_page_cache_stats
+)
 from blogengine.models import Post, Category, Tag
+from blogengine.singleflight import (
+    acquire_lease, cached_fragment, page_lease_name, release_lease
+)
+from blogengine.views import FEED_ITEMS, listed_posts
 
 
 '''
@@ -162,6 +198,444 @@ class PostTest(TestCase):
             'The Python programming language'
         )
 
+    def test_post_text_rendered_on_save(self):
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my *first* blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Check the HTML is stored along with the renderer signature
+        only_post = Post.objects.all()[0]
+        self.assertTrue(
+            'This is my <em>first</em> blog post' in only_post.text_html
+        )
+        self.assertEquals(only_post.text_html_signature, renderer_signature())
+        self.assertFalse(only_post.text_html_is_stale)
+
+        # Edit the text and check the HTML follows
+        only_post.text = 'This is my *edited* blog post'
+        only_post.save()
+        only_post = Post.objects.all()[0]
+        self.assertTrue(
+            'This is my <em>edited</em> blog post' in only_post.text_html
+        )
+
+    def test_render_posts_command(self):
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my *first* blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Make the stored HTML stale, as after a renderer upgrade
+        Post.objects.update(text_html='', text_html_signature='old')
+        self.assertTrue(Post.objects.all()[0].text_html_is_stale)
+
+        # Re-render
+        call_command('render_posts', stdout=StringIO())
+
+        # Check the HTML was rebuilt
+        only_post = Post.objects.all()[0]
+        self.assertFalse(only_post.text_html_is_stale)
+        self.assertTrue(
+            'This is my <em>first</em> blog post' in only_post.text_html
+        )
+
+    def test_render_text_html_migration(self):
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my *first* blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Drop the stored HTML, as for posts written before it existed
+        Post.objects.update(text_html='', text_html_signature='')
+
+        # Run the data migration
+        migration = [
+            migration for migration in Migrations('blogengine')
+            if migration.name() == '0013_render_post_text_html'
+        ][0]
+        migration.migration_instance().forwards(migration.orm())
+
+        # Check the HTML was rendered
+        only_post = Post.objects.all()[0]
+        self.assertFalse(only_post.text_html_is_stale)
+        self.assertTrue(
+            'This is my <em>first</em> blog post' in only_post.text_html
+        )
+
+    def test_import_export_posts(self):
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the category and tags
+        category = Category(name='python', description='The Python language')
+        category.save()
+        django_tag = Tag(name='django', description='The Django framework')
+        django_tag.save()
+        south_tag = Tag(name='south', description='Migrations')
+        south_tag.save()
+
+        # Create the posts
+        for number in range(3):
+            post = Post()
+            post.title = 'Post %d' % number
+            post.text = 'This is *post* %d' % number
+            post.slug = 'post-%d' % number
+            post.pub_date = timezone.now() - timedelta(days=number)
+            post.author = author
+            post.site = site
+            post.category = category if number else None
+            post.save()
+            post.tag.add(*[django_tag, south_tag][:number])
+        post = Post.objects.get(slug='post-2')
+
+        # Export, then empty the blog
+        output = tempfile.NamedTemporaryFile(suffix='.jsonl')
+        self.addCleanup(output.close)
+        call_command('export_posts', output.name)
+        exported = open(output.name).read()
+        self.assertEquals(len(exported.splitlines()), 6)
+        Post.objects.all().delete()
+        Category.objects.all().delete()
+        Tag.objects.all().delete()
+
+        # Import in batches of two, a few queries per batch
+        version = content_version()
+        Site.objects.clear_cache()
+        with self.assertNumQueries(18):
+            call_command(
+                'import_posts', output.name, batch_size=2, stdout=StringIO()
+            )
+        self.assertNotEquals(content_version(), version)
+
+        # Check everything came back
+        self.assertEquals(Category.objects.count(), 1)
+        self.assertEquals(Tag.objects.count(), 2)
+        self.assertEquals(Post.objects.count(), 3)
+        imported = Post.objects.get(slug='post-2')
+        self.assertEquals(imported.title, post.title)
+        self.assertEquals(imported.pub_date, post.pub_date)
+        self.assertEquals(imported.text_html, post.text_html)
+        self.assertEquals(imported.author, author)
+        self.assertEquals(imported.site.domain, 'example.com')
+        self.assertEquals(imported.category.slug, 'python')
+        self.assertEquals(
+            sorted(imported.tag.values_list('slug', flat=True)),
+            ['django', 'south']
+        )
+        self.assertEquals(
+            list(Post.objects.get(slug='post-0').tag.all()), []
+        )
+
+        # Check exporting again gives the same lines
+        call_command('export_posts', output.name)
+        self.assertEquals(open(output.name).read(), exported)
+
+        # Check importing again only skips
+        out = StringIO()
+        call_command('import_posts', output.name, stdout=out)
+        self.assertTrue('skipped 6 existing' in out.getvalue())
+        self.assertEquals(Post.objects.count(), 3)
+
+        # Check a bad line rolls the whole import back
+        with open(output.name, 'w') as f:
+            f.write(exported.replace('post-', 'new-post-'))
+            f.write('{"type": "post", "slug": "broken"}\n')
+        with self.assertRaises(CommandError):
+            call_command('import_posts', output.name, stdout=StringIO())
+        self.assertEquals(Post.objects.count(), 3)
+
+    def test_content_version(self):
+        version = content_version()
+
+        # Create the category
+        category = Category()
+        category.name = 'python'
+        category.description = 'The Python programming language'
+        category.save()
+        self.assertTrue(category.updated_at is not None)
+
+        # Check the version moved on
+        self.assertNotEquals(content_version(), version)
+        version = content_version()
+
+        # Create the tag
+        tag = Tag()
+        tag.name = 'python'
+        tag.description = 'The Python programming language'
+        tag.save()
+        self.assertTrue(tag.updated_at is not None)
+        self.assertNotEquals(content_version(), version)
+        version = content_version()
+
+        # Delete them
+        tag.delete()
+        self.assertNotEquals(content_version(), version)
+        version = content_version()
+        category.delete()
+        self.assertNotEquals(content_version(), version)
+
+    def test_generate_static_site(self):
+        # Create the category
+        category = Category()
+        category.name = 'python'
+        category.description = 'The Python programming language'
+        category.save()
+
+        # Create the tag
+        tag = Tag()
+        tag.name = 'perl'
+        tag.description = 'The Perl programming language'
+        tag.save()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create two posts
+        posts = []
+        for i in range(2):
+            post = Post()
+            post.title = 'Post number %d' % i
+            post.text = 'This is post number %d' % i
+            post.slug = 'post-number-%d' % i
+            post.pub_date = timezone.now()
+            post.author = author
+            post.site = site
+            post.category = category
+            post.save()
+            post.tag.add(tag)
+            posts.append(post)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        def generate():
+            out = StringIO()
+            call_command(
+                'generate_static_site', directory, workers=1,
+                stdout=out, stderr=StringIO()
+            )
+            return out.getvalue()
+
+        # Render everything
+        self.assertTrue(generate().startswith('Rendered 6 page(s)'))
+        for path in [
+            'index.html', 'feeds/posts/index.xml',
+            'category/python/index.html', 'tag/perl/index.html',
+        ] + [post.get_absolute_url().strip('/') + '/index.html'
+             for post in posts]:
+            self.assertTrue(os.path.exists(os.path.join(directory, path)))
+        with open(os.path.join(directory, 'index.html')) as f:
+            self.assertTrue('Post number 1' in f.read())
+
+        # Check nothing is rendered again when nothing changed
+        self.assertTrue(generate().startswith('Rendered 0 page(s)'))
+
+        # Edit the second post
+        posts[1].title = 'Edited post'
+        posts[1].save()
+
+        # Check only its page and the listings showing it are rendered
+        self.assertTrue(generate().startswith('Rendered 5 page(s)'))
+        with open(os.path.join(directory, 'index.html')) as f:
+            self.assertTrue('Edited post' in f.read())
+
+        # Delete the first post and check its page goes away
+        filename = os.path.join(
+            directory, posts[0].get_absolute_url().strip('/'), 'index.html'
+        )
+        posts[0].delete()
+        self.assertTrue('removed 1' in generate())
+        self.assertFalse(os.path.exists(filename))
+
+        # Publish a flat page, then move it to another site
+        page = FlatPage.objects.create(
+            url='/about/', title='About me', content='All about me'
+        )
+        page.sites.add(Site.objects.get_current())
+        generate()
+        filename = os.path.join(directory, 'about', 'index.html')
+        self.assertTrue(os.path.exists(filename))
+        page.sites.clear()
+        page.content = 'All about me, elsewhere'
+        page.save()
+
+        # Check the page, now not found, has its file removed
+        self.assertTrue('removed 1' in generate())
+        self.assertFalse(os.path.exists(filename))
+
+        # Check rendering everything again drops the files of pages gone
+        # since, though it doesn't read the manifest
+        filename = os.path.join(
+            directory, posts[1].get_absolute_url().strip('/'), 'index.html'
+        )
+        Post.objects.filter(pk=posts[1].pk).delete()
+        out = StringIO()
+        call_command(
+            'generate_static_site', directory, workers=1, all=True,
+            stdout=out, stderr=StringIO()
+        )
+        self.assertTrue('removed 1' in out.getvalue())
+        self.assertFalse(os.path.exists(filename))
+
+    def test_post_summaries(self):
+        cache.clear()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the posts
+        for i in range(2):
+            post = Post()
+            post.title = 'Post %d' % i
+            post.text = 'This is post %d' % i
+            post.slug = 'post-%d' % i
+            post.pub_date = timezone.now()
+            post.author = author
+            post.site = site
+            post.save()
+
+        # Check both summaries are rendered and cached
+        posts = list(listed_posts().order_by('slug'))
+        summaries = render_post_summaries(posts)
+        self.assertTrue('Post 0' in summaries[0])
+        self.assertTrue('Post 1' in summaries[1])
+        found = cache.get_many([post_summary_key(post) for post in posts])
+        self.assertEquals(len(found), 2)
+
+        # Check cached summaries are served as they are
+        cache.set(post_summary_key(posts[0]), 'Cached summary')
+        summaries = render_post_summaries(posts)
+        self.assertEquals(summaries[0], 'Cached summary')
+
+        # Check an edited post gets a new summary
+        posts[0].title = 'Edited post'
+        posts[0].save()
+        posts = list(listed_posts().order_by('slug'))
+        summaries = render_post_summaries(posts)
+        self.assertTrue('Edited post' in summaries[0])
+        self.assertTrue('Post 1' in summaries[1])
+
+    def test_cached_fragment(self):
+        cache.clear()
+        calls = []
+
+        def regenerate():
+            calls.append(1)
+            return 'fragment %d' % len(calls)
+
+        def fragment():
+            return cached_fragment('fragment', regenerate, 60, ['posts'])
+
+        # Check the fragment is computed once
+        self.assertEquals(fragment(), 'fragment 1')
+        self.assertEquals(fragment(), 'fragment 1')
+        self.assertEquals(len(calls), 1)
+
+        # Invalidate it while another worker holds the lease
+        invalidate('posts')
+        token = acquire_lease('fragment')
+        self.assertTrue(token)
+
+        # Check the stale fragment is served meanwhile
+        self.assertEquals(fragment(), 'fragment 1')
+        self.assertEquals(len(calls), 1)
+
+        # Check it's regenerated once the lease is released
+        release_lease('fragment', token)
+        self.assertEquals(fragment(), 'fragment 2')
+        self.assertEquals(fragment(), 'fragment 2')
+
 
 class BaseAcceptanceTest(LiveServerTestCase):
     def setUp(self):
@@ -720,6 +1194,37 @@ class PostViewTest(BaseAcceptanceTest):
         marked_url = '<a href="http://127.0.0.1:8000/">my first blog post</a>'
         self.assertTrue(marked_url in response.content)
 
+    def test_post_page_wrong_date(self):
+        # Create author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create new post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Fetch the post under another year
+        response = self.client.get('/%s/%s/my-first-post/' % (
+            post.pub_date.year - 1, post.pub_date.month
+        ))
+        self.assertEquals(response.status_code, 404)
+
     def test_category_page(self):
         # Create the category
         category = Category()
@@ -917,57 +1422,7 @@ class PostViewTest(BaseAcceptanceTest):
         # Check second post present
         self.assertEquals(response.status_code, 200)
 
-
-class FlatPageViewTest(BaseAcceptanceTest):
-    def test_create_flat_page(self):
-        # Create flat page
-        page = FlatPage()
-        page.url = '/about/'
-        page.title = 'About me'
-        page.content = 'All about me'
-        page.save()
-
-        # Add the site
-        page.sites.add(Site.objects.all()[0])
-        page.save()
-
-        # Check new page saved
-        all_pages = FlatPage.objects.all()
-        self.assertTrue(len(all_pages), 1)
-        only_page = all_pages[0]
-        self.assertEquals(only_page, page)
-
-        # Check data correct
-        self.assertTrue(page.url, '/about/')
-        self.assertTrue(page.title, 'About me')
-        self.assertTrue(page.content, 'All about me')
-
-        # Get URL
-        page_url = only_page.get_absolute_url()
-
-        # Get the page
-        response = self.client.get(page_url)
-        self.assertEquals(response.status_code, 200)
-
-        # Check title and content in response
-        self.assertTrue('About me' in response.content)
-        self.assertTrue('All about me' in response.content)
-
-
-class FeedTest(BaseAcceptanceTest):
-    def test_all_post_feed(self):
-        # Create the categogy
-        category = Category()
-        category.name = 'python'
-        category.description = 'The Python programming language'
-        category.save()
-
-        # Create the tag
-        tag = Tag()
-        tag.name = 'python'
-        tag.description = 'The Python programming language'
-        tag.save()
-
+    def test_post_save_keeps_unrelated_cache_keys(self):
         # Create the author
         author = User.objects.create_user(
             'testuser',
@@ -982,10 +1437,831 @@ class FeedTest(BaseAcceptanceTest):
         site.domain = 'example.com'
         site.save()
 
+        # Store something unrelated to the blog
+        cache.set('unrelated', 'still here')
+
         # Create the post
         post = Post()
         post.title = 'My first post'
-        post.text = 'This is my *first* blog post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Check the unrelated key survived
+        self.assertEquals(cache.get('unrelated'), 'still here')
+
+    def test_cached_pages_invalidated(self):
+        # Create the category
+        category = Category()
+        category.name = 'python'
+        category.description = 'The Python programming language'
+        category.save()
+
+        # Create the tag
+        tag = Tag()
+        tag.name = 'perl'
+        tag.description = 'The Perl programming language'
+        tag.save()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.category = category
+        post.save()
+        post.tag.add(tag)
+
+        # Fetch the pages so they get cached
+        post_url = post.get_absolute_url()
+        for url in ['/', post_url, '/category/python/', '/tag/perl/']:
+            response = self.client.get(url)
+            self.assertTrue('My first post' in response.content)
+
+        # Edit the post
+        post.title = 'My edited post'
+        post.save()
+
+        # Check every page shows the edit
+        for url in ['/', post_url, '/category/python/', '/tag/perl/']:
+            response = self.client.get(url)
+            self.assertTrue('My edited post' in response.content)
+
+        # Rename the category and the tag
+        category.name = 'snakes'
+        category.save()
+        tag.name = 'camels'
+        tag.save()
+
+        # Check the post page shows the new names
+        response = self.client.get(post_url)
+        self.assertTrue('snakes' in response.content)
+        self.assertTrue('camels' in response.content)
+
+        # Remove the tag
+        post.tag.remove(tag)
+
+        # Check the tag page no longer lists the post
+        response = self.client.get('/tag/perl/')
+        self.assertTrue('No posts found' in response.content)
+
+    def test_listing_query_count(self):
+        # Create the category
+        category = Category()
+        category.name = 'python'
+        category.description = 'The Python programming language'
+        category.save()
+
+        # Create the tags
+        tags = []
+        for name in ['perl', 'ruby']:
+            tag = Tag()
+            tag.name = name
+            tag.description = 'A programming language'
+            tag.save()
+            tags.append(tag)
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create a full page of posts, each with a category and two tags
+        for i in range(5):
+            post = Post()
+            post.title = 'Post number %d' % i
+            post.text = 'This is post number %d' % i
+            post.slug = 'post-number-%d' % i
+            post.pub_date = timezone.now()
+            post.author = author
+            post.site = site
+            post.category = category
+            post.save()
+            post.tag.add(*tags)
+
+        # Page of posts, their tags and the flat pages menu, whatever the
+        # number of posts shown
+        for url in ['/', '/category/python/', '/tag/perl/']:
+            cache.clear()
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            self.assertTrue('ruby' in response.content)
+
+        # Page numbers add the count
+        for url in ['/?page=1', '/category/python/?page=1', '/tag/perl/?page=1']:
+            cache.clear()
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+
+    def test_cursor_pagination(self):
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create five posts, two of them published at the same time
+        now = timezone.now()
+        pub_dates = [now, now, now - timedelta(days=1),
+                     now - timedelta(days=2), now - timedelta(days=3)]
+        for i, pub_date in enumerate(pub_dates):
+            post = Post()
+            post.title = 'Post number %d' % i
+            post.text = 'This is post number %d' % i
+            post.slug = 'post-number-%d' % i
+            post.pub_date = pub_date
+            post.author = author
+            post.site = site
+            post.save()
+
+        # Follow the next links through the index
+        seen = []
+        url = '/'
+        while url:
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            page = response.context['page_obj']
+            seen.extend(post.slug for post in page.object_list)
+            url = page.next_cursor and '/?cursor=%s' % page.next_cursor
+
+        # Check every post showed up once, newest first
+        expected = [
+            post.slug for post in Post.objects.order_by('-pub_date', '-pk')
+        ]
+        self.assertEquals(seen, expected)
+
+        # Go back one page from the last one
+        response = self.client.get('/?cursor=%s' % page.previous_cursor)
+        self.assertEquals(
+            [post.slug for post in response.context['page_obj']],
+            expected[2:4]
+        )
+
+        # Check a bogus cursor is a 404
+        response = self.client.get('/?cursor=bogus')
+        self.assertEquals(response.status_code, 404)
+
+    def test_conditional_get(self):
+        # Create the category
+        category = Category()
+        category.name = 'python'
+        category.description = 'The Python programming language'
+        category.save()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.category = category
+        post.save()
+
+        for url in ['/', post.get_absolute_url(), '/category/python/']:
+            # Fetch the page
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            etag = response['ETag']
+            last_modified = response['Last-Modified']
+
+            # Check the view answers with a 304 from its validators alone,
+            # without a query, bypassing the page cache with an unused query
+            # parameter
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    url, {'nocache': 1},
+                    HTTP_IF_NONE_MATCH=etag,
+                    HTTP_IF_MODIFIED_SINCE=last_modified
+                )
+            self.assertEquals(response.status_code, 304)
+
+        # Rename the category
+        category.name = 'snakes'
+        category.save()
+
+        # Check the post page is sent again
+        response = self.client.get(
+            post.get_absolute_url(), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue('snakes' in response.content)
+
+        # Check clients sending only If-Modified-Since get the pages again
+        # after changes no modification time of theirs shows: a deleted
+        # post, and a new flat page in the menu
+        for change in [post.delete, lambda: FlatPage.objects.create(
+                url='/about/', title='About me', content='All about me')]:
+            response = self.client.get('/')
+            last_modified = response['Last-Modified']
+            change()
+            response = self.client.get(
+                '/', {'nocache': 1}, HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+            self.assertEquals(response.status_code, 200)
+
+    @override_settings(BLOGENGINE_PAGE_CACHE_STATS=True)
+    def test_page_cache(self):
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        reset_page_cache_stats(cache)
+
+        # Fetch the index twice, with an analytics cookie
+        self.client.cookies['_ga'] = 'GA1.1.1234'
+        response = self.client.get('/')
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse('Cookie' in response.get('Vary', ''))
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertTrue('My first post' in response.content)
+
+        # Check a visitor with another cookie shares the cached page
+        self.client.cookies['_ga'] = 'GA1.1.5678'
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+
+        # Check the admin is never cached
+        response = self.client.get('/admin/')
+        self.assertEquals(response.status_code, 200)
+
+        self.assertEquals(
+            page_cache_stats(cache),
+            {'hit': 2, 'stale': 0, 'miss': 1, 'bypass': 1}
+        )
+
+        # Check a logged in user bypasses the cache
+        self.client.login(username='testuser', password='password')
+        response = self.client.get('/')
+        self.assertEquals(page_cache_stats(cache)['bypass'], 2)
+
+        # Check nothing is counted with the counters off
+        with override_settings(BLOGENGINE_PAGE_CACHE_STATS=False):
+            response = self.client.get('/')
+        self.assertEquals(page_cache_stats(cache)['bypass'], 2)
+
+    @override_settings(BLOGENGINE_PAGE_CACHE_STATS=True)
+    def test_stale_page_during_regeneration(self):
+        cache.clear()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Cache the index
+        response = self.client.get('/')
+        self.assertTrue('My first post' in response.content)
+
+        # Edit the post while another worker renders the index
+        post.title = 'My edited post'
+        post.save()
+        lease_name = page_lease_name(RequestFactory().get('/'))
+        token = acquire_lease(lease_name)
+        reset_page_cache_stats(cache)
+
+        # Check the stale index is served without rendering it again
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertTrue('My first post' in response.content)
+        self.assertEquals(page_cache_stats(cache)['stale'], 1)
+
+        # Check the index is rendered again once the lease is released
+        release_lease(lease_name, token)
+        response = self.client.get('/')
+        self.assertTrue('My edited post' in response.content)
+        self.assertEquals(page_cache_stats(cache)['miss'], 1)
+
+    def test_lease_released_for_uncached_response(self):
+        cache.clear()
+
+        # Take the lease of a page, as a worker missing it does
+        request = RequestFactory().get('/')
+        lease_name = page_lease_name(request)
+        token = acquire_lease(lease_name)
+        request._cache_lease = (lease_name, token)
+        request._cache_update_cache = True
+
+        # Answer with a response handing out a cookie, which isn't cached
+        response = HttpResponse('Hello')
+        response.set_cookie('csrftoken', 'token')
+        UpdateCacheMiddleware().process_response(request, response)
+
+        # Check the lease was released all the same
+        token = acquire_lease(lease_name)
+        self.assertNotEquals(token, None)
+        release_lease(lease_name, token)
+
+    @override_settings(BLOGENGINE_PAGE_CACHE_STATS=True)
+    def test_edit_during_render_not_cached_as_current(self):
+        cache.clear()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Edit the post while the index is being rendered
+        def edit(sender, template, **kwargs):
+            if template.name == 'blogengine/post_list.html':
+                template_rendered.disconnect(edit)
+                Post.objects.filter(pk=post.pk).update(
+                    title='My edited post', updated_at=timezone.now()
+                )
+                invalidate('post:%d' % post.pk)
+        template_rendered.connect(edit)
+        self.addCleanup(template_rendered.disconnect, edit)
+        response = self.client.get('/')
+        self.assertTrue('My first post' in response.content)
+
+        # Check the page rendered before the edit isn't served as current
+        reset_page_cache_stats(cache)
+        response = self.client.get('/')
+        self.assertTrue('My edited post' in response.content)
+        self.assertEquals(page_cache_stats(cache)['miss'], 1)
+
+    @override_settings(
+        CACHE_MIDDLEWARE_SECONDS=1,
+        BLOGENGINE_BACKGROUND_REFRESH=False,
+        BLOGENGINE_PAGE_CACHE_STATS=True
+    )
+    def test_expired_page_served_while_refreshed(self):
+        cache.clear()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Cache the index
+        response = self.client.get('/')
+        self.assertTrue('My first post' in response.content)
+
+        # Change the post without invalidating anything, and let the
+        # cached index expire
+        Post.objects.filter(pk=post.pk).update(
+            title='My edited post', updated_at=timezone.now()
+        )
+        time.sleep(1.1)
+        reset_page_cache_stats(cache)
+
+        # Check the expired index is served, and refreshed meanwhile
+        response = self.client.get('/')
+        self.assertTrue('My first post' in response.content)
+        self.assertEquals(page_cache_stats(cache)['stale'], 1)
+
+        # Check the refreshed index is served from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertTrue('My edited post' in response.content)
+        self.assertEquals(
+            page_cache_stats(cache),
+            {'hit': 1, 'stale': 1, 'miss': 0, 'bypass': 0}
+        )
+
+    @override_settings(BLOGENGINE_PAGE_CACHE_STATS=True)
+    def test_compressed_page_cache(self):
+        cache.clear()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Fetch the index compressed
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        content = gzip.GzipFile(fileobj=StringIO(response.content)).read()
+        self.assertTrue('My first post' in content)
+
+        # Check another browser accepting gzip gets the same cached copy
+        reset_page_cache_stats(cache)
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/', HTTP_ACCEPT_ENCODING='deflate, gzip;q=0.8, br'
+            )
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        self.assertEquals(
+            gzip.GzipFile(fileobj=StringIO(response.content)).read(), content
+        )
+        self.assertEquals(page_cache_stats(cache)['hit'], 1)
+
+        # Check browsers not accepting gzip get a plain copy of their own
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertTrue('My first post' in response.content)
+        self.assertEquals(page_cache_stats(cache)['miss'], 1)
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEquals(page_cache_stats(cache)['hit'], 2)
+
+        # Check the view answers the compressed page's ETag with a 304 on a
+        # page cache miss, made with an unused query parameter
+        response = self.client.get(
+            '/', {'nocache': 1}, HTTP_ACCEPT_ENCODING='gzip'
+        )
+        etag = response['ETag']
+        self.assertTrue(etag.endswith(';gzip"'))
+        response = self.client.get(
+            '/', {'nocache': 2}, HTTP_ACCEPT_ENCODING='gzip',
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEquals(response.status_code, 304)
+
+        # Check pages with a session aren't compressed
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'session'
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertTrue('My first post' in response.content)
+
+    def test_instrumentation(self):
+        cache.clear()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Capture the performance log
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('blogengine.performance')
+        handlers = logger.handlers
+        logger.handlers = [handler]
+        try:
+            # Check requests that aren't sampled are left alone
+            with override_settings(BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE=0):
+                response = self.client.get('/')
+            self.assertFalse(response.has_header('Server-Timing'))
+            self.assertEquals(len(records), 0)
+
+            # Check a sampled request gets its timings
+            cache.clear()
+            with override_settings(BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE=1):
+                response = self.client.get('/')
+                self.assertTrue('My first post' in response.content)
+                metrics = [
+                    metric.split(';')[0]
+                    for metric in response['Server-Timing'].split(', ')
+                ]
+                self.assertEquals(
+                    metrics, ['db', 'cache', 'markdown', 'render', 'total']
+                )
+                self.assertEquals(len(records), 1)
+                record = json.loads(records[0].getMessage())
+                self.assertEquals(record['path'], '/')
+                self.assertEquals(record['status'], 200)
+                self.assertTrue(record['db_queries'] > 0)
+                # The page and the summary of its post
+                self.assertEquals(record['render_templates'], 2)
+                self.assertTrue(record['render_ms'] > 0)
+
+                # Check a page cache hit shows cache calls but no queries
+                response = self.client.get('/')
+                self.assertTrue('desc="0 queries"' in response['Server-Timing'])
+                record = json.loads(records[1].getMessage())
+                self.assertEquals(record['db_queries'], 0)
+                self.assertTrue(record['cache_calls'] > 0)
+                self.assertEquals(record['render_templates'], 0)
+
+                # Check queries are still counted for assertNumQueries
+                cache.clear()
+                with self.assertNumQueries(3):
+                    self.client.get('/')
+
+                # Check flat pages and the feed time their rendering
+                page = FlatPage()
+                page.url = '/about/'
+                page.title = 'About me'
+                page.content = 'All about me'
+                page.save()
+                page.sites.add(site)
+                for path in ('/about/', '/feeds/posts/'):
+                    self.client.get(path)
+                    record = json.loads(records[-1].getMessage())
+                    self.assertEquals(record['path'], path)
+                    self.assertEquals(record['render_templates'], 1)
+
+            # Check the header isn't stored with the cached page
+            with override_settings(BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE=0):
+                response = self.client.get('/')
+            self.assertFalse(response.has_header('Server-Timing'))
+        finally:
+            logger.handlers = handlers
+
+    def test_warm_cache_keys(self):
+        cache.clear()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my first blog post'
+        post.slug = 'my-first-post'
+        post.pub_date = timezone.now()
+        post.author = author
+        post.site = site
+        post.save()
+
+        # Cache the index
+        response = self.client.get('/')
+        self.assertEquals(response.status_code, 200)
+
+        # Check the generations it depends on are hot keys
+        found = cache.get_many(generation_keys())
+        self.assertTrue(GENERATION_KEY % 'posts' in found)
+        self.assertTrue(GENERATION_KEY % ('post:%d' % post.pk) in found)
+
+        # Check the cached index and its header list are hot keys
+        found = cache.get_many(page_keys(cache))
+        self.assertEquals(len(found), 2)
+        page = [
+            value for key, value in found.items()
+            if key.startswith('views.decorators.cache.cache_page.')
+        ]
+        self.assertTrue('My first post' in page[0].content)
+
+
+class FlatPageViewTest(BaseAcceptanceTest):
+    def test_create_flat_page(self):
+        # Create flat page
+        page = FlatPage()
+        page.url = '/about/'
+        page.title = 'About me'
+        page.content = 'All about me'
+        page.save()
+
+        # Add the site
+        page.sites.add(Site.objects.all()[0])
+        page.save()
+
+        # Check new page saved
+        all_pages = FlatPage.objects.all()
+        self.assertTrue(len(all_pages), 1)
+        only_page = all_pages[0]
+        self.assertEquals(only_page, page)
+
+        # Check data correct
+        self.assertTrue(page.url, '/about/')
+        self.assertTrue(page.title, 'About me')
+        self.assertTrue(page.content, 'All about me')
+
+        # Get URL
+        page_url = only_page.get_absolute_url()
+
+        # Get the page
+        response = self.client.get(page_url)
+        self.assertEquals(response.status_code, 200)
+
+        # Check title and content in response
+        self.assertTrue('About me' in response.content)
+        self.assertTrue('All about me' in response.content)
+
+    def test_flat_page_conditional_get(self):
+        # Create flat page
+        page = FlatPage()
+        page.url = '/about/'
+        page.title = 'About me'
+        page.content = 'All about me'
+        page.save()
+        page.sites.add(Site.objects.all()[0])
+
+        # Get the page
+        response = self.client.get('/about/')
+        self.assertEquals(response.status_code, 200)
+        etag = response['ETag']
+
+        # Check a conditional GET gets a 304
+        response = self.client.get('/about/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+        # Edit the page
+        page.content = 'All about me, edited'
+        page.save()
+
+        # Check the new content is sent
+        response = self.client.get('/about/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue('All about me, edited' in response.content)
+
+
+class FeedTest(BaseAcceptanceTest):
+    def test_all_post_feed(self):
+        # Create the categogy
+        category = Category()
+        category.name = 'python'
+        category.description = 'The Python programming language'
+        category.save()
+
+        # Create the tag
+        tag = Tag()
+        tag.name = 'python'
+        tag.description = 'The Python programming language'
+        tag.save()
+
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create the post
+        post = Post()
+        post.title = 'My first post'
+        post.text = 'This is my *first* blog post'
         post.slug = 'my-first-post'
         post.pub_date = timezone.now()
         post.author = author
@@ -1021,3 +2297,184 @@ class FeedTest(BaseAcceptanceTest):
         self.assertTrue(
             'This is my <em>first</em> blog post' in feed_post.description
         )
+
+    def test_feed_conditional_get(self):
+        # Create the author
+        author = User.objects.create_user(
+            'testuser',
+            'user@example.com',
+            'password'
+        )
+        author.save()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Create more posts than the feed holds
+        for i in range(FEED_ITEMS + 2):
+            post = Post()
+            post.title = 'Post number %d' % i
+            post.text = 'This is post number %d' % i
+            post.slug = 'post-number-%d' % i
+            post.pub_date = timezone.now()
+            post.author = author
+            post.site = site
+            post.save()
+
+        # Fetch the feed
+        response = self.client.get('/feeds/posts/')
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # Check only the newest posts are in it
+        feed = feedparser.parse(response.content)
+        self.assertEquals(len(feed.entries), FEED_ITEMS)
+
+        # Check a reader holding the current version gets a 304
+        etag = response['ETag']
+        response = self.client.get('/feeds/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+        # Edit the newest post
+        post = Post.objects.all()[0]
+        post.text = 'This is an *edited* post'
+        post.save()
+
+        # Check the reader gets the new version
+        response = self.client.get('/feeds/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        feed = feedparser.parse(response.content)
+        self.assertTrue(
+            'This is an <em>edited</em> post' in feed.entries[0].description
+        )
+
+
+class BenchmarkTest(BaseAcceptanceTest):
+    def test_load_test(self):
+        cache.clear()
+
+        # Create the site
+        site = Site()
+        site.name = 'example.com'
+        site.domain = 'example.com'
+        site.save()
+
+        # Keep the performance log of every request quiet
+        logger = logging.getLogger('blogengine.performance')
+        self.addCleanup(setattr, logger, 'handlers', logger.handlers)
+        logger.handlers = [logging.NullHandler()]
+
+        # Seed a small corpus and measure it against the live server
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(output.close)
+        with override_settings(BLOGENGINE_INSTRUMENTATION_SAMPLE_RATE=1):
+            call_command(
+                'load_test', seed_posts=12, server=self.live_server_url,
+                concurrency=1, requests=6, urls=3, output=output.name,
+                stdout=StringIO()
+            )
+        self.assertEquals(Post.objects.count(), 12)
+        self.assertEquals(Post.tag.through.objects.count(), 36)
+        self.assertTrue(Post.objects.filter(text_html__contains='<h2').exists())
+
+        # Check every group was measured cold and warm, without errors
+        report = json.load(open(output.name))
+        self.assertEquals(report['posts'], 12)
+        results = dict(
+            ((result['variant'], result['group']), result)
+            for result in report['results']
+        )
+        groups = ['category', 'feed', 'flatpage', 'index', 'pagination',
+                  'post', 'tag']
+        self.assertEquals(sorted(results), sorted(
+            (variant, group) for variant in ('cold', 'warm') for group in groups
+        ))
+        for result in results.values():
+            self.assertEquals(result['errors'], 0)
+        self.assertEquals(results['cold', 'post']['requests'], 3)
+        self.assertEquals(results['warm', 'post']['requests'], 6)
+
+        # Check queries were counted, and warm pages came from the cache
+        self.assertTrue(results['cold', 'post']['queries_per_request'] > 0)
+        self.assertEquals(results['warm', 'post']['queries_per_request'], 0)
+
+class StaticAssetsTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def collect(self):
+        # Collect two stylesheets and the image one of them refers to
+        storage = BundlingStaticFilesStorage(
+            location=self.root,
+            base_url='/static/',
+            bundles={'bundles/test.css': ['lib/css/a.css', 'css/b.css']}
+        )
+        files = {
+            'lib/css/a.css': 'h1 {\n    background: url("../img/x.png");\n}\n',
+            'css/b.css': '/* Headings */\n' + 'h2 { color: red; }\n' * 20,
+            'lib/img/x.png': 'PNG',
+        }
+        for name, content in files.items():
+            storage.save(name, ContentFile(content))
+        paths = dict((name, (storage, name)) for name in files)
+        return storage, dict(
+            (original, hashed)
+            for original, hashed, processed in storage.post_process(paths)
+        )
+
+    def test_bundle(self):
+        storage, hashed = self.collect()
+
+        # Check the bundle is minified, fingerprinted and refers to the
+        # fingerprinted image from its own directory
+        bundle = hashed['bundles/test.css']
+        self.assertTrue(bundle.startswith('bundles/test.'))
+        with storage.open(bundle) as f:
+            content = f.read()
+        self.assertEquals(
+            content,
+            'h1{background:url("../lib/img/%s")}' % (
+                os.path.basename(hashed['lib/img/x.png'])
+            ) + 'h2{color:red}' * 20
+        )
+
+        # Check it has a gzipped copy
+        with storage.open(bundle + '.gz') as f:
+            self.assertEquals(gzip.GzipFile(fileobj=f).read(), content)
+
+    def test_precompressed_cling(self):
+        storage, hashed = self.collect()
+        cling = PrecompressedCling(self.root)
+        path = '/' + hashed['bundles/test.css']
+
+        def get(accept_encoding):
+            started = []
+            body = cling({
+                'REQUEST_METHOD': 'GET',
+                'PATH_INFO': path,
+                'HTTP_ACCEPT_ENCODING': accept_encoding,
+            }, lambda status, headers, exc_info=None: started.append(
+                (status, dict(headers))
+            ))
+            return started[0], ''.join(body)
+
+        # Check the gzipped copy is served to clients accepting it
+        (status, headers), body = get('gzip, deflate')
+        self.assertEquals(status, '200 OK')
+        self.assertEquals(headers['Content-Encoding'], 'gzip')
+        self.assertEquals(headers['Content-Type'], 'text/css')
+        self.assertEquals(headers['Cache-Control'], 'public, max-age=31536000')
+        self.assertEquals(headers['Vary'], 'Accept-Encoding')
+        self.assertEquals(gzip.GzipFile(fileobj=StringIO(body)).read(),
+                          storage.open(hashed['bundles/test.css']).read())
+
+        # Check the plain file is served to the others
+        for accept_encoding in ['', 'gzip;q=0', 'x-gzip']:
+            (status, headers), body = get(accept_encoding)
+            self.assertFalse('Content-Encoding' in headers)
+            self.assertTrue(body.startswith('h1{'))
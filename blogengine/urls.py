@@ -1,20 +1,22 @@
 from django.conf.urls import patterns, url
-from django.views.generic import ListView, DetailView
 from blogengine.models import Post, Category, Tag
-from blogengine.views import CategoryListView, TagListView, PostsFeed
+from blogengine.views import (
+    INDEX_PAGE_SIZE, PostListView, PostDetailView, CategoryListView,
+    TagListView, PostsFeed
+)
 
 
 urlpatterns = patterns('',
     # Index
-    url(r'^(?P<page>\d+)?/?$', ListView.as_view(
+    url(r'^(?P<page>\d+)?/?$', PostListView.as_view(
         model=Post,
-        paginate_by=2,
+        paginate_by=INDEX_PAGE_SIZE,
         ),
         name='index'
         ),
 
     # Individual posts
-    url(r'^(?P<pub_date__year>\d{4})/(?P<pub_date__month>\d{1,2})/(?P<slug>[a-zA-Z0-9-]+)/?$', DetailView.as_view(
+    url(r'^(?P<pub_date__year>\d{4})/(?P<pub_date__month>\d{1,2})/(?P<slug>[a-zA-Z0-9-]+)/?$', PostDetailView.as_view(
         model=Post,
         ),
         name='post'
@@ -1,30 +1,176 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.flatpages import views as flatpage_views
+from django.http import Http404
 from django.shortcuts import render
-from django.views.generic import ListView
-from .models import Category, Post, Tag
+from django.views.generic import ListView, DetailView
+from .fragments import cached_many, render_post_summaries
+from .instrumentation import timed
+from .invalidation import (
+    add_dependencies, content_modified, content_version, post_dependencies
+)
+from .models import Post
+from .pagination import KeysetPaginator, InvalidCursor
 from django.contrib.syndication.views import Feed
-from django.utils.encoding import force_unicode
 from django.utils.safestring import mark_safe
-import markdown2
+from django.views.decorators.http import condition
 
+FEED_ITEMS = getattr(settings, 'BLOGENGINE_FEED_ITEMS', 20)
+INDEX_PAGE_SIZE = getattr(settings, 'BLOGENGINE_INDEX_PAGE_SIZE', 2)
+FEED_ITEM_TIMEOUT = 60 * 60 * 24
 
-class CategoryListView(ListView):
-    def get_queryset(self):
-        slug = self.kwargs['slug']
+
+def feed_item_key(post):
+    # A new modification time gives a new key, so entries never go stale
+    return 'blogengine:feed-item:%d:%s' % (
+        post.pk, post.updated_at.strftime('%Y%m%d%H%M%S%f')
+    )
+
+
+def listed_posts():
+    """
+    Posts with everything the templates show about them, fetched in a
+    constant number of queries however many posts are on the page.
+    """
+    return Post.objects.select_related(
+        'category', 'author', 'site'
+    ).prefetch_related('tag')
+
+
+def content_etag(request, *args, **kwargs):
+    return 'v%s' % content_version()
+
+
+def content_last_modified(request, *args, **kwargs):
+    return content_modified()
+
+
+class ConditionalMixin(object):
+    """
+    Send ETag and Last-Modified validators, and answer a matching
+    conditional GET with 304 before fetching the page's posts or rendering
+    anything.
+
+    The ETag is the site-wide content version, which any change to a post,
+    category, tag or flat page moves on, and Last-Modified the time of that
+    change. Neither needs a query, and both move on whatever the change,
+    deletions and menu changes included.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        view = condition(
+            etag_func=content_etag,
+            last_modified_func=content_last_modified,
+        )(super(ConditionalMixin, self).dispatch)
+        return view(request, *args, **kwargs)
+
+
+class CacheDependencyMixin(object):
+    """
+    Record the posts, categories and tags a page was rendered from, so the
+    page cache can evict it when any of them changes.
+    """
+    def get_cache_dependencies(self, context):
+        return []
+
+    def get_context_data(self, **kwargs):
+        context = super(CacheDependencyMixin, self).get_context_data(**kwargs)
+        add_dependencies(self.request, self.get_cache_dependencies(context))
+        # Every page lists the flat pages in its menu
+        add_dependencies(self.request, ['flatpages'])
+        return context
+
+
+class PostListMixin(ConditionalMixin, CacheDependencyMixin):
+    cursor_kwarg = 'cursor'
+
+    # Dependency bumped when posts enter, leave or move in this listing
+    def get_listing_dependency(self):
+        return 'posts'
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginate with a cursor unless a page number was explicitly asked
+        for, which keeps the old offset-based page links working.
+        """
+        if self.kwargs.get(self.page_kwarg) or \
+                self.page_kwarg in self.request.GET:
+            return super(PostListMixin, self).paginate_queryset(
+                queryset, page_size
+            )
+
+        paginator = KeysetPaginator(queryset, page_size)
         try:
-            category = Category.objects.get(slug=slug)
-            return Post.objects.filter(category=category)
-        except Category.DoesNotExist:
-            return Post.objects.none()
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return (paginator, page, page.object_list, page.has_other_pages())
 
+    def get_context_data(self, **kwargs):
+        context = super(PostListMixin, self).get_context_data(**kwargs)
+        context['post_summaries'] = [
+            mark_safe(summary)
+            for summary in render_post_summaries(context['object_list'])
+        ]
+        return context
+
+    def get_cache_dependencies(self, context):
+        dependencies = [self.get_listing_dependency()]
+        for post in context['object_list']:
+            dependencies.extend(post_dependencies(post))
+        return dependencies
+
+
+class PostListView(PostListMixin, ListView):
+    model = Post
 
-class TagListView(ListView):
     def get_queryset(self):
-        slug = self.kwargs['slug']
-        try:
-            tag = Tag.objects.get(slug=slug)
-            return tag.post_set.all()
-        except Tag.DoesNotExist:
-            return Post.objects.none()
+        return listed_posts()
+
+
+class PostDetailView(ConditionalMixin, CacheDependencyMixin, DetailView):
+    model = Post
+
+    def get_queryset(self):
+        return listed_posts()
+
+    def get_object(self, queryset=None):
+        """
+        Look the post up by its unique slug alone, then check the year and
+        month from the URL in Python so the query stays an index lookup.
+        """
+        post = super(PostDetailView, self).get_object(queryset)
+        if (str(post.pub_date.year) != self.kwargs['pub_date__year'] or
+                post.pub_date.month != int(self.kwargs['pub_date__month'])):
+            raise Http404("No post found matching the query")
+        return post
+
+    def get_cache_dependencies(self, context):
+        return post_dependencies(context['object'])
+
+
+class CategoryListView(PostListMixin, ListView):
+    def get_listing_dependency(self):
+        return 'category-posts:%s' % self.kwargs['slug']
+
+    def get_queryset(self):
+        return listed_posts().filter(category__slug=self.kwargs['slug'])
+
+
+class TagListView(PostListMixin, ListView):
+    def get_listing_dependency(self):
+        return 'tag-posts:%s' % self.kwargs['slug']
+
+    def get_queryset(self):
+        return listed_posts().filter(tag__slug=self.kwargs['slug'])
+
+
+@condition(etag_func=content_etag, last_modified_func=content_last_modified)
+def flatpage(request, url):
+    add_dependencies(request, ['flatpages'])
+    # Returns a plain HttpResponse, so time its rendering here
+    with timed('render'):
+        return flatpage_views.flatpage(request, url)
 
 
 class PostsFeed(Feed):
@@ -32,15 +178,75 @@ class PostsFeed(Feed):
     link = "/feeds/posts/"
     description = "RSS feed - blog posts"
 
+    def __call__(self, request, *args, **kwargs):
+        view = condition(
+            etag_func=self.get_etag,
+            last_modified_func=self.get_last_modified,
+        )(super(PostsFeed, self).__call__)
+        return view(request, *args, **kwargs)
+
+    def get_validators(self, request):
+        """
+        Ids and modification times of the posts in the feed, fetched once
+        per request from the pub_date index without loading any text.
+        """
+        if not hasattr(request, '_feed_validators'):
+            request._feed_validators = list(
+                self.feed_posts().values_list('pk', 'updated_at')
+            )
+        return request._feed_validators
+
+    def get_etag(self, request, *args, **kwargs):
+        validators = self.get_validators(request)
+        return hashlib.md5(
+            ';'.join('%d:%s' % v for v in validators)
+        ).hexdigest()
+
+    def get_last_modified(self, request, *args, **kwargs):
+        # Not the newest updated_at of the items: that goes back in time
+        # when the newest post is deleted
+        return content_modified()
+
+    def get_feed(self, obj, request):
+        feed = super(PostsFeed, self).get_feed(obj, request)
+        add_dependencies(request, ['posts'] + [
+            'post:%d' % pk for pk, updated_at in self.get_validators(request)
+        ])
+
+        # Time writing the feed out like a page's template
+        write = feed.write
+
+        def timed_write(*args, **kwargs):
+            with timed('render'):
+                return write(*args, **kwargs)
+        feed.write = timed_write
+        return feed
+
+    def feed_posts(self):
+        return Post.objects.order_by('-pub_date')[:FEED_ITEMS]
+
     def items(self):
-        return Post.objects.order_by('-pub_date')
+        posts = list(self.feed_posts().defer('text', 'text_html'))
+
+        # Fetch every description in one round trip, and only go to the
+        # database for the ones missing from the cache
+        def fetch(missing):
+            text_html = dict(
+                Post.objects.filter(
+                    pk__in=[post.pk for post in missing]
+                ).values_list('pk', 'text_html')
+            )
+            return [text_html.get(post.pk, '') for post in missing]
+
+        descriptions = cached_many(
+            posts, feed_item_key, fetch, FEED_ITEM_TIMEOUT
+        )
+        for post, description in zip(posts, descriptions):
+            post.feed_description = description
+        return posts
 
     def item_title(self, item):
         return item.title
 
     def item_description(self, item):
-        extras = ["fenced-code-blocks"]
-        content = mark_safe(
-            markdown2.markdown(force_unicode(item.text), extras=extras)
-        )
-        return content
+        return mark_safe(item.feed_description)
@@ -0,0 +1,260 @@
+"""Benchmark pylibmc against memcached or the bundled stand-in
+
+Measures throughput and latency of single and multi-key reads and writes,
+compression, pickling and the client pools, over both protocols, and
+writes the results as JSON for comparing releases::
+
+    python bin/runbench.py --server 127.0.0.1:11211 -o 1.3.0.json
+    python bin/runbench.py --standin -o standin.json --compare 1.3.0.json
+
+Every case runs *ops* calls after a warm-up, with values drawn from a
+seeded generator, so runs on the same machine are comparable. Multi-key
+cases count one call per operation, whatever the number of keys.
+"""
+
+from __future__ import with_statement
+
+import json
+import time
+import random
+import platform
+import threading
+from optparse import OptionParser
+from timeit import default_timer
+
+import pylibmc
+from pylibmc.pools import ClientPool, ThreadMappedPool
+
+from standin import StandIn
+
+VALUE_SIZES = (10, 1000, 100 * 1000)
+KEY_COUNTS = (10, 100)
+COMPRESS_LEVELS = (1, 6, 9)
+THREAD_COUNTS = (1, 4, 16)
+
+class Case(object):
+    """A benchmark: *run* is called with the operation number."""
+
+    def __init__(self, name, protocol, run, setup=None, threads=1,
+                 **params):
+        self.name = name
+        self.protocol = protocol
+        self.run = run
+        self.setup = setup
+        self.threads = threads
+        self.params = params
+
+    @property
+    def id(self):
+        params = "".join(",%s=%s" % item
+                         for item in sorted(self.params.items()))
+        return "%s[%s,threads=%d%s]" % (self.name, self.protocol,
+                                         self.threads, params)
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def measure(case, ops, warmup):
+    """Run *case*, returning ops/sec and latency percentiles."""
+    if case.setup is not None:
+        case.setup()
+    for i in xrange(warmup):
+        case.run(i)
+
+    per_thread = max(1, ops // case.threads)
+    latencies = [[] for i in xrange(case.threads)]
+    def worker(n):
+        times = latencies[n]
+        run = case.run
+        for i in xrange(n * per_thread, (n + 1) * per_thread):
+            start = default_timer()
+            run(i)
+            times.append(default_timer() - start)
+
+    start = default_timer()
+    if case.threads == 1:
+        worker(0)
+    else:
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in xrange(case.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = default_timer() - start
+
+    ordered = sorted(t for times in latencies for t in times)
+    return {"id": case.id, "name": case.name, "protocol": case.protocol,
+            "threads": case.threads, "params": case.params,
+            "ops": len(ordered),
+            "ops_per_sec": len(ordered) / elapsed if elapsed else 0.0,
+            "p50_us": percentile(ordered, 0.5) * 1e6,
+            "p99_us": percentile(ordered, 0.99) * 1e6}
+
+# {{{ Cases
+def make_value(rnd, size):
+    """Somewhat compressible text of *size* bytes, like rendered pages."""
+    words = ["memcached", "pylibmc", "value", "cache",
+             "%d" % rnd.randint(0, 9999)]
+    chunks = []
+    length = 0
+    while length < size:
+        word = rnd.choice(words)
+        chunks.append(word)
+        length += len(word) + 1
+    return " ".join(chunks)[:size]
+
+def make_cases(servers, protocol, seed=0):
+    binary = protocol == "binary"
+    mc = pylibmc.Client(servers, binary=binary)
+    rnd = random.Random(seed)
+    cases = []
+
+    for size in VALUE_SIZES:
+        value = make_value(rnd, size)
+        key = "bench:value:%d" % size
+        cases.append(Case("set", protocol,
+                          lambda i, key=key, value=value: mc.set(key, value),
+                          size=size))
+        cases.append(Case("get", protocol,
+                          lambda i, key=key: mc.get(key),
+                          setup=lambda key=key, value=value: mc.set(key,
+                                                                    value),
+                          size=size))
+    cases.append(Case("get_miss", protocol,
+                      lambda i: mc.get("bench:missing")))
+
+    for count in KEY_COUNTS:
+        mapping = dict(("bench:multi:%d" % n, make_value(rnd, 1000))
+                       for n in xrange(count))
+        keys = mapping.keys()
+        cases.append(Case("set_multi", protocol,
+                          lambda i, mapping=mapping: mc.set_multi(mapping),
+                          keys=count, size=1000))
+        cases.append(Case("get_multi", protocol,
+                          lambda i, keys=keys: mc.get_multi(keys),
+                          setup=lambda mapping=mapping: mc.set_multi(mapping),
+                          keys=count, size=1000))
+
+    codecs = ["zlib"]
+    if pylibmc.support_lz4:
+        codecs.append("lz4")
+    if not pylibmc.support_compression:
+        codecs = []
+    large = make_value(rnd, 100 * 1000)
+    for codec in codecs:
+        cmc = pylibmc.Client(servers, binary=binary, compression=codec)
+        levels = COMPRESS_LEVELS if codec == "zlib" else (-1,)
+        for level in levels:
+            key = "bench:compressed:%s:%d" % (codec, level)
+            def store(i=None, cmc=cmc, key=key, level=level):
+                cmc.set(key, large, min_compress_len=1, compress_level=level)
+            cases.append(Case("set_compressed", protocol, store,
+                              codec=codec, level=level, size=len(large)))
+            cases.append(Case("get_compressed", protocol,
+                              lambda i, cmc=cmc, key=key: cmc.get(key),
+                              setup=store, codec=codec, level=level,
+                              size=len(large)))
+
+    obj = {"title": make_value(rnd, 50), "tags": range(20),
+           "body": make_value(rnd, 1000)}
+    cases.append(Case("set_pickled", protocol,
+                      lambda i: mc.set("bench:pickled", obj)))
+    cases.append(Case("get_pickled", protocol,
+                      lambda i: mc.get("bench:pickled"),
+                      setup=lambda: mc.set("bench:pickled", obj)))
+
+    value = make_value(rnd, 1000)
+    setup = lambda: mc.set("bench:pooled", value)
+    for threads in THREAD_COUNTS:
+        pool = ClientPool(mc, threads)
+        def pooled(i, pool=pool):
+            with pool.reserve(block=True) as pmc:
+                pmc.get("bench:pooled")
+        cases.append(Case("get_pooled", protocol, pooled, setup=setup,
+                          threads=threads, pool="ClientPool", size=1000))
+        if ThreadMappedPool is not None:
+            tpool = ThreadMappedPool(mc)
+            def mapped(i, tpool=tpool):
+                with tpool.reserve() as pmc:
+                    pmc.get("bench:pooled")
+            cases.append(Case("get_pooled", protocol, mapped, setup=setup,
+                              threads=threads, pool="ThreadMappedPool",
+                              size=1000))
+    return cases
+# }}}
+
+def compare(results, previous):
+    """Print each case's change in ops/sec from the *previous* results."""
+    before = dict((r["id"], r) for r in previous["results"])
+    print "\nChange from %s (pylibmc %s):" % (previous.get("file", "previous"),
+                                           previous["pylibmc"])
+    for result in results:
+        old = before.get(result["id"])
+        if old and old["ops_per_sec"]:
+            change = 100.0 * (result["ops_per_sec"] / old["ops_per_sec"] - 1)
+            print "  %-60s %+7.1f%%" % (result["id"], change)
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog [options] [case names]")
+    parser.add_option("--server", default=None,
+                      help="memcached address (default 127.0.0.1:11211)")
+    parser.add_option("--standin", action="store_true", default=False,
+                      help="benchmark against the in-process stand-in")
+    parser.add_option("--protocol", action="append", dest="protocols",
+                      choices=("ascii", "binary"),
+                      help="protocol to benchmark, repeatable (default both)")
+    parser.add_option("-n", "--ops", type="int", default=10000,
+                      help="operations per case (default %default)")
+    parser.add_option("--warmup", type="int", default=100,
+                      help="untimed operations per case (default %default)")
+    parser.add_option("--seed", type="int", default=0,
+                      help="seed of the generated values (default %default)")
+    parser.add_option("-o", "--output", help="write JSON results here")
+    parser.add_option("--compare", help="JSON results of a previous run")
+    options, names = parser.parse_args(argv)
+
+    standin = None
+    if options.standin:
+        standin = StandIn().start()
+        server = "%s:%d" % standin.address
+    else:
+        server = options.server or "127.0.0.1:11211"
+
+    results = []
+    try:
+        for protocol in options.protocols or ("ascii", "binary"):
+            for case in make_cases([server], protocol, options.seed):
+                if names and case.name not in names:
+                    continue
+                result = measure(case, options.ops, options.warmup)
+                results.append(result)
+                print "%-60s %10.0f ops/s  p50 %8.1fus  p99 %8.1fus" % (
+                    result["id"], result["ops_per_sec"], result["p50_us"],
+                    result["p99_us"])
+    finally:
+        if standin is not None:
+            standin.stop()
+
+    report = {"pylibmc": pylibmc.__version__,
+              "libmemcached": pylibmc.libmemcached_version,
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "server": "standin" if standin is not None else server,
+              "ops": options.ops, "seed": options.seed,
+              "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "results": results}
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            previous = json.load(f)
+        previous["file"] = options.compare
+        compare(results, previous)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""In-process stand-in for memcached, for benchmarks where none is running
+
+Speaks enough of the ASCII and binary protocols for everything pylibmc
+does: retrievals, storage commands with and without CAS, delete, incr and
+decr, touch, flush_all and version. Items expire, but are never evicted.
+
+Being pure Python, it's much slower than memcached; numbers measured
+against it compare pylibmc releases and settings with each other, not
+with other clients talking to a real server.
+"""
+
+from __future__ import with_statement
+
+import struct
+import threading
+import time
+import SocketServer
+
+RELATIVE_LIMIT = 60 * 60 * 24 * 30
+
+class Store(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+        self.next_cas = 1
+
+    def _expires(self, exptime):
+        if not exptime:
+            return None
+        if exptime > RELATIVE_LIMIT:
+            return float(exptime)
+        return time.time() + exptime
+
+    def get(self, key):
+        """Return (flags, data, cas) for *key*, or None."""
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            flags, expires, data, cas = item
+            if expires is not None and expires <= time.time():
+                del self.items[key]
+                return None
+            return flags, data, cas
+
+    def store(self, mode, key, flags, exptime, data, cas=0):
+        """Store like the *mode* command; return a status word."""
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[1] is not None and \
+                    item[1] <= time.time():
+                item = None
+            if mode == "add" and item is not None:
+                return "NOT_STORED"
+            if mode in ("replace", "append", "prepend") and item is None:
+                return "NOT_STORED"
+            if cas:
+                if item is None:
+                    return "NOT_FOUND"
+                if item[3] != cas:
+                    return "EXISTS"
+            if mode == "append":
+                flags, exptime, data = item[0], None, item[2] + data
+            elif mode == "prepend":
+                flags, exptime, data = item[0], None, data + item[2]
+            expires = item[1] if exptime is None else self._expires(exptime)
+            self.items[key] = (flags, expires, data, self.next_cas)
+            self.next_cas += 1
+            return "STORED"
+
+    def delete(self, key):
+        with self.lock:
+            return self.items.pop(key, None) is not None
+
+    def incr(self, key, delta, initial=None, exptime=0):
+        """Add *delta* (negative to decrement); return the value, or None."""
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[1] is not None and \
+                    item[1] <= time.time():
+                item = None
+            if item is None:
+                if initial is None:
+                    return None
+                value, flags, expires = initial, 0, self._expires(exptime)
+            else:
+                if not item[2].isdigit():
+                    raise ValueError("non-numeric value")
+                value = max(0, int(item[2]) + delta) % 2 ** 64
+                flags, expires = item[0], item[1]
+            self.items[key] = (flags, expires, str(value), self.next_cas)
+            self.next_cas += 1
+            return value
+
+    def touch(self, key, exptime):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return False
+            self.items[key] = (item[0], self._expires(exptime)) + item[2:]
+            return True
+
+    def flush(self):
+        with self.lock:
+            self.items.clear()
+
+# {{{ Binary protocol
+REQUEST_HEADER = struct.Struct("!BBHBBHLLQ")
+RESPONSE_MAGIC = 0x81
+
+(OK, NOT_FOUND, EXISTS, TOO_LARGE, INVALID, NOT_STORED,
+ NON_NUMERIC) = range(7)
+UNKNOWN_COMMAND = 0x81
+
+GETS = {0x00: (False, False), 0x09: (True, False),
+        0x0c: (False, True), 0x0d: (True, True)}
+STORES = {0x01: "set", 0x02: "add", 0x03: "replace", 0x0e: "append",
+          0x0f: "prepend", 0x11: "set", 0x12: "add", 0x13: "replace",
+          0x19: "append", 0x1a: "prepend"}
+QUIET = frozenset((0x09, 0x0d, 0x11, 0x12, 0x13, 0x14, 0x15, 0x16, 0x17,
+                   0x18, 0x19, 0x1a))
+STORE_STATUS = {"STORED": OK, "NOT_STORED": NOT_STORED,
+                "EXISTS": EXISTS, "NOT_FOUND": NOT_FOUND}
+# }}}
+
+class Handler(SocketServer.StreamRequestHandler):
+    version = "1.4.0-standin"
+
+    def handle(self):
+        first = self.rfile.read(1)
+        if not first:
+            return
+        if ord(first) == 0x80:
+            self.handle_binary(first)
+        else:
+            self.handle_ascii(first)
+
+    # {{{ ASCII protocol
+    def handle_ascii(self, first):
+        store = self.server.store
+        line = first + self.rfile.readline()
+        while line:
+            args = line.split()
+            if args:
+                if not self.ascii_command(store, args[0], args[1:]):
+                    return
+                self.wfile.flush()
+            line = self.rfile.readline()
+
+    def ascii_command(self, store, cmd, args):
+        write = self.wfile.write
+        noreply = args and args[-1] == "noreply"
+        if noreply:
+            args = args[:-1]
+        reply = (lambda s: None) if noreply else write
+        if cmd in ("get", "gets"):
+            for key in args:
+                found = store.get(key)
+                if found is not None:
+                    flags, data, cas = found
+                    if cmd == "gets":
+                        write("VALUE %s %d %d %d\r\n%s\r\n"
+                              % (key, flags, len(data), cas, data))
+                    else:
+                        write("VALUE %s %d %d\r\n%s\r\n"
+                              % (key, flags, len(data), data))
+            write("END\r\n")
+        elif cmd in ("set", "add", "replace", "append", "prepend", "cas"):
+            key, flags, exptime, length = args[:4]
+            cas = int(args[4]) if cmd == "cas" else 0
+            data = self.rfile.read(int(length) + 2)[:-2]
+            mode = "set" if cmd == "cas" else cmd
+            reply(store.store(mode, key, int(flags), int(exptime), data,
+                              cas) + "\r\n")
+        elif cmd == "delete":
+            reply("DELETED\r\n" if store.delete(args[0])
+                  else "NOT_FOUND\r\n")
+        elif cmd in ("incr", "decr"):
+            delta = int(args[1]) * (1 if cmd == "incr" else -1)
+            try:
+                value = store.incr(args[0], delta)
+            except ValueError:
+                reply("CLIENT_ERROR cannot increment or decrement "
+                      "non-numeric value\r\n")
+            else:
+                reply("NOT_FOUND\r\n" if value is None else "%d\r\n" % value)
+        elif cmd == "touch":
+            reply("TOUCHED\r\n" if store.touch(args[0], int(args[1]))
+                  else "NOT_FOUND\r\n")
+        elif cmd == "flush_all":
+            store.flush()
+            reply("OK\r\n")
+        elif cmd == "version":
+            write("VERSION %s\r\n" % self.version)
+        elif cmd in ("verbosity", "stats"):
+            reply("OK\r\n" if cmd == "verbosity" else "END\r\n")
+        elif cmd == "quit":
+            return False
+        else:
+            write("ERROR\r\n")
+        return True
+    # }}}
+
+    # {{{ Binary protocol
+    def handle_binary(self, first):
+        store = self.server.store
+        header = first + self.rfile.read(REQUEST_HEADER.size - 1)
+        while len(header) == REQUEST_HEADER.size:
+            (magic, opcode, keylen, extlen, datatype, vbucket, bodylen,
+             opaque, cas) = REQUEST_HEADER.unpack(header)
+            body = self.rfile.read(bodylen)
+            extras = body[:extlen]
+            key = body[extlen:extlen + keylen]
+            value = body[extlen + keylen:]
+            if not self.binary_command(store, opcode, opaque, cas, extras,
+                                       key, value):
+                return
+            # Quiet commands are answered along with the next loud one
+            if opcode not in QUIET:
+                self.wfile.flush()
+            header = self.rfile.read(REQUEST_HEADER.size)
+
+    def respond(self, opcode, opaque, status=OK, extras="", key="",
+                value="", cas=0):
+        self.wfile.write(REQUEST_HEADER.pack(
+            RESPONSE_MAGIC, opcode, len(key), len(extras), 0, status,
+            len(extras) + len(key) + len(value), opaque, cas))
+        self.wfile.write(extras + key + value)
+
+    def binary_command(self, store, opcode, opaque, cas, extras, key,
+                       value):
+        quiet = opcode in QUIET
+        def reply(status=OK, **kwds):
+            if not quiet or status != OK:
+                self.respond(opcode, opaque, status, **kwds)
+        if opcode in GETS:
+            quiet_miss, with_key = GETS[opcode]
+            found = store.get(key)
+            if found is None:
+                if not quiet_miss:
+                    self.respond(opcode, opaque, NOT_FOUND,
+                                 value="Not found")
+            else:
+                flags, data, item_cas = found
+                self.respond(opcode, opaque, extras=struct.pack("!L", flags),
+                             key=key if with_key else "", value=data,
+                             cas=item_cas)
+        elif opcode in STORES:
+            mode = STORES[opcode]
+            if mode in ("append", "prepend"):
+                flags, exptime = 0, 0
+            else:
+                flags, exptime = struct.unpack("!LL", extras)
+            result = store.store(mode, key, flags, exptime, value, cas)
+            status = STORE_STATUS[result]
+            found = store.get(key) if status == OK else None
+            reply(status, cas=found[2] if found else 0)
+        elif opcode in (0x04, 0x14):
+            reply(OK if store.delete(key) else NOT_FOUND)
+        elif opcode in (0x05, 0x06, 0x15, 0x16):
+            delta, initial, exptime = struct.unpack("!QQL", extras)
+            if opcode in (0x06, 0x16):
+                delta = -delta
+            try:
+                result = store.incr(key, delta,
+                                    None if exptime == 0xffffffff
+                                    else initial, exptime)
+            except ValueError:
+                reply(NON_NUMERIC)
+            else:
+                if result is None:
+                    reply(NOT_FOUND)
+                else:
+                    reply(value=struct.pack("!Q", result))
+        elif opcode == 0x1c:
+            exptime, = struct.unpack("!L", extras)
+            reply(OK if store.touch(key, exptime) else NOT_FOUND)
+        elif opcode in (0x08, 0x18):
+            store.flush()
+            reply()
+        elif opcode == 0x0a:
+            reply()
+        elif opcode == 0x0b:
+            reply(value=self.version)
+        elif opcode in (0x07, 0x17):
+            reply()
+            return False
+        else:
+            self.respond(opcode, opaque, UNKNOWN_COMMAND,
+                         value="Unknown command")
+        return True
+    # }}}
+
+class StandIn(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Threaded stand-in server; *port* 0 picks a free one.
+
+    >>> server = StandIn().start()
+    >>> server.address[0]
+    '127.0.0.1'
+    >>> server.stop()
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        SocketServer.TCPServer.__init__(self, (host, port), Handler)
+        self.store = Store()
+
+    @property
+    def address(self):
+        return self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever,
+                                  name="memcached-standin")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == "__main__":
+    import sys
+    port = int(sys.argv[1]) if sys.argv[1:] else 11211
+    server = StandIn(port=port)
+    print "memcached stand-in listening on %s:%d" % server.address
+    server.serve_forever()
@@ -7,10 +7,13 @@ from distutils.core import setup, Extension
 # --with-zlib: use zlib for compressing and decompressing
 # --without-zlib: ^ negated
 # --with-zlib=<dir>: path to zlib if needed
+# --with-lz4: also support the faster lz4 compression codec
+# --with-lz4=<dir>: path to lz4 if needed
 # --with-libmemcached=<dir>: path to libmemcached package if needed
 
 cmd = None
 use_zlib = True
+use_lz4 = False
 pkgdirs = []  # incdirs and libdirs get these
 libs = ["memcached"]
 defs = []
@@ -24,6 +27,7 @@ def append_env(L, e):
 
 append_env(pkgdirs, "LIBMEMCACHED")
 append_env(pkgdirs, "ZLIB")
+append_env(pkgdirs, "LZ4")
 
 # Hack up sys.argv, yay
 unprocessed = []
@@ -34,6 +38,9 @@ for arg in sys.argv[1:]:
     elif arg == "--without-zlib":
         use_zlib = False
         continue
+    elif arg == "--with-lz4":
+        use_lz4 = True
+        continue
     elif arg == "--with-sasl2":
         libs.append("sasl2")
         continue
@@ -44,6 +51,10 @@ for arg in sys.argv[1:]:
            arg.startswith("--with-zlib="):
             pkgdirs.append(arg.split("=", 1)[1])
             continue
+        elif arg.startswith("--with-lz4="):
+            use_lz4 = True
+            pkgdirs.append(arg.split("=", 1)[1])
+            continue
     unprocessed.append(arg)
 sys.argv[1:] = unprocessed
 
@@ -55,6 +66,10 @@ if use_zlib:
     libs.append("z")
     defs.append(("USE_ZLIB", None))
 
+if use_lz4:
+    libs.append("lz4")
+    defs.append(("USE_LZ4", None))
+
 ## OS X non-PPC workaround
 
 # Apple OS X 10.6 with Xcode 4 have Python compiled with PPC but they removed
@@ -39,6 +39,21 @@
    is greater than this (deflate always releases at present) */
 #  define ZLIB_GIL_RELEASE ZLIB_BUFSZ
 #endif
+#ifdef USE_LZ4
+#  include <lz4.h>
+/* The LZ4 block format doesn't record the uncompressed size, so it's stored
+   in front of the compressed data, as four little-endian bytes */
+#  define LZ4_HEADER_SIZE 4
+#  define LZ4_GIL_RELEASE (1 << 14)
+#endif
+#if defined(USE_ZLIB) || defined(USE_LZ4)
+#  define USE_COMPRESSION
+#endif
+#ifdef USE_ZLIB
+#  define PYLIBMC_CODEC_DEFAULT PYLIBMC_CODEC_ZLIB
+#else
+#  define PYLIBMC_CODEC_DEFAULT PYLIBMC_CODEC_LZ4
+#endif
 
 #define PyBool_TEST(t) ((t) ? Py_True : Py_False)
 
@@ -59,6 +74,10 @@ static PylibMC_Client *PylibMC_ClientType_new(PyTypeObject *type,
     if (self != NULL) {
         self->mc = memcached_create(NULL);
         self->sasl_set = false;
+        self->serialize = NULL;
+        self->deserialize = NULL;
+        self->codec = PYLIBMC_CODEC_DEFAULT;
+        self->min_compress_ratio = 0.0;
     }
 
     return self;
@@ -74,6 +93,9 @@ static void PylibMC_ClientType_dealloc(PylibMC_Client *self) {
         memcached_free(self->mc);
     }
 
+    Py_XDECREF(self->serialize);
+    Py_XDECREF(self->deserialize);
+
     self->ob_type->tp_free(self);
 }
 /* }}} */
@@ -81,17 +103,65 @@ static void PylibMC_ClientType_dealloc(PylibMC_Client *self) {
 static int PylibMC_Client_init(PylibMC_Client *self, PyObject *args,
         PyObject *kwds) {
     PyObject *srvs, *srvs_it, *c_srv;
+    PyObject *serialize = Py_None, *deserialize = Py_None;
     unsigned char set_stype = 0, bin = 0, got_server = 0;
-    const char *user = NULL, *pass = NULL;
+    const char *user = NULL, *pass = NULL, *compression = NULL;
+    double min_compress_ratio = 0.0;
     memcached_return rc;
 
-    static char *kws[] = { "servers", "binary", "username", "password", NULL };
+    static char *kws[] = { "servers", "binary", "username", "password",
+                           "serializer", "deserializer", "compression",
+                           "min_compress_ratio", NULL };
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|bzz", kws,
-                                     &srvs, &bin, &user, &pass)) {
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|bzzOOzd", kws,
+                                     &srvs, &bin, &user, &pass,
+                                     &serialize, &deserialize,
+                                     &compression, &min_compress_ratio)) {
+        return -1;
+    }
+
+    if (compression == NULL) {
+        self->codec = PYLIBMC_CODEC_DEFAULT;
+#ifdef USE_ZLIB
+    } else if (!strcmp(compression, "zlib")) {
+        self->codec = PYLIBMC_CODEC_ZLIB;
+#endif
+#ifdef USE_LZ4
+    } else if (!strcmp(compression, "lz4")) {
+        self->codec = PYLIBMC_CODEC_LZ4;
+#endif
+    } else {
+        PyErr_Format(PyExc_ValueError,
+                     "compression %.32s not supported", compression);
         return -1;
     }
 
+    if (min_compress_ratio < 0.0 || min_compress_ratio >= 1.0) {
+        PyErr_SetString(PyExc_ValueError,
+                        "min_compress_ratio must be at least 0 and below 1");
+        return -1;
+    }
+    self->min_compress_ratio = min_compress_ratio;
+
+    if ((serialize != Py_None && !PyCallable_Check(serialize)) ||
+            (deserialize != Py_None && !PyCallable_Check(deserialize))) {
+        PyErr_SetString(PyExc_TypeError,
+                        "serializer and deserializer must be callable");
+        return -1;
+    }
+
+    if (serialize != Py_None) {
+        Py_INCREF(serialize);
+        Py_XDECREF(self->serialize);
+        self->serialize = serialize;
+    }
+
+    if (deserialize != Py_None) {
+        Py_INCREF(deserialize);
+        Py_XDECREF(self->deserialize);
+        self->deserialize = deserialize;
+    }
+
     if ((srvs_it = PyObject_GetIter(srvs)) == NULL) {
         return -1;
     }
@@ -399,14 +469,114 @@ error:
     return rc;
 }
 #endif
+
+#ifdef USE_LZ4
+static int _PylibMC_CompressLZ4(char *value, size_t value_len,
+                                char **result, size_t *result_len) {
+    /* n.b.: like _PylibMC_Deflate, this is called while *not* holding the
+       GIL, and failures just leave the value uncompressed */
+    unsigned char *header;
+    int bound, out_len;
+
+    *result = NULL;
+    *result_len = 0;
+
+    if (value_len > LZ4_MAX_INPUT_SIZE) {
+        return 0;
+    }
+
+    bound = LZ4_compressBound((int)value_len);
+    if ((*result = malloc(LZ4_HEADER_SIZE + bound)) == NULL) {
+        return 0;
+    }
+
+    out_len = LZ4_compress_default(value, *result + LZ4_HEADER_SIZE,
+                                   (int)value_len, bound);
+    if (out_len <= 0 || (size_t)out_len + LZ4_HEADER_SIZE >= value_len) {
+        free(*result);
+        *result = NULL;
+        return 0;
+    }
+
+    header = (unsigned char *)*result;
+    header[0] = value_len & 0xff;
+    header[1] = (value_len >> 8) & 0xff;
+    header[2] = (value_len >> 16) & 0xff;
+    header[3] = (value_len >> 24) & 0xff;
+    *result_len = (size_t)out_len + LZ4_HEADER_SIZE;
+
+    return 1;
+}
+#endif
 /* }}} */
 
-static PyObject *_PylibMC_parse_memcached_value(char *value, size_t size,
-        uint32_t flags) {
+static PyObject *_PylibMC_parse_memcached_value(PylibMC_Client *self,
+        char *value, size_t size, uint32_t flags) {
     PyObject *retval = NULL;
     PyObject *tmp = NULL;
     uint32_t dtype = flags & PYLIBMC_FLAG_TYPES;
 
+#ifdef USE_LZ4
+    PyObject *decompressed = NULL;
+
+    if (flags & PYLIBMC_FLAG_LZ4) {
+        unsigned char *header = (unsigned char *)value;
+        size_t out_len;
+        int rc;
+
+        if (size < LZ4_HEADER_SIZE) {
+            PyErr_SetString(PylibMCExc_MemcachedError,
+                            "Failed to decompress value: truncated");
+            return NULL;
+        }
+
+        out_len = (size_t)header[0] | (size_t)header[1] << 8 |
+                  (size_t)header[2] << 16 | (size_t)header[3] << 24;
+        /* Don't trust the header of a corrupt or foreign value: lz4 can't
+           expand data more than 255 times, nor compress past its limit */
+        if (out_len > LZ4_MAX_INPUT_SIZE ||
+                out_len > (size - LZ4_HEADER_SIZE) * 255) {
+            PyErr_SetString(PylibMCExc_MemcachedError,
+                            "Failed to decompress value: corrupt lz4 header");
+            return NULL;
+        }
+        decompressed = PyString_FromStringAndSize(NULL, out_len);
+        if (decompressed == NULL) {
+            return NULL;
+        }
+
+        if (out_len >= LZ4_GIL_RELEASE) {
+            Py_BEGIN_ALLOW_THREADS;
+            rc = LZ4_decompress_safe(value + LZ4_HEADER_SIZE,
+                                     PyString_AS_STRING(decompressed),
+                                     (int)(size - LZ4_HEADER_SIZE),
+                                     (int)out_len);
+            Py_END_ALLOW_THREADS;
+        } else {
+            rc = LZ4_decompress_safe(value + LZ4_HEADER_SIZE,
+                                     PyString_AS_STRING(decompressed),
+                                     (int)(size - LZ4_HEADER_SIZE),
+                                     (int)out_len);
+        }
+
+        if (rc < 0 || (size_t)rc != out_len) {
+            Py_DECREF(decompressed);
+            PyErr_SetString(PylibMCExc_MemcachedError,
+                            "Failed to decompress value: corrupt lz4 data");
+            return NULL;
+        }
+
+        value = PyString_AS_STRING(decompressed);
+        size = out_len;
+    }
+#else
+    if (flags & PYLIBMC_FLAG_LZ4) {
+        PyErr_SetString(PylibMCExc_MemcachedError,
+            "value for key compressed with lz4, unable to decompress");
+        return NULL;
+    }
+#endif
+
 #if USE_ZLIB
     PyObject *inflated = NULL;
 
@@ -465,6 +635,15 @@ static PyObject *_PylibMC_parse_memcached_value(char *value, size_t size,
         case PYLIBMC_FLAG_PICKLE:
             retval = _PylibMC_Unpickle(value, size);
             break;
+        case PYLIBMC_FLAG_SERIALIZED:
+            if (self->deserialize == NULL) {
+                PyErr_SetString(PylibMCExc_MemcachedError,
+                    "value for key serialized, but no deserializer set");
+                goto cleanup;
+            }
+            retval = PyObject_CallFunction(self->deserialize, "s#",
+                                           value, size);
+            break;
         case PYLIBMC_FLAG_INTEGER:
         case PYLIBMC_FLAG_LONG:
         case PYLIBMC_FLAG_BOOL:
@@ -496,13 +675,19 @@ cleanup:
     Py_XDECREF(inflated);
 #endif
 
+#ifdef USE_LZ4
+    Py_XDECREF(decompressed);
+#endif
+
     Py_XDECREF(tmp);
 
     return retval;
 }
 
-static PyObject *_PylibMC_parse_memcached_result(memcached_result_st *res) {
-        return _PylibMC_parse_memcached_value((char *)memcached_result_value(res),
+static PyObject *_PylibMC_parse_memcached_result(PylibMC_Client *self,
+        memcached_result_st *res) {
+        return _PylibMC_parse_memcached_value(self,
+                                              (char *)memcached_result_value(res),
                                               memcached_result_length(res),
                                               memcached_result_flags(res));
 }
@@ -527,7 +712,8 @@ static PyObject *PylibMC_Client_get(PylibMC_Client *self, PyObject *arg) {
     Py_END_ALLOW_THREADS;
 
     if (mc_val != NULL) {
-        PyObject *r = _PylibMC_parse_memcached_value(mc_val, val_size, flags);
+        PyObject *r = _PylibMC_parse_memcached_value(self, mc_val, val_size,
+                                                     flags);
         free(mc_val);
         return r;
     } else if (error == MEMCACHED_SUCCESS) {
@@ -576,7 +762,7 @@ static PyObject *PylibMC_Client_gets(PylibMC_Client *self, PyObject *arg) {
 
     if (rc == MEMCACHED_SUCCESS && res != NULL) {
         ret = Py_BuildValue("(NL)",
-                            _PylibMC_parse_memcached_result(res),
+                            _PylibMC_parse_memcached_result(self, res),
                             memcached_result_cas(res));
 
         /* we have to fetch the last result from the mget cursor */
@@ -635,23 +821,23 @@ static PyObject *_PylibMC_RunSetCommandSingle(PylibMC_Client *self,
       return NULL;
     }
 
-#ifdef USE_ZLIB
-    if (compress_level == -1) {
-        compress_level = Z_DEFAULT_COMPRESSION;
-    } else if (compress_level < 0 || compress_level > 9) {
+#ifdef USE_COMPRESSION
+    /* -1 is zlib's default level, and ignored by lz4 */
+    if (compress_level < -1 || compress_level > 9) {
         PyErr_SetString(PyExc_ValueError, "compress_level must be between 0 and 9 inclusive");
         return NULL;
     }
 #else
     if (min_compress) {
-      PyErr_SetString(PyExc_TypeError, "min_compress_len without zlib");
+      PyErr_SetString(PyExc_TypeError, "min_compress_len without compression support");
       return NULL;
     }
 #endif
 
     pylibmc_mset serialized = { NULL };
 
-    success = _PylibMC_SerializeValue(key, NULL, value, time, &serialized);
+    success = _PylibMC_SerializeValue(self, key, NULL, value, time,
+                                      &serialized);
 
     if (!success)
         goto cleanup;
@@ -695,16 +881,15 @@ static PyObject *_PylibMC_RunSetCommandMulti(PylibMC_Client *self,
         return NULL;
     }
 
-#ifdef USE_ZLIB
-    if (compress_level == -1) {
-        compress_level = Z_DEFAULT_COMPRESSION;
-    } else if (compress_level < 0 || compress_level > 9) {
+#ifdef USE_COMPRESSION
+    /* -1 is zlib's default level, and ignored by lz4 */
+    if (compress_level < -1 || compress_level > 9) {
         PyErr_SetString(PyExc_ValueError, "compress_level must be between 0 and 9 inclusive");
         return NULL;
     }
 #else
     if (min_compress) {
-      PyErr_SetString(PyExc_TypeError, "min_compress_len without zlib");
+      PyErr_SetString(PyExc_TypeError, "min_compress_len without compression support");
       return NULL;
     }
 #endif
@@ -731,7 +916,7 @@ static PyObject *_PylibMC_RunSetCommandMulti(PylibMC_Client *self,
     Py_ssize_t pos = 0; /* PyDict_Next's 'pos' isn't an incrementing index */
 
     for (idx = 0; PyDict_Next(keys, &pos, &curr_key, &curr_value); idx++) {
-        int success = _PylibMC_SerializeValue(curr_key, key_prefix,
+        int success = _PylibMC_SerializeValue(self, curr_key, key_prefix,
                                               curr_value, time,
                                               &serialized[idx]);
 
@@ -811,7 +996,7 @@ static PyObject *_PylibMC_RunCasCommand(PylibMC_Client *self,
 
     /* TODO: because it's RunSetCommand that does the zlib
        compression, cas can't currently use compressed values. */
-    success = _PylibMC_SerializeValue(key, NULL, value, time, &mset);
+    success = _PylibMC_SerializeValue(self, key, NULL, value, time, &mset);
 
     if (!success || PyErr_Occurred() != NULL) {
         goto cleanup;
@@ -856,7 +1041,8 @@ static void _PylibMC_FreeMset(pylibmc_mset *mset) {
       mset->value_obj = NULL;
 }
 
-static int _PylibMC_SerializeValue(PyObject* key_obj,
+static int _PylibMC_SerializeValue(PylibMC_Client* self,
+                                   PyObject* key_obj,
                                    PyObject* key_prefix,
                                    PyObject* value_obj,
                                    time_t time,
@@ -941,6 +1127,20 @@ static int _PylibMC_SerializeValue(PyObject* key_obj,
         PyObject* tmp = PyNumber_Long(value_obj);
         store_val = PyObject_Str(tmp);
         Py_DECREF(tmp);
+    } else if(value_obj != NULL && self->serialize != NULL) {
+        /* hand it to the client's serializer, which must give a string */
+        Py_INCREF(value_obj);
+        serialized->flags |= PYLIBMC_FLAG_SERIALIZED;
+        store_val = PyObject_CallFunctionObjArgs(self->serialize,
+                                                 value_obj, NULL);
+        Py_DECREF(value_obj);
+        if (store_val != NULL && !PyString_Check(store_val)) {
+            PyErr_Format(PyExc_TypeError,
+                         "serializer must return a str, not %.200s",
+                         store_val->ob_type->tp_name);
+            Py_DECREF(store_val);
+            store_val = NULL;
+        }
     } else if(value_obj != NULL) {
         /* we have no idea what it is, so we'll store it pickled */
         Py_INCREF(value_obj);
@@ -984,6 +1184,8 @@ static bool _PylibMC_RunSetCommand(PylibMC_Client* self,
     int pos;
     bool error = false;
     bool allsuccess = true;
+    uint8_t codec = self->codec;
+    double keep_ratio = 1.0 - self->min_compress_ratio;
 
     Py_BEGIN_ALLOW_THREADS;
 
@@ -994,14 +1196,36 @@ static bool _PylibMC_RunSetCommand(PylibMC_Client* self,
         size_t value_len = (size_t)mset->value_len;
         uint32_t flags = mset->flags;
 
-#ifdef USE_ZLIB
+#ifdef USE_COMPRESSION
         char *compressed_value = NULL;
         size_t compressed_len = 0;
+        uint32_t compressed_flag = PYLIBMC_FLAG_NONE;
 
         if (compress_level && min_compress && value_len >= min_compress) {
-            _PylibMC_Deflate(value, value_len,
-                             &compressed_value, &compressed_len,
-                             compress_level);
+            switch (codec) {
+#ifdef USE_ZLIB
+                case PYLIBMC_CODEC_ZLIB:
+                    _PylibMC_Deflate(value, value_len,
+                                     &compressed_value, &compressed_len,
+                                     compress_level);
+                    compressed_flag = PYLIBMC_FLAG_ZLIB;
+                    break;
+#endif
+#ifdef USE_LZ4
+                case PYLIBMC_CODEC_LZ4:
+                    _PylibMC_CompressLZ4(value, value_len,
+                                         &compressed_value, &compressed_len);
+                    compressed_flag = PYLIBMC_FLAG_LZ4;
+                    break;
+#endif
+            }
+        }
+
+        if (compressed_value != NULL &&
+                compressed_len > value_len * keep_ratio) {
+            /* Not worth decompressing on every read */
+            free(compressed_value);
+            compressed_value = NULL;
         }
 
         if (compressed_value != NULL) {
@@ -1009,7 +1233,7 @@ static bool _PylibMC_RunSetCommand(PylibMC_Client* self,
              * needs to get back at the old *value at some point */
             value = compressed_value;
             value_len = compressed_len;
-            flags |= PYLIBMC_FLAG_ZLIB;
+            flags |= compressed_flag;
         }
 #endif
 
@@ -1023,7 +1247,7 @@ static bool _PylibMC_RunSetCommand(PylibMC_Client* self,
                    value, value_len, mset->time, flags);
         }
 
-#ifdef USE_ZLIB
+#ifdef USE_COMPRESSION
         if (compressed_value != NULL) {
             free(compressed_value);
         }
@@ -1545,7 +1769,7 @@ static PyObject *PylibMC_Client_get_multi(
             goto unpack_error;
 
         /* Parse out value */
-        val = _PylibMC_parse_memcached_result(res);
+        val = _PylibMC_parse_memcached_result(self, res);
         if (val == NULL)
             goto unpack_error;
 
@@ -2016,6 +2240,14 @@ static PyObject *PylibMC_Client_clone(PylibMC_Client *self) {
     Py_BEGIN_ALLOW_THREADS;
     clone->mc = memcached_clone(NULL, self->mc);
     Py_END_ALLOW_THREADS;
+
+    Py_XINCREF(self->serialize);
+    clone->serialize = self->serialize;
+    Py_XINCREF(self->deserialize);
+    clone->deserialize = self->deserialize;
+    clone->codec = self->codec;
+    clone->min_compress_ratio = self->min_compress_ratio;
+
     return (PyObject *)clone;
 }
 /* }}} */
@@ -2076,6 +2308,10 @@ static PyObject *PylibMC_ErrFromMemcached(PylibMC_Client *self,
 }
 
 /* {{{ Pickling */
+/* Looked up once, on first use, instead of on every (un)pickle. */
+static PyObject *_PylibMC_pickle_loads = NULL;
+static PyObject *_PylibMC_pickle_dumps = NULL;
+
 static PyObject *_PylibMC_GetPickles(const char *attname) {
     PyObject *pickle, *pickle_attr;
 
@@ -2100,11 +2336,12 @@ static PyObject *_PylibMC_Unpickle(const char *buff, size_t size) {
     PyObject *pickle_load;
     PyObject *retval = NULL;
 
-    retval = NULL;
-    pickle_load = _PylibMC_GetPickles("loads");
+    if (_PylibMC_pickle_loads == NULL) {
+        _PylibMC_pickle_loads = _PylibMC_GetPickles("loads");
+    }
+    pickle_load = _PylibMC_pickle_loads;
     if (pickle_load != NULL) {
         retval = PyObject_CallFunction(pickle_load, "s#", buff, size);
-        Py_DECREF(pickle_load);
     }
 
     return retval;
@@ -2114,10 +2351,13 @@ static PyObject *_PylibMC_Pickle(PyObject *val) {
     PyObject *pickle_dump;
     PyObject *retval = NULL;
 
-    pickle_dump = _PylibMC_GetPickles("dumps");
+    if (_PylibMC_pickle_dumps == NULL) {
+        _PylibMC_pickle_dumps = _PylibMC_GetPickles("dumps");
+    }
+    pickle_dump = _PylibMC_pickle_dumps;
     if (pickle_dump != NULL) {
+        /* -1 is the highest protocol: the fastest and most compact */
         retval = PyObject_CallFunction(pickle_dump, "Oi", val, -1);
-        Py_DECREF(pickle_dump);
     }
 
     return retval;
@@ -2327,12 +2567,18 @@ by using comma-separation. Good luck with that.\n");
     PyModule_ADD_REF(module, "support_sasl", Py_False);
 #endif
 
-#ifdef USE_ZLIB
+#ifdef USE_COMPRESSION
     PyModule_ADD_REF(module, "support_compression", Py_True);
 #else
     PyModule_ADD_REF(module, "support_compression", Py_False);
 #endif
 
+#ifdef USE_LZ4
+    PyModule_ADD_REF(module, "support_lz4", Py_True);
+#else
+    PyModule_ADD_REF(module, "support_lz4", Py_False);
+#endif
+
     PyModule_AddIntConstant(module, "server_type_tcp", PYLIBMC_SERVER_TCP);
     PyModule_AddIntConstant(module, "server_type_udp", PYLIBMC_SERVER_UDP);
     PyModule_AddIntConstant(module, "server_type_unix", PYLIBMC_SERVER_UNIX);
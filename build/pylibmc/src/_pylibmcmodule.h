@@ -66,12 +66,22 @@ typedef ssize_t Py_ssize_t;
 #define PYLIBMC_FLAG_LONG    (1 << 2)
 /* Note: this is an addition! python-memcached doesn't handle bools. */
 #define PYLIBMC_FLAG_BOOL    (1 << 4)
+/* Also an addition: a value encoded by the client's own serializer. Clients
+ * without the matching deserializer refuse it instead of misreading it. */
+#define PYLIBMC_FLAG_SERIALIZED (1 << 5)
 #define PYLIBMC_FLAG_TYPES   (PYLIBMC_FLAG_PICKLE | PYLIBMC_FLAG_INTEGER | \
-                              PYLIBMC_FLAG_LONG | PYLIBMC_FLAG_BOOL)
+                              PYLIBMC_FLAG_LONG | PYLIBMC_FLAG_BOOL | \
+                              PYLIBMC_FLAG_SERIALIZED)
 /* Modifier flags */
 #define PYLIBMC_FLAG_ZLIB    (1 << 3)
+/* Another addition: compressed with LZ4 rather than zlib. */
+#define PYLIBMC_FLAG_LZ4     (1 << 6)
 /* }}} */
 
+/* Codecs a client can compress values with */
+#define PYLIBMC_CODEC_ZLIB   1
+#define PYLIBMC_CODEC_LZ4    2
+
 typedef memcached_return (*_PylibMC_SetCommand)(memcached_st *, const char *,
         size_t, const char *, size_t, time_t, uint32_t);
 typedef memcached_return (*_PylibMC_IncrCommand)(memcached_st *,
@@ -268,6 +278,14 @@ typedef struct {
     PyObject_HEAD
     memcached_st *mc;
     uint8_t sasl_set;
+    /* Callables for values of other than the native types, or NULL to
+     * pickle them. */
+    PyObject *serialize;
+    PyObject *deserialize;
+    /* Codec for values over min_compress_len, and the share of a value's
+     * size compression must save for the compressed value to be stored. */
+    uint8_t codec;
+    double min_compress_ratio;
 } PylibMC_Client;
 
 /* {{{ Prototypes */
@@ -307,7 +325,8 @@ static PyObject *_PylibMC_Unpickle(const char *, size_t);
 static PyObject *_PylibMC_Pickle(PyObject *);
 static int _PylibMC_CheckKey(PyObject *);
 static int _PylibMC_CheckKeyStringAndSize(char *, Py_ssize_t);
-static int _PylibMC_SerializeValue(PyObject *key_obj,
+static int _PylibMC_SerializeValue(PylibMC_Client *self,
+                                   PyObject *key_obj,
                                    PyObject *key_prefix,
                                    PyObject *value_obj,
                                    time_t time,
@@ -328,6 +347,8 @@ static int _PylibMC_Deflate(char *value, size_t value_len,
 static int _PylibMC_Inflate(char *value, size_t size,
                             char** result, size_t* result_size,
                             char** failure_reason);
+static int _PylibMC_CompressLZ4(char *value, size_t value_len,
+                                char **result, size_t *result_len);
 static bool _PylibMC_IncrDecr(PylibMC_Client *, pylibmc_incr *, size_t);
 
 /* }}} */
@@ -70,20 +70,25 @@ See http://sendapatch.se/projects/pylibmc/
 import _pylibmc
 from .consts import hashers, distributions
 from .client import Client
-from .pools import ClientPool, ThreadMappedPool
+from .pools import ClientPool, ThreadMappedPool, BoundedPool
+from .pipeline import PipelinedClient
+from .nearcache import NearCache, LRUStore
 
 libmemcached_version = _pylibmc.libmemcached_version
 support_compression = _pylibmc.support_compression
+support_lz4 = _pylibmc.support_lz4
 support_sasl = _pylibmc.support_sasl
 
 __version__ = _pylibmc.__version__
 
 def build_info():
-    return ("pylibmc %s for libmemcached %s (compression=%s, sasl=%s)"
+    return ("pylibmc %s for libmemcached %s (compression=%s, lz4=%s, sasl=%s)"
             % (__version__,
                libmemcached_version,
                support_compression,
+               support_lz4,
                support_sasl))
 
 __all__ = ["hashers", "distributions", "Client",
-           "ClientPool", "ThreadMappedPool"]
+           "ClientPool", "ThreadMappedPool", "BoundedPool",
+           "PipelinedClient", "NearCache", "LRUStore"]
@@ -75,10 +75,15 @@ def translate_server_spec(server, port=11211, weight=1):
     return (stype, str(addr), int(port), int(weight))
 
 def translate_server_specs(servers):
+    """Translate each of *servers*, passing translated ones through as is.
+
+    >>> translate_server_specs(["127.0.0.1:11211:2", (1, "127.0.0.2", 11211, 3)])
+    [(1, '127.0.0.1', 11211, 2), (1, '127.0.0.2', 11211, 3)]
+    """
     addr_tups = []
     for server in servers:
         # Anti-pattern for convenience
-        if isinstance(server, tuple) and len(server) == 3:
+        if isinstance(server, tuple) and len(server) in (3, 4):
             addr_tup = server
         else:
             addr_tup = translate_server_spec(server)
@@ -87,7 +92,9 @@ def translate_server_specs(servers):
 
 class Client(_pylibmc.client):
     def __init__(self, servers, behaviors=None, binary=False,
-                 username=None, password=None):
+                 username=None, password=None,
+                 serializer=None, deserializer=None,
+                 compression=None, min_compress_ratio=0.0):
         """Initialize a memcached client instance.
 
         This connects to the servers in *servers*, which will default to being
@@ -99,12 +106,29 @@ class Client(_pylibmc.client):
         SASL authentication is supported if libmemcached supports it (check
         *pylibmc.support_sasl*). Requires both username and password.
         Note that SASL requires *binary*=True.
+
+        Values other than strings, ints, longs and bools are pickled with the
+        highest protocol, unless *serializer* is given: a callable turning
+        such a value into a str, stored under a flag of its own. Values
+        stored that way are decoded with *deserializer*; pickled values are
+        still read, so clients with and without a serializer can share data.
+
+        Values over the *min_compress_len* given to the set commands are
+        compressed with *compression*: "zlib" (the default) or, if pylibmc
+        was built with it (check *pylibmc.support_lz4*), the much faster
+        "lz4". Values are read back whichever codec wrote them. A compressed
+        value is only stored if it's at least *min_compress_ratio* smaller
+        than the original, e.g. 0.2 for a fifth.
         """
         self.binary = binary
         self.addresses = list(servers)
         super(Client, self).__init__(servers=translate_server_specs(servers),
                                      binary=binary, username=username,
-                                     password=password)
+                                     password=password,
+                                     serializer=serializer,
+                                     deserializer=deserializer,
+                                     compression=compression,
+                                     min_compress_ratio=min_compress_ratio)
         if behaviors is not None:
             self.set_behaviors(behaviors)
 
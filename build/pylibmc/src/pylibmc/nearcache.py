@@ -0,0 +1,328 @@
+"""In-process near cache in front of memcached"""
+
+from __future__ import with_statement
+
+import threading
+from time import time
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+import _pylibmc
+
+NotFound = dict(_pylibmc.exceptions)["NotFound"]
+
+class LRUStore(object):
+    """Thread-safe, size-bounded LRU mapping of keys to serialized values.
+
+    At most *max_items* entries and *max_bytes* bytes of values are kept;
+    the least recently used entries are evicted to make room. Values are
+    kept serialized, so every reader gets its own copy.
+
+    One store is meant to be shared by the clients of all threads in a
+    process, each wrapped in a :class:`NearCache`.
+    """
+
+    def __init__(self, max_items=1000, max_bytes=8 * 1024 * 1024):
+        if OrderedDict is None:
+            raise RuntimeError("LRUStore requires Python 2.7")
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        #: Remote version the entries are valid for, and when it was checked
+        self.version = None
+        self.checked = 0
+        self.reset_stats()
+
+    def get(self, key, now):
+        """Return the (data, pickled) pair for *key*, or None."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, data, pickled = entry
+            if expires < now:
+                self.bytes -= len(data)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            # Re-inserting moves the entry to the most recently used end
+            self.entries[key] = entry
+            self.hits += 1
+            return data, pickled
+
+    def put(self, key, data, pickled, expires):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            self.entries[key] = (expires, data, pickled)
+            self.bytes += len(data)
+            while (len(self.entries) > self.max_items or
+                   self.bytes > self.max_bytes):
+                evicted = self.entries.popitem(last=False)[1]
+                self.bytes -= len(evicted[1])
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= len(entry[1])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+        self.expirations = self.invalidations = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            hit_ratio = float(self.hits) / lookups if lookups else 0.0
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_ratio": hit_ratio,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations,
+                    "invalidations": self.invalidations,
+                    "items": len(self.entries), "bytes": self.bytes}
+
+class NearCache(object):
+    """Serve hot keys from process memory, in front of the client *mc*.
+
+    Values read through the near cache are kept in *store* (an
+    :class:`LRUStore`, by default a new one) for up to *ttl* seconds, so
+    repeated reads of the same keys skip the network. *ttl* may also be a
+    callable returning the number of seconds for a given key. Only keys for
+    which *near* returns true are kept, by default all of them.
+
+    The store stays coherent with memcached through the counter at
+    *version_key*: every write of a near-cached key through a NearCache
+    bumps it, and the store is emptied whenever it's seen to have moved.
+    It's checked at most every *check_interval* seconds, which bounds how
+    long other processes may serve a value overwritten elsewhere. As each
+    such write empties every process's store, *near* should pick keys that
+    are read far more often than written. Keys whose values never change
+    once written, or are validated some other way, can be left out of the
+    *versioned* predicate: writing them doesn't bump the version, and other
+    processes may keep serving the value they have for up to *ttl*.
+
+    Anything but reads and writes is passed on to *mc* as is.
+
+    >>> from pylibmc.test import make_test_client
+    >>> mc = make_test_client()
+    >>> nc = NearCache(mc, ttl=60)
+    >>> nc.set("hot", ["value"])
+    True
+    >>> nc.get("hot"), nc.get("hot")
+    (['value'], ['value'])
+    >>> nc.stats()["hits"]
+    1
+    """
+
+    def __init__(self, mc, store=None, ttl=5, check_interval=1,
+                 version_key="pylibmc:near-cache:version", near=None,
+                 versioned=None):
+        self.mc = mc
+        self.store = store if store is not None else LRUStore()
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.version_key = version_key
+        self.near = near or (lambda key: True)
+        self.versioned = versioned or self.near
+
+    def __getattr__(self, name):
+        return getattr(self.mc, name)
+
+    def clone(self):
+        """Clone the client, sharing the store."""
+        return self.__class__(self.mc.clone(), self.store, self.ttl,
+                              self.check_interval, self.version_key,
+                              self.near, self.versioned)
+
+    def stats(self):
+        """Hit, miss, eviction and invalidation counts, items and bytes."""
+        return self.store.stats()
+
+    # {{{ Coherence
+    def _sync(self, now):
+        store = self.store
+        if now - store.checked < self.check_interval:
+            return
+        version = self.mc.get(self.version_key)
+        with store.lock:
+            store.checked = now
+            if version == store.version:
+                return
+            store.version = version
+            store.invalidations += 1
+        store.clear()
+
+    def _bump(self, keys):
+        keys = [key for key in keys if self.near(key)]
+        for key in keys:
+            self.store.discard(key)
+        if not [key for key in keys if self.versioned(key)]:
+            return
+        try:
+            version = self.mc.incr(self.version_key)
+        except NotFound:
+            self.mc.add(self.version_key, 1)
+            version = None
+        store = self.store
+        with store.lock:
+            if version is not None and store.version == version - 1:
+                # Nobody else wrote in between, the rest stays valid
+                store.version = version
+                return
+            store.checked = 0
+        self._sync(time())
+    # }}}
+
+    # {{{ Reads
+    def _keep(self, key, value, now):
+        ttl = self.ttl(key) if callable(self.ttl) else self.ttl
+        if isinstance(value, str):
+            self.store.put(key, value, False, now + ttl)
+        else:
+            self.store.put(key, dumps(value, HIGHEST_PROTOCOL), True,
+                           now + ttl)
+
+    def get(self, key):
+        if not self.near(key):
+            return self.mc.get(key)
+        now = time()
+        self._sync(now)
+        found = self.store.get(key, now)
+        if found is not None:
+            data, pickled = found
+            return loads(data) if pickled else data
+        value = self.mc.get(key)
+        if value is not None:
+            self._keep(key, value, now)
+        return value
+
+    def get_multi(self, keys, key_prefix=None):
+        prefix = key_prefix or ""
+        now = time()
+        self._sync(now)
+        values = {}
+        remote = []
+        for key in keys:
+            found = None
+            if self.near(prefix + key):
+                found = self.store.get(prefix + key, now)
+            if found is None:
+                remote.append(key)
+            else:
+                data, pickled = found
+                values[key] = loads(data) if pickled else data
+        if remote:
+            fetched = self.mc.get_multi(remote, key_prefix=key_prefix)
+            for key, value in fetched.iteritems():
+                if self.near(prefix + key):
+                    self._keep(prefix + key, value, now)
+            values.update(fetched)
+        return values
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+    # }}}
+
+    # {{{ Writes
+    def _write(self, name, key, *args, **kwds):
+        try:
+            return getattr(self.mc, name)(key, *args, **kwds)
+        finally:
+            self._bump([key])
+
+    def set(self, key, *args, **kwds):
+        return self._write("set", key, *args, **kwds)
+
+    def add(self, key, *args, **kwds):
+        return self._write("add", key, *args, **kwds)
+
+    def replace(self, key, *args, **kwds):
+        return self._write("replace", key, *args, **kwds)
+
+    def append(self, key, *args, **kwds):
+        return self._write("append", key, *args, **kwds)
+
+    def prepend(self, key, *args, **kwds):
+        return self._write("prepend", key, *args, **kwds)
+
+    def cas(self, key, *args, **kwds):
+        return self._write("cas", key, *args, **kwds)
+
+    def delete(self, key, *args, **kwds):
+        return self._write("delete", key, *args, **kwds)
+
+    def incr(self, key, *args, **kwds):
+        return self._write("incr", key, *args, **kwds)
+
+    def decr(self, key, *args, **kwds):
+        return self._write("decr", key, *args, **kwds)
+
+    def touch(self, key, *args, **kwds):
+        return self._write("touch", key, *args, **kwds)
+
+    def _write_multi(self, name, keys, *args, **kwds):
+        prefix = kwds.get("key_prefix") or ""
+        keys = list(keys)
+        try:
+            return getattr(self.mc, name)(*((keys,) + args), **kwds)
+        finally:
+            self._bump([prefix + key for key in keys])
+
+    def set_multi(self, mapping, *args, **kwds):
+        prefix = kwds.get("key_prefix") or ""
+        try:
+            return self.mc.set_multi(mapping, *args, **kwds)
+        finally:
+            self._bump([prefix + key for key in mapping])
+
+    def add_multi(self, mapping, *args, **kwds):
+        prefix = kwds.get("key_prefix") or ""
+        try:
+            return self.mc.add_multi(mapping, *args, **kwds)
+        finally:
+            self._bump([prefix + key for key in mapping])
+
+    def delete_multi(self, keys, *args, **kwds):
+        return self._write_multi("delete_multi", keys, *args, **kwds)
+
+    def incr_multi(self, keys, *args, **kwds):
+        return self._write_multi("incr_multi", keys, *args, **kwds)
+
+    def __setitem__(self, key, value):
+        if not self.set(key, value):
+            raise KeyError("failed setting %r" % (key,))
+
+    def __delitem__(self, key):
+        if not self.delete(key):
+            raise KeyError(key)
+
+    def flush_all(self, *args, **kwds):
+        try:
+            return self.mc.flush_all(*args, **kwds)
+        finally:
+            self.store.clear()
+            self.store.checked = 0
+    # }}}
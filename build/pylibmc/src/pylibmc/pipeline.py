@@ -0,0 +1,251 @@
+"""Non-blocking, pipelined access for event-driven programs"""
+
+from __future__ import with_statement
+
+import sys
+import threading
+from Queue import Queue, Empty
+
+#: Operations coalesced into a single get_multi round trip
+_read_ops = frozenset(("get", "get_multi"))
+#: Operations coalesced into set_multi round trips, one per expiry time
+_write_ops = frozenset(("set", "set_multi"))
+
+class PipelineTimeout(Exception):
+    """Raised by :meth:`Future.result` when the result isn't in on time."""
+
+class Future(object):
+    """Result of an operation submitted to a :class:`PipelinedClient`.
+
+    Callbacks added with *add_done_callback* are called with the future
+    once it's resolved, from the connection thread that resolved it. Event
+    loops should hand the result over to their own thread from there, e.g.
+    with Tornado's ``IOLoop.add_callback`` or Twisted's
+    ``reactor.callFromThread``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._callbacks = []
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for and return the result, or raise the operation's error."""
+        if not self._done.wait(timeout):
+            raise PipelineTimeout("no result within %r seconds" % (timeout,))
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _resolve(self, result=None, exc_info=None):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                # Report it, but keep the connection thread going
+                sys.excepthook(*sys.exc_info())
+
+class PipelinedClient(object):
+    """Issue memcached operations without blocking the calling thread.
+
+    Every method returns a :class:`Future` straight away. The operations
+    are queued and run by a small, fixed number of connection threads,
+    each with its own clone of *mc*. A connection thread takes everything
+    that queued up while it was busy, up to *max_batch* operations, and
+    coalesces them: runs of gets become a single ``get_multi`` and runs of
+    sets with the same expiry time a single ``set_multi``, so hundreds of
+    lookups issued in one tick of an event loop cost a handful of round
+    trips rather than a thread each.
+
+    Each connection thread runs what it took in queue order, and
+    coalescing never moves a read past a write; with several connections,
+    wait on a write's future before relying on it elsewhere.
+
+    >>> from pylibmc.test import make_test_client
+    >>> mc = make_test_client()
+    >>> pmc = PipelinedClient(mc, connections=2)
+    >>> pmc.set("hi", "ho").result()
+    True
+    >>> futures = [pmc.get("hi") for i in range(10)]
+    >>> [f.result() for f in futures] == ["ho"] * 10
+    True
+    >>> pmc.delete("hi").result()
+    True
+    >>> pmc.close()
+    """
+
+    def __init__(self, mc, connections=2, max_batch=256):
+        self.max_batch = max_batch
+        self._queue = Queue()
+        self._closed = False
+        self._threads = []
+        for i in xrange(connections):
+            thread = threading.Thread(target=self._run, args=(mc.clone(),),
+                                      name="pylibmc-pipeline-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _submit(self, name, *args, **kwds):
+        if self._closed:
+            raise RuntimeError("pipelined client is closed")
+        future = Future()
+        self._queue.put((name, args, kwds, future))
+        return future
+
+    # {{{ Operations
+    def get(self, key):
+        return self._submit("get", key)
+
+    def get_multi(self, keys, key_prefix=None):
+        return self._submit("get_multi", list(keys), key_prefix=key_prefix)
+
+    def gets(self, key):
+        return self._submit("gets", key)
+
+    def set(self, key, value, time=0, **kwds):
+        return self._submit("set", key, value, time=time, **kwds)
+
+    def set_multi(self, mapping, time=0, key_prefix=None, **kwds):
+        return self._submit("set_multi", dict(mapping), time=time,
+                            key_prefix=key_prefix, **kwds)
+
+    def add(self, key, value, time=0, **kwds):
+        return self._submit("add", key, value, time=time, **kwds)
+
+    def delete(self, key):
+        return self._submit("delete", key)
+
+    def incr(self, key, delta=1):
+        return self._submit("incr", key, delta)
+
+    def decr(self, key, delta=1):
+        return self._submit("decr", key, delta)
+
+    def cas(self, key, value, cas, time=0):
+        return self._submit("cas", key, value, cas, time=time)
+    # }}}
+
+    def close(self):
+        """Finish the queued operations and stop the connection threads."""
+        if self._closed:
+            return
+        self._closed = True
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    # {{{ Connection threads
+    def _run(self, mc):
+        try:
+            stop = False
+            while not stop:
+                batch = [self._queue.get()]
+                while batch[-1] is not None and len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except Empty:
+                        break
+                if batch[-1] is None:
+                    stop = True
+                    batch.pop()
+                self._run_batch(mc, batch)
+        finally:
+            mc.disconnect_all()
+
+    def _run_batch(self, mc, batch):
+        run = []
+        for op in batch:
+            if run and _kind(op) != _kind(run[-1]):
+                self._run_ops(mc, run)
+                run = []
+            run.append(op)
+        if run:
+            self._run_ops(mc, run)
+
+    def _run_ops(self, mc, ops):
+        kind = _kind(ops[0])
+        if kind == "read" and len(ops) > 1:
+            _run_reads(mc, ops)
+        elif kind[0] == "write" and len(ops) > 1:
+            _run_writes(mc, ops, kind[1])
+        else:
+            for name, args, kwds, future in ops:
+                _call(future, getattr(mc, name), *args, **kwds)
+    # }}}
+
+def _kind(op):
+    name, args, kwds, future = op
+    if name in _read_ops and not kwds.get("key_prefix"):
+        return "read"
+    if name in _write_ops and not kwds.get("key_prefix") and \
+            set(kwds).issubset(("time", "key_prefix")):
+        # Writes with different expiry times go in separate runs
+        return ("write", kwds.get("time", 0))
+    return name
+
+def _call(future, fn, *args, **kwds):
+    try:
+        rv = fn(*args, **kwds)
+    except Exception:
+        future._resolve(exc_info=sys.exc_info())
+    else:
+        future._resolve(rv)
+
+def _fail(ops):
+    exc_info = sys.exc_info()
+    for name, args, kwds, future in ops:
+        future._resolve(exc_info=exc_info)
+
+def _run_reads(mc, ops):
+    keys = set()
+    for name, args, kwds, future in ops:
+        if name == "get":
+            keys.add(args[0])
+        else:
+            keys.update(args[0])
+    try:
+        found = mc.get_multi(list(keys))
+    except Exception:
+        return _fail(ops)
+    for name, args, kwds, future in ops:
+        if name == "get":
+            future._resolve(found.get(args[0]))
+        else:
+            future._resolve(dict((k, found[k]) for k in args[0] if k in found))
+
+def _run_writes(mc, ops, time):
+    # Later writes to a key win, as they would have run last
+    mapping = {}
+    for name, args, kwds, future in ops:
+        if name == "set":
+            mapping[args[0]] = args[1]
+        else:
+            mapping.update(args[0])
+    try:
+        failed = set(mc.set_multi(mapping, time=time))
+    except Exception:
+        return _fail(ops)
+    for name, args, kwds, future in ops:
+        if name == "set":
+            future._resolve(args[0] not in failed)
+        else:
+            future._resolve([k for k in args[0] if k in failed])
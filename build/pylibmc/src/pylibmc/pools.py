@@ -2,8 +2,25 @@
 
 from __future__ import with_statement
 
+import threading
 from contextlib import contextmanager
-from Queue import Queue
+from time import time
+from Queue import Queue, Empty
+
+import _pylibmc
+
+# This makes sure ThreadMappedPool doesn't exist with non-thread Pythons.
+try:
+    import thread
+except ImportError:
+    thread = None
+
+#: Errors after which a client's connections can't be trusted any more
+_connection_errors = tuple(exc for (name, exc) in _pylibmc.exceptions
+                           if name in ("ConnectionError", "WriteError",
+                                       "ReadError", "UnknownReadFailure",
+                                       "ProtocolError", "SocketCreateError",
+                                       "ServerDead", "ServerDown"))
 
 class ClientPool(Queue):
     """Client pooling helper.
@@ -32,13 +49,15 @@ class ClientPool(Queue):
             self.fill(mc, n_slots)
 
     @contextmanager
-    def reserve(self, block=False):
+    def reserve(self, block=False, timeout=None):
         """Context manager for reserving a client from the pool.
 
         If *block* is given and the pool is exhausted, the pool waits for
-        another thread to fill it before returning.
+        another thread to fill it before returning, for at most *timeout*
+        seconds if given. ``Queue.Empty`` is raised when no client could be
+        had.
         """
-        mc = self.get(block)
+        mc = self.get(block, timeout)
         try:
             yield mc
         finally:
@@ -59,9 +78,17 @@ class ThreadMappedPool(dict):
     If a client is reserved, this class checks for a key based on the current
     thread, and if none exists, clones the master client and inserts that key.
 
-    Of course this requires that you let the pool know when a thread is done
-    with its reserved instance, so therefore ``relinquish`` must be called
-    before thread exit.
+    Threads should let the pool know when they are done with their client
+    by calling ``relinquish`` before they exit. Clients of threads that
+    exited without doing so are reclaimed on an explicit call to
+    ``reclaim``, and, unless *auto_reclaim* is false, each time the pool
+    has to clone a new client.
+
+    A thread is taken to have exited when ``threading.enumerate`` doesn't
+    list it. Threads started outside the ``threading`` module, e.g. by
+    mod_wsgi or other C code, are never listed, so their clients would be
+    dropped by every reclaim and reconnected on their next reservation;
+    pass ``auto_reclaim=False`` when such threads use the pool.
 
     >>> from pylibmc.test import make_test_client
     >>> mc = make_test_client()
@@ -74,11 +101,12 @@ class ThreadMappedPool(dict):
     True
     """
 
-    def __new__(cls, master):
+    def __new__(cls, master, auto_reclaim=True):
         return super(ThreadMappedPool, cls).__new__(cls)
 
-    def __init__(self, master):
+    def __init__(self, master, auto_reclaim=True):
         self.master = master
+        self.auto_reclaim = auto_reclaim
 
     @property
     def current_key(self):
@@ -94,6 +122,8 @@ class ThreadMappedPool(dict):
         key = self.current_key
         mc = self.pop(key, None)
         if mc is None:
+            if self.auto_reclaim:
+                self.reclaim()
             mc = self.master.clone()
         try:
             yield mc
@@ -108,8 +138,215 @@ class ThreadMappedPool(dict):
         """
         return self.pop(self.current_key, None)
 
-# This makes sure ThreadMappedPool doesn't exist with non-thread Pythons.
-try:
-    import thread
-except ImportError:
+    def reclaim(self):
+        """Disconnect and drop the clients of threads that have exited.
+
+        Returns the number of clients reclaimed.
+        """
+        alive = set(t.ident for t in threading.enumerate())
+        reclaimed = 0
+        for key in self.keys():
+            if key not in alive:
+                mc = self.pop(key, None)
+                if mc is not None:
+                    mc.disconnect_all()
+                    reclaimed += 1
+        return reclaimed
+
+if thread is None:
     ThreadMappedPool = None
+
+class BoundedPool(ClientPool):
+    """A client pool of bounded size that grows on demand.
+
+    Clients are cloned from *master* as they are needed, up to *max_size*
+    of them; once they're all reserved, ``reserve`` waits up to *timeout*
+    seconds for one to come back and then raises ``Queue.Empty``. The most
+    recently returned client is handed out first, so under light load the
+    spare ones sit idle, and those idle for over *max_idle* seconds are
+    disconnected and dropped, down to *min_size* clients.
+
+    A client whose reservation ended in a connection error is disconnected
+    and replaced rather than handed to the next thread. Clients idle for
+    over *check_idle* seconds are checked with a cheap request before being
+    handed out again, and replaced if it fails.
+
+    ``stats`` reports gauges for sizing the pool, e.g. for the number of
+    threads of a threaded gunicorn worker.
+
+    >>> from pylibmc.test import make_test_client
+    >>> mc = make_test_client()
+    >>> pool = BoundedPool(mc, max_size=4, timeout=1)
+    >>> with pool.reserve() as mc:
+    ...     mc.set("hi", "ho")
+    ...     mc.delete("hi")
+    ...
+    True
+    True
+    >>> pool.stats()["size"]
+    1
+    """
+
+    #: Key fetched to check that an idle client's connection still works
+    check_key = "_pylibmc_pool_check"
+
+    def __init__(self, master, max_size=10, min_size=0, timeout=None,
+                 max_idle=None, check_idle=30):
+        Queue.__init__(self, max_size)
+        self.master = master
+        self.max_size = max_size
+        self.min_size = min_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_idle = check_idle
+        self.size = 0
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    # {{{ Queue internals: a stack of (client, idle since) pairs
+    def _init(self, maxsize):
+        self.queue = []
+        self._evicted = []
+
+    def _qsize(self, len=len):
+        return len(self.queue)
+
+    def _put(self, mc):
+        self.queue.append((mc, time()))
+
+    def _get(self):
+        # Called with the queue's mutex held, so only note what to evict
+        if self.max_idle is not None:
+            cutoff = time() - self.max_idle
+            while (len(self.queue) > 1 and self.size > self.min_size
+                   and self.queue[0][1] < cutoff):
+                self._evicted.append(self.queue.pop(0)[0])
+                self.size -= 1
+        return self.queue.pop()
+    # }}}
+
+    def fill(self, mc, n_slots):
+        """Fill *n_slots* of the pool with clones of *mc*."""
+        with self.mutex:
+            self.size += n_slots
+        ClientPool.fill(self, mc, n_slots)
+
+    def _acquire(self, block, timeout):
+        try:
+            return self.get(False)
+        except Empty:
+            pass
+        with self.mutex:
+            grow = self.size < self.max_size
+            if grow:
+                self.size += 1
+        if grow:
+            try:
+                return (self.master.clone(), time())
+            except:
+                with self.mutex:
+                    self.size -= 1
+                raise
+        if not block:
+            raise Empty
+        return self.get(True, timeout)
+
+    def _check(self, mc):
+        try:
+            mc.get(self.check_key)
+        except _connection_errors:
+            return False
+        return True
+
+    @contextmanager
+    def reserve(self, block=True, timeout=None):
+        """Reserve a client, waiting at most *timeout* seconds for one.
+
+        *timeout* defaults to the pool's. Raises ``Queue.Empty`` if no
+        client became free in time, or straight away if *block* is false.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        started = time()
+        try:
+            mc, idle_since = self._acquire(block, timeout)
+        except Empty:
+            self._record(time() - started, timed_out=True)
+            raise
+        finally:
+            for evicted in self._pop_evicted():
+                evicted.disconnect_all()
+
+        if (self.check_idle is not None and
+                started - idle_since > self.check_idle and
+                not self._check(mc)):
+            mc.disconnect_all()
+            mc = self.master.clone()
+        self._record(time() - started)
+
+        try:
+            yield mc
+        except _connection_errors:
+            # Hand the next thread fresh connections instead
+            mc.disconnect_all()
+            self.put(self.master.clone())
+            raise
+        except:
+            self.put(mc)
+            raise
+        else:
+            self.put(mc)
+        finally:
+            with self._stats_lock:
+                self._in_use -= 1
+
+    def _pop_evicted(self):
+        with self.mutex:
+            evicted, self._evicted = self._evicted, []
+        if evicted:
+            with self._stats_lock:
+                self._stats["evicted"] += len(evicted)
+        return evicted
+
+    # {{{ Gauges
+    def _record(self, waited, timed_out=False):
+        with self._stats_lock:
+            stats = self._stats
+            stats["wait_time"] += waited
+            stats["max_wait_time"] = max(stats["max_wait_time"], waited)
+            if timed_out:
+                stats["timeouts"] += 1
+            else:
+                stats["reservations"] += 1
+                self._in_use += 1
+                stats["max_in_use"] = max(stats["max_in_use"], self._in_use)
+
+    def reset_stats(self):
+        """Reset the counters reported by ``stats``."""
+        with self._stats_lock:
+            self._in_use = getattr(self, "_in_use", 0)
+            self._stats = {"reservations": 0, "timeouts": 0, "evicted": 0,
+                           "wait_time": 0.0, "max_wait_time": 0.0,
+                           "max_in_use": self._in_use}
+
+    def stats(self):
+        """Gauges and counters for sizing the pool.
+
+        *size* is the number of clients, *in_use* the number reserved and
+        *utilization* the share of *max_size* reserved. *mean_wait_time*
+        and *max_wait_time* are in seconds, counted with *reservations*,
+        *timeouts*, *evicted* and *max_in_use* since the last
+        ``reset_stats``.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["in_use"] = self._in_use
+        stats["size"] = self.size
+        stats["max_size"] = self.max_size
+        stats["idle"] = self.qsize()
+        stats["utilization"] = float(stats["in_use"]) / self.max_size
+        attempts = stats["reservations"] + stats["timeouts"]
+        stats["mean_wait_time"] = (stats["wait_time"] / attempts
+                                   if attempts else 0.0)
+        return stats
+    # }}}
@@ -28,3 +28,4 @@ def dump_infos():
     print "Reported libmemcached version:", _pylibmc.libmemcached_version
     print "Reported pylibmc version:", _pylibmc.__version__
     print "Support compression:", _pylibmc.support_compression
+    print "Support lz4:", _pylibmc.support_lz4
@@ -34,6 +34,64 @@ class ClientTests(PylibmcTestCase):
             if rv == 10:
                 break
 
+    def test_serializer(self):
+        calls = []
+        def serialize(value):
+            calls.append(value)
+            return repr(value)
+        mc = make_test_client(serializer=serialize, deserializer=eval)
+        ok_(mc.set("serialized", {"a": [1, 2]}))
+        eq_(calls, [{"a": [1, 2]}])
+        eq_(mc.get("serialized"), {"a": [1, 2]})
+        eq_(mc.get_multi(["serialized"]), {"serialized": {"a": [1, 2]}})
+        # Native types don't go through the serializer
+        ok_(mc.set("native", 1))
+        eq_(len(calls), 1)
+        eq_(mc.clone().get("serialized"), {"a": [1, 2]})
+
+    def test_serializer_mixed_clients(self):
+        mc = make_test_client(serializer=repr, deserializer=eval)
+        ok_(self.mc.set("pickled", [1]))
+        eq_(mc.get("pickled"), [1])
+        ok_(mc.set("serialized", [2]))
+        self.assertRaises(pylibmc.Error, self.mc.get, "serialized")
+
+    def test_lz4_compression(self):
+        if not pylibmc.support_lz4:
+            raise SkipTest
+        value = "<p>Lorem ipsum</p>" * 1000
+        mc = make_test_client(compression="lz4")
+        ok_(mc.set("lz4", value, min_compress_len=1))
+        eq_(mc.get("lz4"), value)
+        # Clients compressing with zlib decode it too
+        eq_(self.mc.get("lz4"), value)
+
+    def test_min_compress_ratio(self):
+        if not pylibmc.support_compression:
+            raise SkipTest
+        self.assertRaises(ValueError, make_test_client,
+                          min_compress_ratio=1.0)
+        # zlib shrinks this to about 2% of its size
+        value = "a" * 1000
+        stored_bytes = lambda: sum(int(stats["bytes"])
+                                   for server, stats in self.mc.get_stats())
+
+        # Too high a ratio to reach: the value is stored as is, so
+        # appending to it keeps it readable
+        mc = make_test_client(min_compress_ratio=0.999)
+        ok_(mc.set("ratio", value, min_compress_len=1))
+        eq_(mc.get("ratio"), value)
+        ok_(mc.append("ratio", "tail"))
+        eq_(mc.get("ratio"), value + "tail")
+        uncompressed = stored_bytes()
+
+        # A reachable one: the value is stored compressed, in far fewer
+        # bytes
+        mc = make_test_client(min_compress_ratio=0.5)
+        ok_(mc.set("ratio", value, min_compress_len=1))
+        eq_(mc.get("ratio"), value)
+        ok_(uncompressed - stored_bytes() > 900)
+
     def testBehaviors(self):
         expected_behaviors = [
             'auto_eject', 'buffer_requests', 'cas', 'connect_timeout',
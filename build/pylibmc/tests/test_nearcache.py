@@ -0,0 +1,77 @@
+import time
+import pylibmc
+from nose.tools import eq_, ok_
+from tests import PylibmcTestCase
+
+class NearCacheTestCase(PylibmcTestCase):
+    def setUp(self):
+        super(NearCacheTestCase, self).setUp()
+        self.mc.delete("pylibmc:near-cache:version")
+        self.store = pylibmc.LRUStore()
+        self.nc = pylibmc.NearCache(self.mc, self.store, ttl=60)
+
+class NearCacheTests(NearCacheTestCase):
+    def test_hit(self):
+        ok_(self.nc.set("a", {"b": 1}))
+        eq_(self.nc.get("a"), {"b": 1})
+        eq_(self.nc.get("a"), {"b": 1})
+        stats = self.nc.stats()
+        eq_(stats["hits"], 1)
+        eq_(stats["misses"], 1)
+        eq_(stats["items"], 1)
+
+    def test_copies(self):
+        ok_(self.nc.set("a", [1]))
+        self.nc.get("a").append(2)
+        eq_(self.nc.get("a"), [1])
+
+    def test_get_multi(self):
+        ok_(self.nc.set_multi({"a": "1", "b": "2"}) == [])
+        eq_(self.nc.get_multi(["a", "b", "c"]), {"a": "1", "b": "2"})
+        eq_(self.nc.get_multi(["a", "b", "c"]), {"a": "1", "b": "2"})
+        eq_(self.nc.stats()["hits"], 2)
+
+    def test_ttl(self):
+        nc = pylibmc.NearCache(self.mc, self.store, ttl=lambda key: 0.01)
+        ok_(nc.set("a", "1"))
+        nc.get("a")
+        time.sleep(0.02)
+        nc.get("a")
+        eq_(self.store.stats()["expirations"], 1)
+
+    def test_lru_budget(self):
+        store = pylibmc.LRUStore(max_items=2, max_bytes=10)
+        nc = pylibmc.NearCache(self.mc, store, ttl=60)
+        ok_(nc.set_multi({"a": "1", "b": "2", "c": "3", "big": "x" * 11})
+            == [])
+        for key in ("a", "b", "c", "big"):
+            nc.get(key)
+        eq_(store.stats()["items"], 2)
+        eq_(store.stats()["evictions"], 1)
+        nc.get("c")
+        eq_(store.stats()["hits"], 1)
+
+    def test_coherence(self):
+        other = pylibmc.NearCache(self.mc.clone(), pylibmc.LRUStore(),
+                                  ttl=60, check_interval=0)
+        ok_(self.nc.set("a", "1"))
+        eq_(other.get("a"), "1")
+        ok_(self.nc.set("a", "2"))
+        eq_(other.get("a"), "2")
+        eq_(other.stats()["invalidations"], 2)
+
+    def test_unversioned_writes(self):
+        nc = pylibmc.NearCache(self.mc, self.store, ttl=60,
+                               versioned=lambda key: key != "page")
+        ok_(nc.set("page", "1"))
+        eq_(self.mc.get("pylibmc:near-cache:version"), None)
+        ok_(nc.set("gen", "1"))
+        ok_(self.mc.get("pylibmc:near-cache:version"))
+
+    def test_not_near(self):
+        nc = pylibmc.NearCache(self.mc, self.store, ttl=60,
+                               near=lambda key: key != "cold")
+        ok_(nc.set("cold", "1"))
+        eq_(nc.get("cold"), "1")
+        eq_(nc.get("cold"), "1")
+        eq_(self.store.stats()["items"], 0)
@@ -0,0 +1,65 @@
+from __future__ import with_statement
+
+import pylibmc
+from pylibmc.pipeline import PipelineTimeout, Future
+from nose.tools import eq_, ok_
+from tests import PylibmcTestCase
+
+class PipelineTestCase(PylibmcTestCase):
+    def setUp(self):
+        super(PipelineTestCase, self).setUp()
+        self.pmc = pylibmc.PipelinedClient(self.mc, connections=2)
+
+    def tearDown(self):
+        self.pmc.close()
+        super(PipelineTestCase, self).tearDown()
+
+class PipelinedClientTests(PipelineTestCase):
+    def test_simple(self):
+        ok_(self.pmc.set("a", 1).result())
+        eq_(self.pmc.get("a").result(), 1)
+        eq_(self.pmc.incr("a", 2).result(), 3)
+        ok_(self.pmc.delete("a").result())
+        eq_(self.pmc.get("a").result(), None)
+
+    def test_coalesced_reads(self):
+        ok_(self.pmc.set_multi({"a": 1, "b": 2}).result() == [])
+        futures = [self.pmc.get(k) for k in "abc" * 50]
+        multi = self.pmc.get_multi(["a", "c"])
+        eq_([f.result() for f in futures], [1, 2, None] * 50)
+        eq_(multi.result(), {"a": 1})
+
+    def test_writes_keep_order(self):
+        # Order only holds within one connection's thread
+        pmc = pylibmc.PipelinedClient(self.mc, connections=1)
+        for i in range(100):
+            pmc.set("counter", i)
+        pmc.close()
+        eq_(self.mc.get("counter"), 99)
+
+    def test_cas(self):
+        mc = self.mc.clone()
+        mc.behaviors = {"cas": True}
+        pmc = pylibmc.PipelinedClient(mc, connections=1)
+        try:
+            ok_(pmc.set("c", 0).result())
+            value, cas = pmc.gets("c").result()
+            ok_(pmc.cas("c", value + 1, cas).result())
+            ok_(not pmc.cas("c", value + 2, cas).result())
+        finally:
+            pmc.close()
+
+    def test_errors_are_raised(self):
+        self.assertRaises(pylibmc.NotFound,
+                          self.pmc.incr("nonexistent").result)
+
+    def test_callback(self):
+        results = []
+        future = self.pmc.set("a", "b")
+        future.add_done_callback(lambda f: results.append(f.result()))
+        future.result()
+        self.pmc.close()
+        eq_(results, [True])
+
+    def test_timeout(self):
+        self.assertRaises(PipelineTimeout, Future().result, 0.01)
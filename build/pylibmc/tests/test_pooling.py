@@ -1,6 +1,7 @@
 from __future__ import with_statement
 
 import Queue
+import threading
 import pylibmc
 from nose.tools import eq_, ok_
 from tests import PylibmcTestCase
@@ -22,4 +23,98 @@ class ClientPoolTests(PoolTestCase):
             with p.reserve() as smc2:
                 self.assertRaises(Queue.Empty, p.reserve().__enter__)
 
-# TODO Thread-mapped pool tests
+    def test_exhaust_timeout(self):
+        p = pylibmc.ClientPool(self.mc, 1)
+        with p.reserve() as smc:
+            self.assertRaises(Queue.Empty, p.reserve(True, 0.01).__enter__)
+
+class ThreadMappedPoolTests(PoolTestCase):
+    def test_simple(self):
+        p = pylibmc.ThreadMappedPool(self.mc)
+        with p.reserve() as smc:
+            ok_(smc.set("a", 1))
+            eq_(smc["a"], 1)
+        eq_(len(p), 1)
+        ok_(p.relinquish())
+        eq_(len(p), 0)
+
+    def test_reclaim_dead_threads(self):
+        p = pylibmc.ThreadMappedPool(self.mc)
+        reserved = threading.Semaphore(0)
+        done = threading.Event()
+        def use():
+            with p.reserve() as smc:
+                smc.set("a", 1)
+            reserved.release()
+            done.wait()
+        threads = [threading.Thread(target=use) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            reserved.acquire()
+        # Live threads keep their clients
+        eq_(len(p), 3)
+        eq_(p.reclaim(), 0)
+        eq_(len(p), 3)
+        done.set()
+        for t in threads:
+            t.join()
+        eq_(p.reclaim(), 3)
+        eq_(len(p), 0)
+
+    def test_no_auto_reclaim(self):
+        p = pylibmc.ThreadMappedPool(self.mc, auto_reclaim=False)
+        def use():
+            with p.reserve() as smc:
+                smc.set("a", 1)
+        t = threading.Thread(target=use)
+        t.start()
+        t.join()
+        # The main thread's reservation doesn't drop the dead thread's client
+        with p.reserve() as smc:
+            pass
+        eq_(len(p), 2)
+        eq_(p.reclaim(), 1)
+        eq_(len(p), 1)
+
+class BoundedPoolTests(PoolTestCase):
+    def test_lazy_growth(self):
+        p = pylibmc.BoundedPool(self.mc, max_size=2)
+        eq_(p.stats()["size"], 0)
+        with p.reserve() as smc:
+            ok_(smc.set("a", 1))
+            eq_(p.stats()["utilization"], 0.5)
+        with p.reserve() as smc:
+            eq_(smc["a"], 1)
+        eq_(p.stats()["size"], 1)
+
+    def test_exhaust_timeout(self):
+        p = pylibmc.BoundedPool(self.mc, max_size=2, timeout=0.01)
+        with p.reserve() as smc1:
+            with p.reserve() as smc2:
+                self.assertRaises(Queue.Empty, p.reserve().__enter__)
+        stats = p.stats()
+        eq_(stats["timeouts"], 1)
+        eq_(stats["max_in_use"], 2)
+        ok_(stats["max_wait_time"] >= 0.01)
+
+    def test_idle_eviction(self):
+        p = pylibmc.BoundedPool(self.mc, max_size=2, max_idle=0)
+        with p.reserve() as smc1:
+            with p.reserve() as smc2:
+                pass
+        with p.reserve() as smc:
+            pass
+        eq_(p.stats()["size"], 1)
+        eq_(p.stats()["evicted"], 1)
+
+    def test_connection_error_replaces_client(self):
+        p = pylibmc.BoundedPool(self.mc, max_size=1)
+        try:
+            with p.reserve() as smc:
+                raise pylibmc.ConnectionError("gone")
+        except pylibmc.ConnectionError:
+            pass
+        with p.reserve() as smc2:
+            ok_(smc2 is not smc)
+        eq_(p.stats()["size"], 1)
@@ -1,5 +1,5 @@
 from nose.tools import eq_
-from pylibmc.client import translate_server_spec
+from pylibmc.client import translate_server_spec, translate_server_specs
 import _pylibmc
 
 def test_translate():
@@ -30,3 +30,9 @@ def test_udp_translate_ipv6_with_weight():
     eq_(translate_server_spec("udp:[abcd:abcd::1]:5555:2"),
         (_pylibmc.server_type_udp, "abcd:abcd::1", 5555, 2))
 
+def test_translate_specs_with_weights():
+    eq_(translate_server_specs(["111.122.133.144:5555:2",
+                                (_pylibmc.server_type_tcp, "111.122.133.145",
+                                 5555, 3)]),
+        [(_pylibmc.server_type_tcp, "111.122.133.144", 5555, 2),
+         (_pylibmc.server_type_tcp, "111.122.133.145", 5555, 3)])